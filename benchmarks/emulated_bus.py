@@ -0,0 +1,276 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+An in-memory stand-in for the bus and storage services.
+
+EmulatedBus is a real commissaire_http.bus.Bus, so request metrics and
+stage timings are recorded as usual, but requests are answered from
+memory after a configurable latency instead of going through a broker.
+"""
+
+import random
+import re
+import threading
+import time
+
+from commissaire import bus as _bus
+from commissaire import models
+from commissaire.bus import BusMixin
+
+from commissaire_http.bus import Bus
+
+
+class _Responder(BusMixin):
+    """
+    Answers requests in place of the broker. Bus.request calls this
+    request through super() since _Responder follows Bus in the MRO of
+    EmulatedBus.
+    """
+
+    def request(self, routing_key, method=None, params=None, **kwargs):
+        """
+        Waits for the emulated latency and answers the request.
+
+        :param routing_key: Routing key for the request.
+        :type routing_key: str
+        :param method: Ignored.
+        :type method: str or None
+        :param params: Ignored.
+        :type params: list or dict or None
+        :param kwargs: Ignored.
+        :type kwargs: dict
+        :returns: The jsonrpc response.
+        :rtype: dict
+        """
+        self.delay()
+        return {'jsonrpc': '2.0', 'id': None, 'result': {}}
+
+
+class EmulatedBus(Bus, _Responder):
+    """
+    A Bus whose requests and storage are served from memory.
+    """
+
+    def __init__(self, latency=0.001, jitter=0.0, seed=None):
+        """
+        Initializes a new EmulatedBus instance.
+
+        :param latency: Average seconds each bus or storage request takes.
+        :type latency: float
+        :param jitter: Seconds the latency varies by in either direction.
+        :type jitter: float
+        :param seed: Seed of the latency jitter.
+        :type seed: int or None
+        """
+        super(EmulatedBus, self).__init__('commissaire', 'memory://', [])
+        self.latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self.storage = MemoryStorage(self)
+
+    @property
+    def connected(self):
+        """
+        Returns True since there is no connection to lose.
+
+        :returns: True
+        :rtype: bool
+        """
+        return True
+
+    def connect(self):
+        """
+        Does nothing since there is no broker to connect to.
+
+        :returns: The same instance.
+        :rtype: EmulatedBus
+        """
+        return self
+
+    def ping(self, timeout=2.0):
+        """
+        Waits for the emulated latency.
+
+        :param timeout: Ignored.
+        :type timeout: float
+        """
+        self.delay()
+
+    def delay(self):
+        """
+        Sleeps for the latency of one request.
+        """
+        delay = self.latency
+        if self.jitter:
+            delay += self._random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class MemoryStorage:
+    """
+    Stand-in for commissaire.storage.client.StorageClient keeping models
+    in memory. Each call makes one request on the bus so it takes the
+    emulated latency and is recorded like a real storage request.
+    """
+
+    #: Turns the name of a typed getter, such as get_host, into a class
+    _typed_getter = re.compile(r'^get_([a-z_]+)$')
+
+    def __init__(self, bus):
+        """
+        Initializes a new, empty, MemoryStorage instance.
+
+        :param bus: The bus storage requests are made on.
+        :type bus: EmulatedBus
+        """
+        self.bus = bus
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        """
+        Provides typed getters such as get_host(address).
+
+        :param name: The name of the getter.
+        :type name: str
+        :returns: The getter.
+        :rtype: callable
+        :raises: AttributeError
+        """
+        match = self._typed_getter.match(name)
+        model_class = None
+        if match:
+            model_class = getattr(models, ''.join(
+                part.title() for part in match.group(1).split('_')), None)
+        if model_class is None:
+            raise AttributeError(name)
+
+        def getter(key):
+            return self.get(model_class.new(
+                **{model_class._primary_key: key}))
+        return getter
+
+    def _key(self, model_instance):
+        """
+        Returns the storage key of a model.
+
+        :param model_instance: The model.
+        :type model_instance: commissaire.models.Model
+        :returns: The class name and primary key.
+        :rtype: tuple
+        """
+        return type(model_instance).__name__, model_instance.primary_key
+
+    def get(self, model_instance):
+        """
+        Gets a stored model.
+
+        :param model_instance: A model with the primary key set.
+        :type model_instance: commissaire.models.Model
+        :returns: The stored model.
+        :rtype: commissaire.models.Model
+        :raises: commissaire.bus.StorageLookupError
+        """
+        self.bus.request('storage.get')
+        try:
+            return self._models[self._key(model_instance)]
+        except KeyError:
+            raise _bus.StorageLookupError(
+                'No {} with key {}'.format(*self._key(model_instance)))
+
+    def get_many(self, list_of_model_instances):
+        """
+        Gets stored models in one request.
+
+        :param list_of_model_instances: Models with the primary key set.
+        :type list_of_model_instances: list
+        :returns: The stored models which exist.
+        :rtype: list
+        """
+        self.bus.request('storage.get_many')
+        found = (self._models.get(self._key(model_instance))
+                 for model_instance in list_of_model_instances)
+        return [model_instance for model_instance in found
+                if model_instance is not None]
+
+    def save(self, model_instance):
+        """
+        Stores a model.
+
+        :param model_instance: The model to store.
+        :type model_instance: commissaire.models.Model
+        :returns: The stored model.
+        :rtype: commissaire.models.Model
+        """
+        self.bus.request('storage.save')
+        self.put(model_instance)
+        return model_instance
+
+    def save_many(self, list_of_model_instances):
+        """
+        Stores models in one request.
+
+        :param list_of_model_instances: The models to store.
+        :type list_of_model_instances: list
+        :returns: The stored models.
+        :rtype: list
+        """
+        self.bus.request('storage.save_many')
+        for model_instance in list_of_model_instances:
+            self.put(model_instance)
+        return list_of_model_instances
+
+    def delete(self, model_instance):
+        """
+        Deletes a stored model.
+
+        :param model_instance: A model with the primary key set.
+        :type model_instance: commissaire.models.Model
+        :raises: commissaire.bus.StorageLookupError
+        """
+        self.bus.request('storage.delete')
+        with self._lock:
+            try:
+                del self._models[self._key(model_instance)]
+            except KeyError:
+                raise _bus.StorageLookupError(
+                    'No {} with key {}'.format(*self._key(model_instance)))
+
+    def list(self, model_class):
+        """
+        Lists all stored models of a list model's item class.
+
+        :param model_class: A list model class such as models.Hosts.
+        :type model_class: type
+        :returns: The list model.
+        :rtype: commissaire.models.Model
+        """
+        self.bus.request('storage.list')
+        name = model_class._list_class.__name__
+        with self._lock:
+            items = [model_instance for key, model_instance
+                     in self._models.items() if key[0] == name]
+        return model_class.new(**{model_class._list_attr: items})
+
+    def put(self, model_instance):
+        """
+        Stores a model without a bus request, such as to seed the storage.
+
+        :param model_instance: The model to store.
+        :type model_instance: commissaire.models.Model
+        """
+        with self._lock:
+            self._models[self._key(model_instance)] = model_instance
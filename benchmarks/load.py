@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Load test of the server's own overhead.
+
+Runs the real CommissaireHttpServer, Dispatcher and AuthenticationManager
+stack in this process against an emulated bus and storage with a
+configurable latency, drives a mix of requests over the hosts, clusters,
+networks and cluster operations routes, and reports throughput and
+latency percentiles as JSON. Reports of two commits can be compared with
+--baseline.
+
+Clients run in the same process as the server, so results are only
+comparable between runs on the same machine with the same options.
+
+Example: python3 benchmarks/load.py --duration 30 --output after.json \
+    --baseline before.json
+"""
+
+import argparse
+import base64
+import bisect
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from http.client import HTTPConnection, RemoteDisconnected
+
+import bcrypt
+
+from commissaire import models
+
+from commissaire_http import CommissaireHttpServer
+from commissaire_http.aio import AsyncCommissaireHttpServer
+from commissaire_http.authentication import AuthenticationManager
+from commissaire_http.authentication.httpbasicauth import HTTPBasicAuth
+from commissaire_http.dispatcher import Dispatcher
+from commissaire_http.router import Router
+from commissaire_http.server.routing import connect_routes
+
+from emulated_bus import EmulatedBus
+
+#: User and password the clients authenticate with
+USER, PASSWORD = 'bench', 'bench'
+
+#: Requests as (name, weight, method, path, body). Paths and bodies are
+#: formatted with a cluster, an address of one of its hosts and a network
+#: which exist.
+REQUEST_MIX = (
+    ('list_hosts', 10, 'GET', '/api/v0/hosts/', None),
+    ('get_host', 20, 'GET', '/api/v0/host/{address}/', None),
+    ('get_host_status', 5, 'GET', '/api/v0/host/{address}/status/', None),
+    ('list_clusters', 10, 'GET', '/api/v0/clusters/', None),
+    ('get_cluster', 15, 'GET', '/api/v0/cluster/{cluster}/', None),
+    ('list_cluster_members', 5, 'GET', '/api/v0/cluster/{cluster}/hosts/',
+     None),
+    ('check_cluster_member', 5, 'GET',
+     '/api/v0/cluster/{cluster}/hosts/{address}/', None),
+    ('add_cluster_member', 2, 'PUT',
+     '/api/v0/cluster/{cluster}/hosts/{address}/', None),
+    ('list_networks', 5, 'GET', '/api/v0/networks/', None),
+    ('get_network', 10, 'GET', '/api/v0/network/{network}/', None),
+    ('create_network', 3, 'PUT', '/api/v0/network/{network}/',
+     {'name': '{network}', 'type': 'flannel_etcd', 'options': {}}),
+    ('get_cluster_deploy', 5, 'GET', '/api/v0/cluster/{cluster}/deploy',
+     None),
+    ('create_cluster_deploy', 5, 'PUT', '/api/v0/cluster/{cluster}/deploy',
+     {'version': '1.0'}),
+)
+
+
+def seed(storage, hosts, clusters, networks):
+    """
+    Fills the emulated storage.
+
+    :param storage: The storage to fill.
+    :type storage: emulated_bus.MemoryStorage
+    :param hosts: Number of hosts.
+    :type hosts: int
+    :param clusters: Number of clusters the hosts are spread over.
+    :type clusters: int
+    :param networks: Number of networks.
+    :type networks: int
+    :returns: The addresses, cluster names and network names.
+    :rtype: tuple
+    """
+    addresses = ['10.{}.{}.{}'.format(i // 65536, i // 256 % 256, i % 256)
+                 for i in range(hosts)]
+    cluster_names = ['cluster{}'.format(i) for i in range(clusters)]
+    network_names = ['network{}'.format(i) for i in range(networks)]
+    for address in addresses:
+        storage.put(models.Host.new(
+            address=address, status='active', os='rhel', cpus=4,
+            memory=8192, space=100000, last_check='2016-01-01T00:00:00'))
+        storage.put(models.HostCreds.new(
+            address=address, ssh_priv_key='', remote_user='root'))
+    for i, name in enumerate(cluster_names):
+        storage.put(models.Cluster.new(
+            name=name, status='ok', type='host_only',
+            network=network_names[i % networks],
+            hostset=addresses[i::clusters]))
+        storage.put(models.ClusterDeploy.new(
+            name=name, status='finished', version='1.0',
+            deployed=addresses[i::clusters], in_process=[],
+            started_at='2016-01-01T00:00:00',
+            finished_at='2016-01-01T00:01:00'))
+    for name in network_names:
+        storage.put(models.Network.new(
+            name=name, type='flannel_etcd', options={}))
+    return addresses, cluster_names, network_names
+
+
+def write_users_file(path, rounds):
+    """
+    Writes the users file of the basic authentication plugin.
+
+    :param path: Path of the file.
+    :type path: str
+    :param rounds: bcrypt cost of the password hash.
+    :type rounds: int
+    """
+    hashed = bcrypt.hashpw(
+        PASSWORD.encode(), bcrypt.gensalt(rounds)).decode()
+    with open(path, 'w') as users:
+        json.dump({USER: {'hash': hashed}}, users)
+
+
+def create_server(bus, users_file, args):
+    """
+    Creates the server stack used by commissaire-server.
+
+    :param bus: The bus handlers use.
+    :type bus: emulated_bus.EmulatedBus
+    :param users_file: Path of the users file.
+    :type users_file: str
+    :param args: The parsed command line arguments.
+    :type args: argparse.Namespace
+    :returns: The server and the port it listens on.
+    :rtype: tuple
+    """
+    dispatcher = Dispatcher(
+        connect_routes(Router(optional_slash=True)),
+        handler_packages=['commissaire_http.handlers'], lazy=True)
+    dispatcher._bus = bus
+    dispatcher.dispatch = AuthenticationManager(
+        dispatcher.dispatch,
+        authenticators=[HTTPBasicAuth(None, filepath=users_file)])
+
+    listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listen_socket.bind(('127.0.0.1', 0))
+    listen_socket.listen(max(128, args.concurrency * 2))
+    server_class = CommissaireHttpServer
+    if args.asyncio:
+        server_class = AsyncCommissaireHttpServer
+    server = server_class(
+        None, None, dispatcher, max_threads=args.threads,
+        max_queued=max(128, args.concurrency * 2),
+        listen_socket=listen_socket)
+    return server, listen_socket.getsockname()[1]
+
+
+def run_client(port, requests, deadline, seed, samples):
+    """
+    Sends requests on a persistent connection until the deadline.
+
+    :param port: Port of the server.
+    :type port: int
+    :param requests: Requests to send, in order, as (name, method, path,
+                     body, headers).
+    :type requests: list
+    :param deadline: time.perf_counter() to stop at.
+    :type deadline: float
+    :param seed: Seed of the order of the requests.
+    :type seed: int
+    :param samples: List to add (name, status, started, seconds) to.
+    :type samples: list
+    """
+    rng = random.Random(seed)
+    conn = HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        while time.perf_counter() < deadline:
+            name, method, path, body, headers = rng.choice(requests)
+            started = time.perf_counter()
+            status = send(conn, method, path, body, headers)
+            samples.append(
+                (name, status, started, time.perf_counter() - started))
+    finally:
+        conn.close()
+
+
+def send(conn, method, path, body, headers):
+    """
+    Sends a request and reads the response. The server may close a kept
+    connection between requests, so like other clients the request is
+    sent again on a new connection once when that happens.
+
+    :param conn: Connection to send the request on.
+    :type conn: http.client.HTTPConnection
+    :param method: HTTP method.
+    :type method: str
+    :param path: Path of the request.
+    :type path: str
+    :param body: Body of the request or None.
+    :type body: str or None
+    :param headers: Headers of the request.
+    :type headers: dict
+    :returns: Status of the response or 0 on a failure.
+    :rtype: int
+    """
+    reused = conn.sock is not None
+    try:
+        conn.request(method, path, body, headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    except (RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+        conn.close()
+        if reused:
+            return send(conn, method, path, body, headers)
+        return 0
+    except (OSError, ValueError):
+        # Counted as an error and retried on a new connection
+        conn.close()
+        return 0
+
+
+def build_requests(addresses, clusters, networks, seed, count=1000):
+    """
+    Builds requests following the weights of REQUEST_MIX.
+
+    :param addresses: Addresses of existing hosts.
+    :type addresses: list
+    :param clusters: Names of existing clusters.
+    :type clusters: list
+    :param networks: Names of existing networks.
+    :type networks: list
+    :param seed: Seed of the choices.
+    :type seed: int
+    :param count: Number of requests to build.
+    :type count: int
+    :returns: Requests as (name, method, path, body, headers).
+    :rtype: list
+    """
+    rng = random.Random(seed)
+    authorization = 'Basic ' + base64.b64encode(
+        '{}:{}'.format(USER, PASSWORD).encode()).decode()
+    totals = []
+    total = 0
+    for item in REQUEST_MIX:
+        total += item[1]
+        totals.append(total)
+
+    requests = []
+    for _ in range(count):
+        name, _, method, path, body = REQUEST_MIX[
+            bisect.bisect_right(totals, rng.random() * total)]
+        index = rng.randrange(len(clusters))
+        values = {
+            # Hosts are spread over the clusters as seeded
+            'address': rng.choice(addresses[index::len(clusters)]),
+            'cluster': clusters[index],
+            'network': rng.choice(networks),
+        }
+        headers = {'Authorization': authorization}
+        if body is not None:
+            body = json.dumps(body).replace(
+                '{network}', values['network']).encode()
+            headers['Content-Type'] = 'application/json'
+        requests.append(
+            (name, method, path.format(**values), body, headers))
+    return requests
+
+
+def percentile(ordered, fraction):
+    """
+    Returns a percentile of ordered samples by the nearest rank.
+
+    :param ordered: Sorted samples.
+    :type ordered: list
+    :param fraction: The percentile as a fraction, such as 0.99.
+    :type fraction: float
+    :returns: The sample at the percentile.
+    :rtype: float
+    """
+    index = max(0, min(len(ordered) - 1,
+                       int(-(-len(ordered) * fraction // 1)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, duration):
+    """
+    Summarizes latencies.
+
+    :param latencies: Seconds requests took.
+    :type latencies: list
+    :param duration: Seconds the samples were taken over.
+    :type duration: float
+    :returns: The number of requests, throughput and latencies in ms.
+    :rtype: dict
+    """
+    ordered = sorted(latencies)
+    summary = {
+        'requests': len(ordered),
+        'throughput_rps': round(len(ordered) / duration, 1),
+    }
+    if ordered:
+        summary['latency_ms'] = {
+            'mean': round(sum(ordered) / len(ordered) * 1000, 3),
+            'p50': round(percentile(ordered, 0.5) * 1000, 3),
+            'p99': round(percentile(ordered, 0.99) * 1000, 3),
+            'p999': round(percentile(ordered, 0.999) * 1000, 3),
+            'max': round(ordered[-1] * 1000, 3),
+        }
+    return summary
+
+
+def git_commit():
+    """
+    Returns the commit the benchmark runs on.
+
+    :returns: The commit hash or None outside of a git checkout.
+    :rtype: str or None
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    """
+    Runs the load test.
+
+    :param args: The parsed command line arguments.
+    :type args: argparse.Namespace
+    :returns: The report.
+    :rtype: dict
+    """
+    bus = EmulatedBus(args.latency, args.jitter, args.seed)
+    addresses, clusters, networks = seed(
+        bus.storage, args.hosts, args.clusters, args.networks)
+    requests = build_requests(addresses, clusters, networks, args.seed)
+
+    with tempfile.NamedTemporaryFile(suffix='.json') as users:
+        write_users_file(users.name, args.bcrypt_rounds)
+        server, port = create_server(bus, users.name, args)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.start()
+
+    started = time.perf_counter()
+    measured_from = started + args.warmup
+    deadline = measured_from + args.duration
+    samples = [[] for _ in range(args.concurrency)]
+    clients = [
+        threading.Thread(target=run_client, args=(
+            port, requests, deadline, args.seed + i, samples[i]))
+        for i in range(args.concurrency)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    server.stop()
+    server_thread.join()
+
+    # Requests which started during the warm up are not measured
+    measured = [sample for client_samples in samples
+                for sample in client_samples if sample[2] >= measured_from]
+    duration = args.duration
+    status_codes = {}
+    by_route = {}
+    for name, status, _, seconds in measured:
+        status_codes[str(status)] = status_codes.get(str(status), 0) + 1
+        by_route.setdefault(name, []).append(seconds)
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'options': vars(args),
+        'errors': sum(count for code, count in status_codes.items()
+                      if not code.startswith('2')),
+        'status_codes': status_codes,
+        'routes': {name: summarize(latencies, duration)
+                   for name, latencies in sorted(by_route.items())},
+    }
+    report.update(summarize([sample[3] for sample in measured], duration))
+    return report
+
+
+def compare(report, baseline):
+    """
+    Prints how a report changed compared to a baseline report.
+
+    :param report: The new report.
+    :type report: dict
+    :param baseline: The baseline report.
+    :type baseline: dict
+    """
+    def change(name, new, old):
+        difference = (new - old) / old * 100 if old else 0
+        print('{:<16} {:>12} -> {:>12} ({:+.1f}%)'.format(
+            name, old, new, difference), file=sys.stderr)
+
+    print('Compared to {}:'.format(baseline.get('commit')), file=sys.stderr)
+    change('throughput_rps', report['throughput_rps'],
+           baseline['throughput_rps'])
+    for key in ('p50', 'p99', 'p999'):
+        change(key + ' ms', report['latency_ms'][key],
+               baseline['latency_ms'][key])
+    change('errors', report['errors'], baseline['errors'])
+
+
+def main():
+    """
+    Main entry point.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument(
+        '--duration', type=float, default=10,
+        help='Seconds requests are measured for')
+    parser.add_argument(
+        '--warmup', type=float, default=2,
+        help='Seconds requests are sent before measuring')
+    parser.add_argument(
+        '--concurrency', type=int, default=16,
+        help='Clients sending requests at the same time')
+    parser.add_argument(
+        '--threads', type=int, default=32,
+        help='Request threads of the server (0 for a thread per '
+             'connection)')
+    parser.add_argument(
+        '--asyncio', action='store_true',
+        help='Use the asyncio server instead of the threaded server')
+    parser.add_argument(
+        '--latency', type=float, default=0.001,
+        help='Seconds each emulated bus or storage request takes')
+    parser.add_argument(
+        '--jitter', type=float, default=0.0005,
+        help='Seconds the emulated latency varies by in either direction')
+    parser.add_argument(
+        '--hosts', type=int, default=100, help='Hosts in storage')
+    parser.add_argument(
+        '--clusters', type=int, default=10, help='Clusters in storage')
+    parser.add_argument(
+        '--networks', type=int, default=10, help='Networks in storage')
+    parser.add_argument(
+        '--bcrypt-rounds', type=int, default=4,
+        help='bcrypt cost of the password checked on every request')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Seed of the request mix and the latency jitter')
+    parser.add_argument(
+        '--output', type=str, help='File to write the JSON report to')
+    parser.add_argument(
+        '--baseline', type=str,
+        help='JSON report of an earlier run to compare with')
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            compare(report, json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
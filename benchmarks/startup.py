@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measures how long commissaire-server takes to start.
+
+Reports the time to import the server and the time from starting the
+server process until it answers its first request. The server uses the
+in-memory bus, so no bus service is needed.
+
+Example: python3 benchmarks/startup.py --runs 10
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from http.client import HTTPConnection
+
+#: Users file of the authentication plugin
+USERS_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'conf', 'users.json')
+
+#: Imports the server and prints the seconds it took
+IMPORT_CODE = (
+    'import time; started = time.perf_counter(); '
+    'import commissaire_http.server.cli; '
+    'print(time.perf_counter() - started)')
+
+
+def free_port():
+    """
+    Finds a free local port.
+
+    :returns: The port number.
+    :rtype: int
+    """
+    sock = socket.socket()
+    try:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+def time_import():
+    """
+    Times importing the server in a new interpreter.
+
+    :returns: Seconds the import took.
+    :rtype: float
+    """
+    return float(subprocess.check_output(
+        [sys.executable, '-c', IMPORT_CODE]).decode())
+
+
+def time_to_first_request(path='/metrics', timeout=30):
+    """
+    Starts a server and times how long it takes to answer a request.
+
+    :param path: The path to request.
+    :type path: str
+    :param timeout: Seconds to wait for the answer.
+    :type timeout: float
+    :returns: Seconds until the first answer.
+    :rtype: float
+    """
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'commissaire_http.server.cli',
+         '--no-config-file', '--listen-interface', '127.0.0.1',
+         '--listen-port', str(port), '--bus-uri', 'memory://',
+         '--authentication-plugin', 'httpbasicauth:filepath=' + USERS_FILE],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            conn = HTTPConnection('127.0.0.1', port, timeout=timeout)
+            try:
+                conn.request('GET', path)
+                if conn.getresponse().status == 200:
+                    return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.005)
+            finally:
+                conn.close()
+        raise RuntimeError('Server did not answer within {} seconds'.format(
+            timeout))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def report(name, samples):
+    """
+    Prints statistics of samples in milliseconds.
+
+    :param name: What was measured.
+    :type name: str
+    :param samples: Seconds measured.
+    :type samples: list
+    """
+    samples = sorted(sample * 1000 for sample in samples)
+    print('{:<24} min {:8.1f} ms  median {:8.1f} ms  max {:8.1f} ms'.format(
+        name, samples[0], statistics.median(samples), samples[-1]))
+
+
+def main():
+    """
+    Main entry point.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument(
+        '--runs', type=int, default=5, help='Times to start the server')
+    args = parser.parse_args()
+
+    report('import', [time_import() for _ in range(args.runs)])
+    report('time to first request',
+           [time_to_first_request() for _ in range(args.runs)])
+
+
+if __name__ == '__main__':
+    main()
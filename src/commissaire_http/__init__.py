@@ -17,15 +17,24 @@
 Main Commissaire application server code.
 """
 
+import io
 import logging
+import queue
+import selectors
+import socket
+import ssl
+import threading
+import time
 
 from argparse import Namespace
 from socketserver import ThreadingMixIn
 from routes.middleware import RoutesMiddleware
-from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+from wsgiref.simple_server import (
+    ServerHandler, WSGIServer, WSGIRequestHandler, make_server)
 
 from commissaire.util.config import read_config_file
-from commissaire_http.util.cli import parse_to_struct
+from commissaire_http.util.cli import parse_rate_limit, parse_to_struct
+from commissaire_http.util.tls import TLSContext, get_common_name
 
 
 def parse_args(parser):
@@ -61,6 +70,33 @@ def parse_args(parser):
     parser.add_argument(
         '--listen-port', '-p', type=int, default=8000,
         help='Port to listen on')
+    parser.add_argument(
+        '--listen-unix', type=str, metavar='PATH',
+        help='Unix domain socket to listen on instead of the interface '
+             'and port. Sockets passed by systemd take precedence.')
+    parser.add_argument(
+        '--workers', type=int, default=0,
+        help='Number of pre-forked worker processes sharing the listening '
+             'socket (0 serves from a single process). Metrics are summed '
+             'across workers; per process metrics carry a pid label')
+    parser.add_argument(
+        '--asyncio', action='store_true',
+        help='Serve with the asyncio server instead of the threaded server')
+    parser.add_argument(
+        '--max-threads', type=int, default=32,
+        help='Number of threads handling requests in each process '
+             '(0 starts a new thread per connection)')
+    parser.add_argument(
+        '--max-queued', type=int, default=128,
+        help='Number of accepted connections which may wait for a free '
+             'thread before new connections are answered with a 503')
+    parser.add_argument(
+        '--keep-alive-timeout', type=float, default=15,
+        help='Seconds an idle persistent connection is kept open '
+             '(0 closes connections after each response)')
+    parser.add_argument(
+        '--keep-alive-requests', type=int, default=100,
+        help='Requests served on a persistent connection before closing it')
     parser.add_argument(
         '--tls-pemfile', type=str,
         help='Full path to the TLS PEM for the commissaire server')
@@ -68,6 +104,83 @@ def parse_args(parser):
         '--tls-clientverifyfile', type=str,
         help='Full path to the TLS file containing the certificate '
              'authorities that client certificates should be verified against')
+    parser.add_argument(
+        '--tls-ciphers', type=str,
+        help='OpenSSL cipher list to allow for TLS connections')
+    parser.add_argument(
+        '--tls-ecdh-curve', type=str,
+        help='Name of the curve to use for ECDH key exchange')
+    parser.add_argument(
+        '--tls-ticket-key-lifetime', type=float, default=0,
+        help='Seconds before TLS session ticket keys are rotated '
+             '(0 never rotates them)')
+    parser.add_argument(
+        '--max-in-flight', type=int, default=0,
+        help='Requests handled at once before answering with 503 '
+             '(0 for no limit)')
+    parser.add_argument(
+        '--adaptive-admission', action='store_true',
+        help='Adjust --max-in-flight to the latency of the requests')
+    parser.add_argument(
+        '--compress-min-size', type=int, default=0,
+        help='Compress JSON responses of at least this many bytes '
+             'for clients accepting gzip or deflate (0 disables)')
+    parser.add_argument(
+        '--compress-cache-size', type=int, default=0,
+        help='Number of compressed response bodies to cache')
+    parser.add_argument(
+        '--route-cache-size', type=int, default=4096,
+        help='Number of route matches to cache (0 disables)')
+    parser.add_argument(
+        '--log-queue-size', type=int, default=0,
+        help='Write log records from a separate thread, buffering up to this '
+             'many records (0 writes them from the logging thread)')
+    parser.add_argument(
+        '--server-timing', action='store_true',
+        help=('Time the stages of each request and report them in a '
+              'Server-Timing header'))
+    parser.add_argument(
+        '--max-body-size', type=int, default=1048576,
+        help='Largest request body in bytes. Larger requests are answered '
+             'with a 413 before the body is read (0 for no limit)')
+    parser.add_argument(
+        '--header-timeout', type=float, default=10,
+        help='Seconds a client may take to send the TLS handshake, request '
+             'line and headers of a request')
+    parser.add_argument(
+        '--body-timeout', type=float, default=30,
+        help='Seconds a client may take to send a request body')
+    parser.add_argument(
+        '--idle-timeout', type=float, default=60,
+        help='Seconds a single read or write of a connection may block')
+    parser.add_argument(
+        '--request-timeout', type=float, default=60,
+        help='Seconds a request may take before its remaining bus requests '
+             'are abandoned and it is answered with a 504. Clients may ask '
+             'for less with the X-Request-Timeout header. 0 only applies '
+             'timeouts given by clients.')
+    parser.add_argument(
+        '--health-check-interval', type=float, default=5,
+        help='Seconds between readiness checks of the bus. Probe responses '
+             'are cached for as long.')
+    parser.add_argument(
+        '--circuit-breaker-failure-ratio', type=float, default=0.5,
+        help='Ratio of bus requests for a routing key which must fail to '
+             'open its circuit breaker (0 disables circuit breakers)')
+    parser.add_argument(
+        '--circuit-breaker-min-requests', type=int, default=10,
+        help='Bus requests for a routing key in the window before its '
+             'failure ratio is considered')
+    parser.add_argument(
+        '--circuit-breaker-window', type=float, default=10,
+        help='Seconds bus requests are counted for by circuit breakers')
+    parser.add_argument(
+        '--circuit-breaker-reset-timeout', type=float, default=5,
+        help='Seconds an open circuit breaker fails requests before letting '
+             'one through to check the service')
+    parser.add_argument(
+        '--drain-timeout', type=float, default=30,
+        help='Seconds in-flight requests may take to finish on shut down')
     parser.add_argument(
         '--authentication-plugin', action='append',
         dest='authentication_plugins',
@@ -76,6 +189,12 @@ def parse_args(parser):
     parser.add_argument(
         '--self-auth', action='append', dest='self_auths',
         help='URI paths which provide their own authentication.')
+    parser.add_argument(
+        '--rate-limit', action='append', dest='rate_limits', default=[],
+        metavar='KEY:rate=N,burst=N,path=PATH,method=METHOD',
+        type=parse_rate_limit,
+        help=('Limit requests per second for each user, ip or route. '
+              'Applied after authentication.'))
     parser.add_argument(
         '--bus-exchange', type=str, default='commissaire',
         help='Message bus exchange name.')
@@ -104,32 +223,793 @@ def parse_args(parser):
     return args
 
 
-class ThreadedWSGIServer(ThreadingMixIn, WSGIServer):
+class CommissaireWSGIServer(WSGIServer):
+    """
+    Commissaire version of the WSGIServer.
+    """
+
+    #: TLSContext wrapping accepted connections or None
+    tls_context = None
+
+    #: Set once the server is shutting down
+    draining = False
+
+    def __init__(self, *args, **kwargs):
+        """
+        Initializes a new CommissaireWSGIServer instance.
+
+        :param args: All non-keyword arguments.
+        :type args: tuple
+        :param kwargs: All keyword arguments.
+        :type kwargs: dict
+        """
+        self._busy = 0
+        self._idle = threading.Condition()
+        super(CommissaireWSGIServer, self).__init__(*args, **kwargs)
+
+    def connection_busy(self):
+        """
+        Called when a connection starts working on a request.
+        """
+        with self._idle:
+            self._busy += 1
+
+    def connection_idle(self):
+        """
+        Called when a connection finished a request.
+        """
+        with self._idle:
+            self._busy -= 1
+            if self._busy == 0:
+                self._idle.notify_all()
+
+    def wait_for_requests(self, timeout):
+        """
+        Waits for connections to finish their in-flight requests.
+
+        :param timeout: Maximum seconds to wait.
+        :type timeout: float
+        :returns: True if no requests are in-flight anymore.
+        :rtype: bool
+        """
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self._busy > 0 or self.has_waiting_requests():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                # Queued connections do not notify so poll for them
+                self._idle.wait(min(remaining, 0.1))
+        return True
+
+    def has_waiting_requests(self):
+        """
+        Checks if accepted connections are waiting for a thread.
+
+        :returns: True if connections are waiting.
+        :rtype: bool
+        """
+        return False
+
+    def use_socket(self, sock):
+        """
+        Serves on an already bound and listening socket instead of the one
+        created by the server, such as a Unix domain socket or a socket
+        passed by systemd.
+
+        :param sock: The listening socket.
+        :type sock: socket.socket
+        """
+        self.socket.close()
+        self.socket = sock
+        self.address_family = sock.family
+        self.server_address = sock.getsockname()
+        if sock.family == socket.AF_UNIX:
+            self.server_name = 'localhost'
+            self.server_port = 0
+        else:
+            host, self.server_port = self.server_address[:2]
+            self.server_name = socket.getfqdn(host)
+        self.setup_environ()
+
+    def get_request(self):
+        """
+        Override to wrap accepted connections with TLS. The handshake is
+        done later by the thread handling the connection.
+
+        :returns: The accepted connection and the client address.
+        :rtype: tuple
+        """
+        request, client_address = super(
+            CommissaireWSGIServer, self).get_request()
+        if self.address_family == socket.AF_UNIX:
+            # Unix domain socket clients have no address
+            client_address = ('unix', 0)
+        if self.tls_context is not None:
+            request = self.tls_context.wrap_socket(request)
+        return request, client_address
+
+
+class ThreadedWSGIServer(ThreadingMixIn, CommissaireWSGIServer):
     """
     Threaded version of the WSIServer
     """
-    pass
+
+    #: Idle persistent connections must not keep the process alive
+    daemon_threads = True
+
+    #: In-flight requests are waited for by CommissaireHttpServer
+    block_on_close = False
+
+
+class ThreadPoolMixIn:
+    """
+    Mix-in class to handle requests with a fixed size pool of threads.
+
+    Accepted connections wait in a bounded queue for a free thread. When
+    the queue is full new connections are answered with a 503 right away.
+    """
+
+    #: Number of threads handling requests
+    max_threads = 32
+    #: Number of accepted connections which may wait for a thread
+    max_queued = 128
+    #: Response sent when the queue is full
+    reject_response = (
+        b'HTTP/1.0 503 Service Unavailable\r\n'
+        b'Content-Type: text/html\r\n'
+        b'Content-Length: 19\r\n'
+        b'Retry-After: 1\r\n'
+        b'Connection: close\r\n\r\n'
+        b'Service Unavailable')
+
+    _pool = None
+    _pending = None
+
+    def start_pool(self):
+        """
+        Starts the pool threads. This is done when serving starts so that
+        the threads are created in the process which does the serving.
+        """
+        self._pending = queue.Queue(self.max_queued)
+        self._pool = []
+        for i in range(self.max_threads):
+            thread = threading.Thread(
+                target=self._pool_worker, name='RequestThread-{}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._pool.append(thread)
+
+    def serve_forever(self, *args, **kwargs):
+        """
+        Starts the pool, if needed, and serves until shut down.
+
+        :param args: All non-keyword arguments.
+        :type args: tuple
+        :param kwargs: All keyword arguments.
+        :type kwargs: dict
+        """
+        if self._pool is None:
+            self.start_pool()
+        super().serve_forever(*args, **kwargs)
+
+    def process_request(self, request, client_address):
+        """
+        Queues the request for the next free pool thread.
+
+        :param request: The accepted connection.
+        :type request: socket.socket
+        :param client_address: The address of the client.
+        :type client_address: tuple
+        """
+        try:
+            self._pending.put_nowait((request, client_address))
+        except queue.Full:
+            self.reject_request(request, client_address)
+
+    def reject_request(self, request, client_address):
+        """
+        Answers a connection with a 503 and closes it.
+
+        :param request: The accepted connection.
+        :type request: socket.socket
+        :param client_address: The address of the client.
+        :type client_address: tuple
+        """
+        # Writing to a TLS connection would mean doing the handshake here
+        if not isinstance(request, ssl.SSLSocket):
+            try:
+                request.sendall(self.reject_response)
+            except OSError:
+                pass
+        self.shutdown_request(request)
+
+    def has_waiting_requests(self):
+        """
+        Checks if accepted connections are waiting for a pool thread.
+
+        :returns: True if connections are waiting.
+        :rtype: bool
+        """
+        return self._pending is not None and not self._pending.empty()
+
+    def _pool_worker(self):
+        """
+        Handles queued requests until a None sentinel is received.
+        """
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self):
+        """
+        Closes the server and stops the pool threads.
+        """
+        super().server_close()
+        for _ in self._pool or []:
+            self._pending.put(None)
+
+
+class PooledWSGIServer(ThreadPoolMixIn, CommissaireWSGIServer):
+    """
+    Version of the WSGIServer using a fixed size pool of threads.
+    """
+
+    #: Size of the listen backlog
+    request_queue_size = 128
+
+
+class DeadlineReader(io.RawIOBase):
+    """
+    Raw reader of a connection which fails once a deadline passed. The
+    deadline covers all reads, so a client sending a byte at a time can
+    not hold a thread for longer than the deadline allows.
+    """
+
+    def __init__(self, sock, timeout=None):
+        """
+        Initializes a new DeadlineReader instance.
+
+        :param sock: The connection to read from.
+        :type sock: socket.socket
+        :param timeout: Seconds a single read may block. None blocks.
+        :type timeout: float or None
+        """
+        self._sock = sock
+        self.timeout = timeout
+        #: time.monotonic() after which reads fail or None
+        self.deadline = None
+
+    def readable(self):
+        """
+        Returns True since the reader is readable.
+
+        :returns: True
+        :rtype: bool
+        """
+        return True
+
+    def readinto(self, buffer):
+        """
+        Reads from the connection into a buffer.
+
+        :param buffer: The buffer to read into.
+        :type buffer: bytearray or memoryview
+        :returns: Number of bytes read or None if a non-blocking
+                  connection has no data.
+        :rtype: int or None
+        :raises: socket.timeout
+        """
+        if self.deadline is None:
+            try:
+                return self._sock.recv_into(buffer)
+            except (BlockingIOError, ssl.SSLWantReadError):
+                return None
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout('Deadline exceeded')
+        if self.timeout is not None and self.timeout < remaining:
+            return self._sock.recv_into(buffer)
+        # Writes keep using the idle timeout
+        self._sock.settimeout(remaining)
+        try:
+            return self._sock.recv_into(buffer)
+        finally:
+            self._sock.settimeout(self.timeout)
+
+
+class RequestBody:
+    """
+    File like wrapper around the connection which never reads past the
+    body of the current request.
+    """
+
+    def __init__(self, rfile, content_length):
+        """
+        Initializes a new RequestBody instance.
+
+        :param rfile: The connection's read file.
+        :type rfile: io.BufferedReader
+        :param content_length: The length of the request body.
+        :type content_length: int
+        """
+        self._rfile = rfile
+        self.remaining = content_length
+        #: Set if the client was too slow sending the body
+        self.timed_out = False
+
+    def read(self, size=-1):
+        """
+        Reads up to size bytes of the body.
+
+        :param size: Maximum bytes to read. Negative reads the rest.
+        :type size: int
+        :returns: The data read.
+        :rtype: bytes
+        """
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        chunks = []
+        try:
+            while size > 0:
+                chunk = self._rfile.read1(size)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size -= len(chunk)
+        except socket.timeout:
+            # The app sees a short body and the connection is closed
+            self.timed_out = True
+        data = chunks[0] if len(chunks) == 1 else b''.join(chunks)
+        self.remaining -= len(data)
+        if size > 0:
+            # The client went away before sending the whole body
+            self.remaining = 0
+        return data
+
+    def readline(self, size=-1):
+        """
+        Reads a line of up to size bytes of the body.
+
+        :param size: Maximum bytes to read. Negative reads up to the end.
+        :type size: int
+        :returns: The data read.
+        :rtype: bytes
+        """
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        try:
+            data = self._rfile.readline(size) if size else b''
+        except socket.timeout:
+            self.timed_out = True
+            self.remaining = 0
+            data = b''
+        self.remaining -= len(data)
+        return data
+
+    def readlines(self, hint=-1):
+        """
+        Reads the rest of the body as lines.
+
+        :param hint: Ignored.
+        :type hint: int
+        :returns: The lines read.
+        :rtype: list
+        """
+        return self.read().splitlines(True)
+
+    def __iter__(self):  # noqa
+        return iter(self.readlines())
+
+    def drain(self, limit):
+        """
+        Discards the unread part of the body so the next request on the
+        connection can be read.
+
+        :param limit: Maximum number of bytes to discard.
+        :type limit: int
+        :returns: True if the whole body has been consumed.
+        :rtype: bool
+        """
+        while 0 < self.remaining <= limit:
+            if not self.read(min(self.remaining, 65536)):
+                break
+        return self.remaining == 0 and not self.timed_out
+
+
+class CommissaireServerHandler(ServerHandler):
+    """
+    Commissaire version of the ServerHandler speaking HTTP/1.1.
+    """
+
+    #: HTTP version of the responses
+    http_version = '1.1'
+
+    #: If the body is sent with chunked transfer encoding
+    chunked = False
+
+    def cleanup_headers(self):
+        """
+        Override to decide if the connection will be kept open and tell
+        the client about it.
+        """
+        super(CommissaireServerHandler, self).cleanup_headers()
+        request_handler = self.request_handler
+        if 'Content-Length' not in self.headers:
+            if request_handler.request_version == 'HTTP/1.1':
+                # Streamed bodies of unknown length are sent in chunks
+                self.chunked = True
+                self.headers['Transfer-Encoding'] = 'chunked'
+            else:
+                # The end of the body is the end of the connection
+                request_handler.close_connection = True
+        if request_handler.server.draining or self.stdin.timed_out:
+            request_handler.close_connection = True
+
+        if request_handler.close_connection:
+            self.headers['Connection'] = 'close'
+        elif request_handler.request_version != 'HTTP/1.1':
+            self.headers['Connection'] = 'keep-alive'
+
+    def write(self, data):
+        """
+        Override to frame the data as a chunk when chunking.
+
+        :param data: Part of the response body.
+        :type data: bytes
+        """
+        if self.status and not self.headers_sent:
+            # Sending the headers decides if the body is chunked
+            self.bytes_sent = len(data)
+            self.send_headers()
+            self.bytes_sent = 0
+        if self.chunked and data:
+            data = b''.join((
+                bytes('{:x}\r\n'.format(len(data)), 'ascii'), data, b'\r\n'))
+        super(CommissaireServerHandler, self).write(data)
+
+    def finish_content(self):
+        """
+        Override to send the last chunk when chunking.
+        """
+        super(CommissaireServerHandler, self).finish_content()
+        if self.chunked:
+            self._write(b'0\r\n\r\n')
+
+    def handle_error(self):
+        """
+        Override to close the connection. A partly sent response leaves
+        the connection unusable.
+        """
+        self.request_handler.close_connection = True
+        super(CommissaireServerHandler, self).handle_error()
 
 
 class CommissaireRequestHandler(WSGIRequestHandler):
     """
     Commissaire version of the WSGIRequestHandler.
+
+    Supports HTTP/1.1 persistent connections.
     """
     #: The software version of the server
     server_version = 'Commissaire/0.0.7'
 
+    #: Highest HTTP version supported
+    protocol_version = 'HTTP/1.1'
+
+    #: Seconds an idle persistent connection is kept open
+    keep_alive_timeout = 15
+
+    #: Seconds between checks for connections waiting for a thread while
+    #: a persistent connection is idle
+    idle_poll_interval = 0.1
+
+    #: Requests served on a persistent connection before closing it
+    keep_alive_requests = 100
+
+    #: Bytes of an unread request body discarded to reuse a connection
+    max_drain = 65536
+
+    #: Largest request body in bytes. 0 for no limit.
+    max_body_size = 1048576
+
+    #: Seconds to receive the TLS handshake, request line and headers
+    header_timeout = 10
+
+    #: Seconds to receive a request body
+    body_timeout = 30
+
+    #: Seconds a single read or write may block
+    timeout = 60
+
+    #: Headers and body are written separately, so without TCP_NODELAY a
+    #: kept connection waits for the client's delayed ACK on each response
+    disable_nagle_algorithm = True
+
+    #: Logger for errors of the request handler
+    logger = logging.getLogger('CommissaireRequestHandler')
+
+    #: Logger for the access log
+    access_logger = logging.getLogger('access')
+
+    def setup(self):
+        """
+        Override to read the connection through a DeadlineReader.
+        """
+        self.timeout = getattr(self.server, 'idle_timeout', self.timeout)
+        self.header_timeout = getattr(
+            self.server, 'header_timeout', self.header_timeout)
+        self.body_timeout = getattr(
+            self.server, 'body_timeout', self.body_timeout)
+        self.max_body_size = getattr(
+            self.server, 'max_body_size', self.max_body_size)
+        if self.request.family == socket.AF_UNIX:
+            # TCP_NODELAY only applies to TCP sockets
+            self.disable_nagle_algorithm = False
+        super(CommissaireRequestHandler, self).setup()
+        self.rfile.close()
+        self.reader = DeadlineReader(self.connection, self.timeout)
+        self.rfile = io.BufferedReader(self.reader)
+
+    def handle(self):
+        """
+        Handles requests until the connection is to be closed.
+        """
+        self.busy = False
+        self.set_busy(True)
+        try:
+            # The handshake and the first request share one deadline
+            self.reader.deadline = time.monotonic() + self.header_timeout
+
+            # The client certificate is verified once per connection and
+            # reused for every request on it.
+            self.peercert = None
+            self.client_cn = None
+            if isinstance(self.request, ssl.SSLSocket):
+                try:
+                    self.request.settimeout(self.header_timeout)
+                    self.request.do_handshake()
+                except (ssl.SSLError, OSError) as error:
+                    self.log_message('TLS handshake failed: %s', error)
+                    return
+                finally:
+                    self.request.settimeout(self.timeout)
+                self.server.tls_context.record_handshake(self.request)
+                self.peercert = self.request.getpeercert()
+                self.client_cn = get_common_name(self.peercert)
+
+            self.requests_handled = 0
+            self.close_connection = True
+            self.handle_one_request()
+            while not self.close_connection:
+                self.handle_one_request()
+        finally:
+            self.set_busy(False)
+
+    def set_busy(self, busy):
+        """
+        Tells the server if the connection is working on a request. Idle
+        connections are not waited for when the server shuts down.
+
+        :param busy: True if a request is being handled.
+        :type busy: bool
+        """
+        if busy != self.busy:
+            self.busy = busy
+            if busy:
+                self.server.connection_busy()
+            else:
+                self.server.connection_idle()
+
+    def handle_one_request(self):
+        """
+        Handle a single HTTP request.
+        """
+        keep_alive_timeout = getattr(
+            self.server, 'keep_alive_timeout', self.keep_alive_timeout)
+        keep_alive_requests = getattr(
+            self.server, 'keep_alive_requests', self.keep_alive_requests)
+
+        if self.requests_handled > 0:
+            self.set_busy(False)
+            if not self.wait_for_request(keep_alive_timeout):
+                self.close_connection = True
+                return
+            self.reader.deadline = time.monotonic() + self.header_timeout
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except (socket.timeout, ConnectionError):
+            self.close_connection = True
+            return
+        self.set_busy(True)
+        self.request_started = time.monotonic()
+
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            self.close_connection = True
+            return
+
+        try:
+            if not self.parse_request():  # An error code has been sent, exit
+                self.close_connection = True
+                return
+        except socket.timeout:
+            self.close_connection = True
+            self.send_error(408)
+            return
+        self.reader.deadline = None
+
+        self.requests_handled += 1
+        if (keep_alive_timeout <= 0 or self.server.draining or
+                self.requests_handled >= keep_alive_requests):
+            self.close_connection = True
+
+        body = self.get_request_body()
+        if body is None:
+            return
+
+        handler = CommissaireServerHandler(
+            body, self.wfile, self.get_stderr(), self.get_environ(),
+            multithread=True)
+        handler.request_handler = self      # backpointer for logging
+        handler.run(self.server.get_app())
+
+        if not body.drain(self.max_drain):
+            self.close_connection = True
+        self.reader.deadline = None
+
+    def wait_for_request(self, timeout):
+        """
+        Waits for the next request on a persistent connection. The wait
+        is given up as soon as other connections are waiting for a thread,
+        so idle connections never keep them waiting.
+
+        :param timeout: Seconds to wait for the request.
+        :type timeout: float
+        :returns: True if the next request can be read.
+        :rtype: bool
+        """
+        deadline = time.monotonic() + timeout
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.connection, selectors.EVENT_READ)
+            while not self.has_buffered_data():
+                if self.server.draining or self.server.has_waiting_requests():
+                    return False
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                if selector.select(min(remaining, self.idle_poll_interval)):
+                    return True
+        return True
+
+    def has_buffered_data(self):
+        """
+        Checks if a pipelined request was already received without
+        blocking.
+
+        :returns: True if data can be read right away.
+        :rtype: bool
+        """
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            # The following read reports the error
+            return True
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def handle_expect_100(self):
+        """
+        Override to only invite clients to send bodies which are accepted.
+
+        :returns: False if an error response was sent instead.
+        :rtype: bool
+        """
+        if self.check_request_body() is None:
+            return False
+        return super(CommissaireRequestHandler, self).handle_expect_100()
+
+    def get_request_body(self):
+        """
+        Checks the request body and starts its deadline.
+
+        :returns: The body or None if an error response was sent.
+        :rtype: RequestBody or None
+        """
+        content_length = self.check_request_body()
+        if content_length is None:
+            return None
+        if content_length > 0:
+            self.reader.deadline = time.monotonic() + self.body_timeout
+        return RequestBody(self.rfile, content_length)
+
+    def check_request_body(self):
+        """
+        Checks the framing and length of the request body. Errors are
+        answered before the body is read and close the connection.
+
+        Bodies are only framed by Content-Length. Requests with a
+        Transfer-Encoding are refused, so the server never disagrees with
+        a proxy about where the next request starts.
+
+        :returns: The length of the body or None if an error was sent.
+        :rtype: int or None
+        """
+        if 'transfer-encoding' in self.headers:
+            # Both headers at once is how requests are smuggled
+            if 'content-length' in self.headers:
+                self.send_error(400, 'Transfer-Encoding with Content-Length')
+            else:
+                self.send_error(501, 'Transfer-Encoding is not supported')
+            self.close_connection = True
+            return None
+        try:
+            content_length = int(self.headers.get('content-length') or 0)
+        except ValueError:
+            content_length = 0
+            self.close_connection = True
+        if 0 < self.max_body_size < content_length:
+            # The body is not drained
+            self.send_error(413)
+            self.close_connection = True
+            return None
+        return max(content_length, 0)
+
+    def log_request(self, code='-', size='-'):
+        """
+        Logs a finished request as a key=value access log line.
+
+        :param code: The status code of the response.
+        :type code: int or str
+        :param size: Bytes of the response body.
+        :type size: int or str
+        """
+        self.access_logger.info(
+            'remote=%s method=%s path=%s status=%s size=%s duration_ms=%.3f',
+            self.address_string(), self.command or '-',
+            getattr(self, 'path', None) or '-',
+            getattr(code, 'value', code), size,
+            (time.monotonic() - self.request_started) * 1000)
+
+    def log_message(self, format, *args):
+        """
+        Logs errors through logging instead of writing them to stderr.
+
+        :param format: The message format.
+        :type format: str
+        :param args: Arguments for the format.
+        :type args: tuple
+        """
+        self.logger.warning(
+            '%s: %s', self.address_string(), format % args)
+
     def get_environ(self):
         """
-        Override to add SSL_CLIENT_VERIFY to the env.
+        Override to add SSL_CLIENT_VERIFY and SSL_CLIENT_S_DN_CN to the env.
 
         :returns: The WSGI environment
         :rtype: dict
         """
         env = super(CommissaireRequestHandler, self).get_environ()
-        try:
-            env['SSL_CLIENT_VERIFY'] = self.request.getpeercert()
-        except:
-            env['SSL_CLIENT_VERIFY'] = None
+        env['SSL_CLIENT_VERIFY'] = self.peercert
+        if self.client_cn is not None:
+            env['SSL_CLIENT_S_DN_CN'] = self.client_cn
         return env
 
 
@@ -142,7 +1022,13 @@ class CommissaireHttpServer:
     logger = logging.getLogger('CommissaireHttpServer')
 
     def __init__(self, bind_host, bind_port, dispatcher,
-                 tls_pem_file=None, tls_clientverify_file=None):
+                 tls_pem_file=None, tls_clientverify_file=None,
+                 max_threads=0, max_queued=128,
+                 keep_alive_timeout=15, keep_alive_requests=100,
+                 tls_ciphers=None, tls_ecdh_curve=None,
+                 tls_ticket_key_lifetime=0, drain_timeout=30,
+                 listen_socket=None, max_body_size=1048576,
+                 header_timeout=10, body_timeout=30, idle_timeout=60):
         """
         Initializes a new CommissaireHttpServer instance.
 
@@ -156,49 +1042,144 @@ class CommissaireHttpServer:
         :type tls_pem_file: str
         :param tls_clientverify_file: Full path to CA to verify certs.
         :type tls_clientverify_file: str
+        :param max_threads: Size of the request thread pool. 0 starts a
+                            thread per connection.
+        :type max_threads: int
+        :param max_queued: Connections which may wait for a pool thread.
+        :type max_queued: int
+        :param keep_alive_timeout: Seconds an idle persistent connection is
+                                   kept open. 0 disables persistence.
+        :type keep_alive_timeout: float
+        :param keep_alive_requests: Requests served on a persistent
+                                    connection before closing it.
+        :type keep_alive_requests: int
+        :param tls_ciphers: OpenSSL cipher list string.
+        :type tls_ciphers: str or None
+        :param tls_ecdh_curve: Name of the curve used for ECDH key exchange.
+        :type tls_ecdh_curve: str or None
+        :param tls_ticket_key_lifetime: Seconds before TLS session ticket
+                                        keys are rotated. 0 never rotates.
+        :type tls_ticket_key_lifetime: float
+        :param drain_timeout: Seconds in-flight requests may take to finish
+                              once the server is stopped.
+        :type drain_timeout: float
+        :param listen_socket: A listening socket to serve on instead of
+                              binding bind_host and bind_port.
+        :type listen_socket: socket.socket or None
+        :param max_body_size: Largest request body in bytes. Larger
+                              requests are answered with a 413. 0 for no
+                              limit.
+        :type max_body_size: int
+        :param header_timeout: Seconds to receive the TLS handshake,
+                               request line and headers of a request.
+        :type header_timeout: float
+        :param body_timeout: Seconds to receive a request body.
+        :type body_timeout: float
+        :param idle_timeout: Seconds a single read or write may block.
+        :type idle_timeout: float
         """
         self._bind_host = bind_host
         self._bind_port = bind_port
         self._tls_pem_file = tls_pem_file
         self._tls_clientverify_file = tls_clientverify_file
+        self.drain_timeout = drain_timeout
         self.dispatcher = dispatcher
-        self._httpd = make_server(
-            self._bind_host,
-            self._bind_port,
-            RoutesMiddleware(
-                self.dispatcher.dispatch,
-                self.dispatcher.router),
-            server_class=ThreadedWSGIServer,
-            handler_class=CommissaireRequestHandler)
-
-        # If we are given a PEM file then wrap the socket
+        server_class = ThreadedWSGIServer
+        if max_threads > 0:
+            server_class = PooledWSGIServer
+        app = RoutesMiddleware(
+            self.dispatcher.dispatch,
+            self.dispatcher.router)
+        if listen_socket is None:
+            self._httpd = make_server(
+                self._bind_host,
+                self._bind_port,
+                app,
+                server_class=server_class,
+                handler_class=CommissaireRequestHandler)
+        else:
+            self._httpd = server_class(
+                listen_socket.getsockname(), CommissaireRequestHandler,
+                bind_and_activate=False)
+            self._httpd.use_socket(listen_socket)
+            self._httpd.set_app(app)
+        if max_threads > 0:
+            self._httpd.max_threads = max_threads
+            self._httpd.max_queued = max_queued
+        self._httpd.keep_alive_timeout = keep_alive_timeout
+        self._httpd.keep_alive_requests = keep_alive_requests
+        self._httpd.max_body_size = max_body_size
+        self._httpd.header_timeout = header_timeout
+        self._httpd.body_timeout = body_timeout
+        self._httpd.idle_timeout = idle_timeout
+
+        # If we are given a PEM file then wrap accepted connections
+        self.tls_context = None
         if tls_pem_file:
-            import ssl
-            client_side_cert_kwargs = {}
+            self.tls_context = TLSContext(
+                self._tls_pem_file,
+                self._tls_clientverify_file,
+                ciphers=tls_ciphers,
+                ecdh_curve=tls_ecdh_curve,
+                ticket_key_lifetime=tls_ticket_key_lifetime)
+            self._httpd.tls_context = self.tls_context
             if self._tls_clientverify_file:
-                client_side_cert_kwargs = {
-                    'cert_reqs': ssl.CERT_REQUIRED,
-                    'ca_certs': self._tls_clientverify_file,
-                }
                 self.logger.info(
                     'Requiring client side certificate CA validation.')
-
-            self._httpd.socket = ssl.wrap_socket(
-                self._httpd.socket,
-                certfile=self._tls_pem_file,
-                ssl_version=ssl.PROTOCOL_TLSv1_2,
-                server_side=True,
-                **client_side_cert_kwargs)
             self.logger.info('Using TLS with %s', self._tls_pem_file)
 
         self.logger.debug(
-            'Created httpd server: %s:%s', self._bind_host, self._bind_port)
+            'Created httpd server: %s', self._httpd.server_address)
+
+    def tls_stats(self):
+        """
+        Returns the TLS handshake counters of this process.
+
+        :returns: Number of handshakes and of resumed sessions.
+        :rtype: dict
+        """
+        if self.tls_context is None:
+            return {'handshakes': 0, 'resumed': 0}
+        return self.tls_context.stats()
 
     def serve_forever(self):
         """
-        Serve HTTP.
+        Serve HTTP until stopped, then drain in-flight requests.
         """
         try:
             self._httpd.serve_forever()
         except Exception as error:
             self.logger.error('Server shut down %s: %s', type(error), error)
+        self.drain()
+
+    def stop(self, signum=None, frame=None):
+        """
+        Stops accepting connections. serve_forever returns once in-flight
+        requests are finished. Usable as a signal handler.
+
+        :param signum: The signal number, if called as a signal handler.
+        :type signum: int or None
+        :param frame: The current stack frame, if called as a signal handler.
+        :type frame: frame or None
+        """
+        self.logger.info('Stopping. Draining in-flight requests.')
+        self._httpd.draining = True
+        # shutdown() waits for serve_forever which may be the caller
+        threading.Thread(target=self._httpd.shutdown, daemon=True).start()
+
+    def drain(self):
+        """
+        Closes the listening socket and waits up to drain_timeout seconds
+        for in-flight requests to finish.
+
+        :returns: True if all in-flight requests finished.
+        :rtype: bool
+        """
+        self._httpd.draining = True
+        # Closing only releases this process' copy of a shared socket
+        self._httpd.server_close()
+        drained = self._httpd.wait_for_requests(self.drain_timeout)
+        if not drained:
+            self.logger.warn(
+                'Requests still in-flight after %ss', self.drain_timeout)
+        return drained
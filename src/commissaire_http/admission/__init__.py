@@ -0,0 +1,242 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Admission control for Commissaire.
+"""
+
+import logging
+import threading
+import time
+
+from functools import partial
+
+from commissaire_http.util.wsgi import call_app_async, close_when_done
+
+
+class FixedLimit:
+    """
+    A concurrency limit which never changes.
+    """
+
+    def __init__(self, limit):
+        """
+        Initializes a new FixedLimit instance.
+
+        :param limit: Maximum number of requests in-flight.
+        :type limit: int
+        """
+        self.limit = limit
+
+    def update(self, latency, in_flight):
+        """
+        Called with the latency of every finished request.
+
+        :param latency: Seconds the request took.
+        :type latency: float
+        :param in_flight: Requests in-flight when the request finished.
+        :type in_flight: int
+        """
+        pass
+
+
+class AIMDLimit(FixedLimit):
+    """
+    A concurrency limit which grows additively while latency is normal and
+    shrinks multiplicatively once latency rises above the usual latency.
+
+    The usual latency is a slow moving average, so a backend which
+    permanently became slower stops being treated as overloaded.
+    """
+
+    #: Weight of a new sample in the recent latency average
+    recent_weight = 0.2
+    #: Weight of a new sample in the usual latency average
+    usual_weight = 0.01
+
+    def __init__(self, limit=20, min_limit=1, max_limit=1000,
+                 backoff=0.9, tolerance=2.0):
+        """
+        Initializes a new AIMDLimit instance.
+
+        :param limit: Initial maximum number of requests in-flight.
+        :type limit: int
+        :param min_limit: The limit never shrinks below this.
+        :type min_limit: int
+        :param max_limit: The limit never grows above this.
+        :type max_limit: int
+        :param backoff: Factor applied to the limit on overload.
+        :type backoff: float
+        :param tolerance: How many times slower than usual requests may
+                          get before the limit shrinks.
+        :type tolerance: float
+        """
+        super(AIMDLimit, self).__init__(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self._recent = None
+        self._usual = None
+        self._last_backoff = 0
+
+    def update(self, latency, in_flight):
+        """
+        Adjusts the limit with the latency of a finished request.
+
+        :param latency: Seconds the request took.
+        :type latency: float
+        :param in_flight: Requests in-flight when the request finished.
+        :type in_flight: int
+        """
+        if self._usual is None:
+            self._recent = self._usual = latency
+            return
+        self._recent += (latency - self._recent) * self.recent_weight
+        self._usual += (latency - self._usual) * self.usual_weight
+
+        now = time.monotonic()
+        if self._recent > self._usual * self.tolerance:
+            # Back off at most once per round trip
+            if now - self._last_backoff > self._recent:
+                self._last_backoff = now
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+        elif in_flight * 2 >= self.limit:
+            # Only grow while the limit is actually being used
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+
+class AdmissionController:
+    """
+    WSGI middleware which limits the number of requests in-flight and
+    answers requests above the limit with a 503 right away. Requests for
+    exempt paths, such as probes and metrics, are neither limited nor
+    counted. Requests with streamed bodies are in-flight until the body
+    is closed.
+    """
+
+    #: Logger for AdmissionController
+    logger = logging.getLogger('AdmissionController')
+
+    def __init__(self, app, limit, retry_after=1, exempt_paths=None):
+        """
+        Initializes a new AdmissionController instance.
+
+        :param app: A WSGI app to wrap.
+        :type app: instance
+        :param limit: The concurrency limit to enforce.
+        :type limit: FixedLimit
+        :param retry_after: Seconds clients are asked to wait on rejection.
+        :type retry_after: int
+        :param exempt_paths: Paths passed through without being limited.
+        :type exempt_paths: None or [str]
+        """
+        self._app = app
+        self.limit = limit
+        self.retry_after = retry_after
+        self.exempt_paths = frozenset(exempt_paths or ())
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        """
+        Passes the request to the app if the limit allows it.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :returns: Response back to requestor.
+        :rtype: list
+        """
+        if environ.get('PATH_INFO') in self.exempt_paths:
+            return self._app(environ, start_response)
+        if not self._admit():
+            return self._reject(start_response)
+        started = time.monotonic()
+        try:
+            result = self._app(environ, start_response)
+        except BaseException:
+            self._finish(started)
+            raise
+        return close_when_done(result, partial(self._finish, started))
+
+    async def call_async(self, environ, start_response):
+        """
+        Coroutine version of __call__ used by the asyncio server.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :returns: Response back to requestor.
+        :rtype: list
+        """
+        if environ.get('PATH_INFO') in self.exempt_paths:
+            return await call_app_async(self._app, environ, start_response)
+        if not self._admit():
+            return self._reject(start_response)
+        started = time.monotonic()
+        try:
+            result = await call_app_async(
+                self._app, environ, start_response)
+        except BaseException:
+            self._finish(started)
+            raise
+        return close_when_done(result, partial(self._finish, started))
+
+    def _admit(self):
+        """
+        Counts a new request if the limit allows it.
+
+        :returns: True if the request may pass.
+        :rtype: bool
+        """
+        with self._lock:
+            if self.in_flight >= self.limit.limit:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def _finish(self, started):
+        """
+        Counts a finished request and updates the limit.
+
+        :param started: time.monotonic() when the request was admitted.
+        :type started: float
+        """
+        latency = time.monotonic() - started
+        with self._lock:
+            self.limit.update(latency, self.in_flight)
+            self.in_flight -= 1
+
+    def _reject(self, start_response):
+        """
+        Answers a request which is above the limit.
+
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :returns: Response back to requestor.
+        :rtype: list
+        """
+        self.logger.debug(
+            'Rejecting request. %s in-flight with a limit of %s.',
+            self.in_flight, self.limit.limit)
+        start_response(
+            '503 Service Unavailable', [
+                ('content-type', 'text/html'),
+                ('Retry-After', str(self.retry_after))])
+        return [bytes('Service Unavailable', 'utf8')]
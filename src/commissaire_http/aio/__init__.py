@@ -0,0 +1,628 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+asyncio based Commissaire application server code.
+"""
+
+import asyncio
+import logging
+import socket
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from io import BytesIO
+from urllib.parse import unquote
+
+from routes.util import URLGenerator
+
+from commissaire_http.util.tls import TLSContext, get_common_name
+from commissaire_http.util.wsgi import FakeStartResponse, call_app_async
+
+
+class BadRequestError(Exception):
+    """
+    Raised when a request can not be parsed.
+    """
+
+    #: The status line of the response
+    status = '400 Bad Request'
+
+
+class RequestTooLargeError(BadRequestError):
+    """
+    Raised when a request body is larger than allowed.
+    """
+
+    #: The status line of the response
+    status = '413 Payload Too Large'
+
+
+class TransferEncodingError(BadRequestError):
+    """
+    Raised when a request body is sent with a Transfer-Encoding.
+    """
+
+    #: The status line of the response
+    status = '501 Not Implemented'
+
+
+class AsyncCommissaireHttpServer:
+    """
+    asyncio based Http Server for Commissaire.
+
+    Connections are handled on the event loop. Handlers which are
+    coroutines are awaited on the loop while all other handlers are run
+    in a thread pool, so a connection only holds a thread while blocking
+    code runs.
+    """
+
+    #: Class level logger
+    logger = logging.getLogger('AsyncCommissaireHttpServer')
+
+    #: Logger for the access log
+    access_logger = logging.getLogger('access')
+
+    #: The software version of the server
+    server_version = 'Commissaire/0.0.7'
+
+    #: Maximum number of header lines accepted in a request
+    max_headers = 100
+
+    def __init__(self, bind_host, bind_port, dispatcher,
+                 tls_pem_file=None, tls_clientverify_file=None,
+                 max_threads=32, max_queued=128,
+                 keep_alive_timeout=15, keep_alive_requests=100,
+                 tls_ciphers=None, tls_ecdh_curve=None,
+                 tls_ticket_key_lifetime=0, drain_timeout=30,
+                 listen_socket=None, max_body_size=1048576,
+                 header_timeout=10, body_timeout=30, idle_timeout=60):
+        """
+        Initializes a new AsyncCommissaireHttpServer instance.
+
+        :param bind_host: Host adapter to listen on.
+        :type bind_host: str
+        :param bind_port: Host port to listen on.
+        :type bind_port: int
+        :param dispatcher: Dispatcher instance (WSGI) to route and respond.
+        :type dispatcher: commissaire_http.dispatcher.Dispatcher
+        :param tls_pem_file: Full path to the PEM file for TLS.
+        :type tls_pem_file: str
+        :param tls_clientverify_file: Full path to CA to verify certs.
+        :type tls_clientverify_file: str
+        :param max_threads: Size of the thread pool running blocking
+                            handlers. 0 uses the asyncio default.
+        :type max_threads: int
+        :param max_queued: Size of the listen backlog.
+        :type max_queued: int
+        :param keep_alive_timeout: Seconds an idle persistent connection is
+                                   kept open. 0 disables persistence.
+        :type keep_alive_timeout: float
+        :param keep_alive_requests: Requests served on a persistent
+                                    connection before closing it.
+        :type keep_alive_requests: int
+        :param tls_ciphers: OpenSSL cipher list string.
+        :type tls_ciphers: str or None
+        :param tls_ecdh_curve: Name of the curve used for ECDH key exchange.
+        :type tls_ecdh_curve: str or None
+        :param tls_ticket_key_lifetime: Ignored. The listening socket keeps
+                                        one context for its lifetime.
+        :type tls_ticket_key_lifetime: float
+        :param drain_timeout: Seconds in-flight requests may take to finish
+                              once the server is stopped.
+        :type drain_timeout: float
+        :param listen_socket: A listening socket to serve on instead of
+                              binding bind_host and bind_port.
+        :type listen_socket: socket.socket or None
+        :param max_body_size: Largest request body in bytes. Larger
+                              requests are answered with a 413. 0 for no
+                              limit.
+        :type max_body_size: int
+        :param header_timeout: Seconds to receive the request line and
+                               headers of a request.
+        :type header_timeout: float
+        :param body_timeout: Seconds to receive a request body.
+        :type body_timeout: float
+        :param idle_timeout: Ignored. Waiting connections do not hold a
+                             thread.
+        :type idle_timeout: float
+        """
+        self._bind_host = bind_host
+        self._bind_port = bind_port
+        self._tls_pem_file = tls_pem_file
+        self._tls_clientverify_file = tls_clientverify_file
+        self._max_threads = max_threads or None
+        self._keep_alive_timeout = keep_alive_timeout
+        self._keep_alive_requests = keep_alive_requests
+        self.max_body_size = max_body_size
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+        self.drain_timeout = drain_timeout
+        self._loop = None
+        self._server = None
+        self._draining = False
+        self._active_requests = 0
+        #: Mapping of open connections to a future done once closed
+        self._connections = {}
+        self.dispatcher = dispatcher
+
+        # The socket is created up front so it can be shared by workers
+        if listen_socket is None:
+            listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listen_socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listen_socket.bind((self._bind_host, self._bind_port))
+            listen_socket.listen(max_queued)
+        self.socket = listen_socket
+        self.socket.setblocking(False)
+        if self.socket.family != socket.AF_UNIX:
+            self._bind_port = self.socket.getsockname()[1]
+
+        self.tls_context = None
+        if tls_pem_file:
+            self.tls_context = TLSContext(
+                self._tls_pem_file,
+                self._tls_clientverify_file,
+                ciphers=tls_ciphers,
+                ecdh_curve=tls_ecdh_curve)
+            if self._tls_clientverify_file:
+                self.logger.info(
+                    'Requiring client side certificate CA validation.')
+            self.logger.info('Using TLS with %s', self._tls_pem_file)
+
+        self.logger.debug(
+            'Created asyncio httpd server: %s', self.socket.getsockname())
+
+    @property
+    def port(self):
+        """
+        Get the port the server is listening on.
+        """
+        return self._bind_port
+
+    def tls_stats(self):
+        """
+        Returns the TLS handshake counters of this process.
+
+        :returns: Number of handshakes and of resumed sessions.
+        :rtype: dict
+        """
+        if self.tls_context is None:
+            return {'handshakes': 0, 'resumed': 0}
+        return self.tls_context.stats()
+
+    def serve_forever(self):
+        """
+        Serve HTTP.
+        """
+        self._loop = loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.set_default_executor(ThreadPoolExecutor(self._max_threads))
+        ssl_context = None
+        if self.tls_context is not None:
+            ssl_context = self.tls_context.context
+        start_server = asyncio.start_server
+        if self.socket.family == socket.AF_UNIX:
+            start_server = asyncio.start_unix_server
+        self._server = server = loop.run_until_complete(start_server(
+            self.handle_connection, sock=self.socket, ssl=ssl_context))
+        try:
+            loop.run_forever()
+        except Exception as error:
+            self.logger.error('Server shut down %s: %s', type(error), error)
+        finally:
+            server.close()
+            # Idle persistent connections are closed as well
+            for writer in list(self._connections.keys()):
+                writer.close()
+            if self._connections:
+                loop.run_until_complete(asyncio.wait(
+                    list(self._connections.values()), timeout=1))
+            loop.run_until_complete(server.wait_closed())
+            loop.close()
+            self._loop = None
+
+    def shutdown(self):
+        """
+        Stops serve_forever. Safe to call from any thread.
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def stop(self, signum=None, frame=None):
+        """
+        Stops accepting connections. serve_forever returns once in-flight
+        requests are finished. Safe to call from any thread and usable as
+        a signal handler.
+
+        :param signum: The signal number, if called as a signal handler.
+        :type signum: int or None
+        :param frame: The current stack frame, if called as a signal handler.
+        :type frame: frame or None
+        """
+        if self._loop is not None:
+            self.logger.info('Stopping. Draining in-flight requests.')
+            asyncio.run_coroutine_threadsafe(self.drain(), self._loop)
+
+    async def drain(self):
+        """
+        Closes the listening socket, waits up to drain_timeout seconds
+        for in-flight requests to finish and stops the loop.
+        """
+        self._draining = True
+        self._server.close()
+        deadline = self._loop.time() + self.drain_timeout
+        while self._active_requests and self._loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        if self._active_requests:
+            self.logger.warn(
+                'Requests still in-flight after %ss', self.drain_timeout)
+        self._loop.stop()
+
+    async def handle_connection(self, reader, writer):
+        """
+        Handles requests on a connection until it is closed.
+
+        :param reader: The stream to read requests from.
+        :type reader: asyncio.StreamReader
+        :param writer: The stream to write responses to.
+        :type writer: asyncio.StreamWriter
+        """
+        # Connection details, including the verified client certificate,
+        # are looked up once and reused for every request.
+        peer = writer.get_extra_info('peername')
+        connection_environ = {
+            # Unix domain socket clients have no address
+            'REMOTE_ADDR': peer[0] if isinstance(peer, tuple) else 'unix',
+            'SSL_CLIENT_VERIFY': None,
+        }
+        ssl_object = writer.get_extra_info('ssl_object')
+        if ssl_object is not None:
+            self.tls_context.record_handshake(ssl_object)
+            peercert = ssl_object.getpeercert()
+            connection_environ['SSL_CLIENT_VERIFY'] = peercert
+            common_name = get_common_name(peercert)
+            if common_name is not None:
+                connection_environ['SSL_CLIENT_S_DN_CN'] = common_name
+        closed = asyncio.Future()
+        self._connections[writer] = closed
+        try:
+            requests_handled = 0
+            keep_alive = True
+            while keep_alive and not self._draining:
+                # Kept connections may idle before the next request
+                timeout = self.header_timeout
+                if requests_handled > 0:
+                    timeout += self._keep_alive_timeout
+                try:
+                    environ = await asyncio.wait_for(self.read_request(
+                        reader, connection_environ), timeout)
+                    if environ is not None:
+                        await self.read_body(reader, environ)
+                except BadRequestError as error:
+                    self.logger.debug('Bad request: %s', error)
+                    self.write_response(
+                        writer, error.status,
+                        [('content-type', 'text/html')],
+                        bytes(error.status[4:], 'utf8'), False)
+                    await writer.drain()
+                    break
+                if environ is None:
+                    break
+                requests_handled += 1
+                self._active_requests += 1
+                try:
+                    keep_alive = await self.handle_request(
+                        environ, writer,
+                        self._keep_alive_timeout > 0 and
+                        requests_handled < self._keep_alive_requests)
+                finally:
+                    self._active_requests -= 1
+        except (ConnectionError, asyncio.IncompleteReadError,
+                asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+            del self._connections[writer]
+            closed.set_result(None)
+
+    async def read_request(self, reader, connection_environ):
+        """
+        Reads a request and builds the WSGI environment for it.
+
+        :param reader: The stream to read the request from.
+        :type reader: asyncio.StreamReader
+        :param connection_environ: WSGI environment items of the connection.
+        :type connection_environ: dict
+        :returns: The WSGI environment or None if the client went away.
+        :rtype: dict or None
+        :raises: BadRequestError
+        """
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return None
+            try:
+                method, target, version = request_line.decode(
+                    'iso-8859-1').split()
+            except ValueError:
+                raise BadRequestError(
+                    'Bad request line {!r}'.format(request_line))
+
+            headers = []
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                if len(headers) >= self.max_headers:
+                    raise BadRequestError('Too many headers')
+                headers.append(line.decode('iso-8859-1'))
+        except ValueError:
+            # Raised by readline when a line is over the limit
+            raise BadRequestError('Line too long')
+
+        path, _, query = target.partition('?')
+        environ = {
+            'REQUEST_METHOD': method.upper(),
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote(path, 'iso-8859-1'),
+            'QUERY_STRING': query,
+            'CONTENT_TYPE': '',
+            'CONTENT_LENGTH': '',
+            'SERVER_NAME': self._bind_host,
+            'SERVER_PORT': str(self._bind_port),
+            'SERVER_PROTOCOL': version,
+            'SERVER_SOFTWARE': self.server_version,
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'https' if self.tls_context else 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        environ.update(connection_environ)
+        for line in headers:
+            name, _, value = line.partition(':')
+            key = name.strip().upper().replace('-', '_')
+            value = value.strip()
+            if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[key] = value
+            elif 'HTTP_' + key in environ:
+                environ['HTTP_' + key] += ',' + value
+            else:
+                environ['HTTP_' + key] = value
+
+        return environ
+
+    async def read_body(self, reader, environ):
+        """
+        Reads the body of a request into the WSGI environment.
+
+        :param reader: The stream to read the body from.
+        :type reader: asyncio.StreamReader
+        :param environ: WSGI environment of the request.
+        :type environ: dict
+        :raises: BadRequestError, RequestTooLargeError,
+                 TransferEncodingError, asyncio.TimeoutError
+        """
+        # Bodies are only framed by Content-Length, see
+        # CommissaireRequestHandler.get_request_body
+        if 'HTTP_TRANSFER_ENCODING' in environ:
+            if environ['CONTENT_LENGTH']:
+                raise BadRequestError('Transfer-Encoding with Content-Length')
+            raise TransferEncodingError('Transfer-Encoding is not supported')
+        try:
+            content_length = int(environ['CONTENT_LENGTH'] or 0)
+        except ValueError:
+            raise BadRequestError('Bad Content-Length')
+        if 0 < self.max_body_size < content_length:
+            raise RequestTooLargeError(
+                'Body of {} bytes is over the limit'.format(content_length))
+        body = b''
+        if content_length > 0:
+            body = await asyncio.wait_for(
+                reader.readexactly(content_length), self.body_timeout)
+        environ['wsgi.input'] = BytesIO(body)
+
+    async def handle_request(self, environ, writer, keep_alive=True):
+        """
+        Routes and dispatches a request and writes the response.
+
+        :param environ: WSGI environment dictionary.
+        :type environ: dict
+        :param writer: The stream to write the response to.
+        :type writer: asyncio.StreamWriter
+        :param keep_alive: If the server allows reusing the connection.
+        :type keep_alive: bool
+        :returns: True if the connection may be reused.
+        :rtype: bool
+        """
+        started = time.monotonic()
+        router = self.dispatcher.router
+        results = router.routematch(environ=environ)
+        match, route = results if results else ({}, None)
+        url = URLGenerator(router, environ)
+        environ['wsgiorg.routing_args'] = ((url), match)
+        environ['routes.route'] = route
+        environ['routes.url'] = url
+
+        start_response = FakeStartResponse()
+        stream = None
+        try:
+            result = await call_app_async(
+                self.dispatcher.dispatch, environ, start_response)
+            if isinstance(result, (list, tuple)):
+                body = b''.join(result)
+                if hasattr(result, 'close'):
+                    result.close()
+            elif environ['SERVER_PROTOCOL'] != 'HTTP/1.1':
+                # Streamed bodies are produced off of the event loop
+                try:
+                    body = await asyncio.get_event_loop().run_in_executor(
+                        None, b''.join, result)
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+            else:
+                # Streamed bodies of unknown length are sent in chunks
+                stream = result
+        except Exception as error:
+            self.logger.error(
+                'Unhandled error %s: %s', type(error), error)
+            start_response(
+                '500 Internal Server Error',
+                [('content-type', 'text/html')])
+            body = b'Internal Server Error'
+
+        keep_alive = (keep_alive and not self._draining and
+                      self._wants_keep_alive(environ))
+        if stream is not None:
+            keep_alive = await self.write_chunked_response(
+                writer, start_response.code, start_response.headers,
+                stream, keep_alive)
+            self.log_request(environ, start_response.code, '-', started)
+            return keep_alive
+        self.write_response(
+            writer, start_response.code, start_response.headers,
+            body, keep_alive)
+        await writer.drain()
+        self.log_request(environ, start_response.code, len(body), started)
+        return keep_alive
+
+    def log_request(self, environ, status, size, started):
+        """
+        Logs a finished request as a key=value access log line.
+
+        :param environ: WSGI environment dictionary.
+        :type environ: dict
+        :param status: The HTTP status line, such as '200 OK'.
+        :type status: str
+        :param size: Bytes of the response body.
+        :type size: int or str
+        :param started: time.monotonic() when handling started.
+        :type started: float
+        """
+        self.access_logger.info(
+            'remote=%s method=%s path=%s status=%s size=%s duration_ms=%.3f',
+            environ.get('REMOTE_ADDR', '-'), environ['REQUEST_METHOD'],
+            environ['PATH_INFO'], status[:3], size,
+            (time.monotonic() - started) * 1000)
+
+    async def write_chunked_response(self, writer, status, headers,
+                                     stream, keep_alive):
+        """
+        Writes a response with chunked transfer encoding.
+
+        :param writer: The stream to write the response to.
+        :type writer: asyncio.StreamWriter
+        :param status: The HTTP status line, such as '200 OK'.
+        :type status: str
+        :param headers: The response headers.
+        :type headers: list
+        :param stream: The body of the response.
+        :type stream: iterable
+        :param keep_alive: If the connection will be reused.
+        :type keep_alive: bool
+        :returns: True if the connection may be reused.
+        :rtype: bool
+        """
+        writer.write(self._format_head(
+            status, headers, keep_alive, [('Transfer-Encoding', 'chunked')]))
+        loop = asyncio.get_event_loop()
+        try:
+            # Encoding and compressing the body runs in the executor so
+            # other connections are served meanwhile.
+            iterator = iter(stream)
+            while True:
+                data = await loop.run_in_executor(None, next, iterator, None)
+                if data is None:
+                    break
+                if data:
+                    writer.write(b''.join((
+                        bytes('{:x}\r\n'.format(len(data)), 'ascii'),
+                        data, b'\r\n')))
+                    await writer.drain()
+        except Exception as error:
+            # A partly sent response leaves the connection unusable
+            self.logger.error(
+                'Unhandled error while streaming %s: %s', type(error), error)
+            return False
+        finally:
+            if hasattr(stream, 'close'):
+                stream.close()
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+        return keep_alive
+
+    def write_response(self, writer, status, headers, body, keep_alive):
+        """
+        Writes a complete response.
+
+        :param writer: The stream to write the response to.
+        :type writer: asyncio.StreamWriter
+        :param status: The HTTP status line, such as '200 OK'.
+        :type status: str
+        :param headers: The response headers.
+        :type headers: list
+        :param body: The body of the response.
+        :type body: bytes
+        :param keep_alive: If the connection will be reused.
+        :type keep_alive: bool
+        """
+        writer.write(self._format_head(
+            status, headers, keep_alive,
+            [('Content-Length', str(len(body)))]) + body)
+
+    def _format_head(self, status, headers, keep_alive, framing):
+        """
+        Formats the status line and headers of a response.
+
+        :param status: The HTTP status line, such as '200 OK'.
+        :type status: str
+        :param headers: The response headers.
+        :type headers: list
+        :param keep_alive: If the connection will be reused.
+        :type keep_alive: bool
+        :param framing: Headers describing the length of the body.
+        :type framing: list
+        :returns: The encoded head of the response.
+        :rtype: bytes
+        """
+        lines = [
+            'HTTP/1.1 {}'.format(status),
+            'Date: {}'.format(formatdate(usegmt=True)),
+            'Server: {}'.format(self.server_version),
+            'Connection: {}'.format('keep-alive' if keep_alive else 'close'),
+        ]
+        for header, value in framing + [
+                (h, v) for h, v in headers if h.lower() != 'content-length']:
+            lines.append('{}: {}'.format(header, value))
+        lines.append('\r\n')
+        return '\r\n'.join(lines).encode('iso-8859-1')
+
+    def _wants_keep_alive(self, environ):
+        """
+        Checks if the client wants to reuse the connection.
+
+        :param environ: WSGI environment dictionary.
+        :type environ: dict
+        :returns: True if the connection may be reused.
+        :rtype: bool
+        """
+        connection = environ.get('HTTP_CONNECTION', '').lower()
+        if environ['SERVER_PROTOCOL'] == 'HTTP/1.1':
+            return connection != 'close'
+        return connection == 'keep-alive'
@@ -16,10 +16,15 @@
 Authentication related code for Commissaire.
 """
 
+import asyncio
+import importlib.util
 import logging
 import base64
+import threading
 
-from commissaire_http.util.wsgi import FakeStartResponse
+from commissaire.util.config import ConfigurationError, import_plugin
+
+from commissaire_http.util.wsgi import FakeStartResponse, call_app_async
 
 
 class Authenticator:
@@ -102,6 +107,69 @@ class Authenticator:
         return False
 
 
+class LazyAuthenticator(Authenticator):
+    """
+    Imports and creates an Authenticator plugin when it is first used.
+    """
+
+    #: Package plugins are looked up in when not found by their own name
+    base_package = 'commissaire_http.authentication'
+
+    def __init__(self, module_name, **kwargs):
+        """
+        Initialize a new instance of LazyAuthenticator. The plugin module
+        is looked up but not imported.
+
+        :param module_name: Name of the plugin module.
+        :type module_name: str
+        :param kwargs: Keyword arguments for the plugin.
+        :type kwargs: dict
+        :raises: commissaire.util.config.ConfigurationError
+        """
+        super(LazyAuthenticator, self).__init__(None)
+        for name in (module_name, self.base_package + '.' + module_name):
+            try:
+                if importlib.util.find_spec(name) is not None:
+                    break
+            except ImportError:
+                pass
+        else:
+            raise ConfigurationError(
+                'Authentication plugin "{}" not found.'.format(module_name))
+        self.module_name = module_name
+        self.kwargs = kwargs
+        self._authenticator = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Imports and creates the plugin unless that was done already.
+
+        :returns: The plugin.
+        :rtype: Authenticator
+        """
+        if self._authenticator is None:
+            with self._lock:
+                if self._authenticator is None:
+                    plugin_class = import_plugin(
+                        self.module_name, self.base_package, Authenticator)
+                    self._authenticator = plugin_class(None, **self.kwargs)
+        return self._authenticator
+
+    def authenticate(self, environ, start_response):
+        """
+        Authenticates with the plugin.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :returns: What the plugin returns.
+        :rtype: bool or list
+        """
+        return self.load().authenticate(environ, start_response)
+
+
 class AuthenticationManager:
     """
     Handles stacking Authenticators.
@@ -137,13 +205,48 @@ class AuthenticationManager:
         :returns: Response back to requestor.
         :rtype: list
         """
+        denied = self._authenticate(environ, start_response)
+        if denied is not None:
+            return denied
+        return self._app(environ, start_response)
+
+    async def call_async(self, environ, start_response):
+        """
+        Coroutine version of __call__ used by the asyncio server. The
+        Authenticators may block so they are run in the executor.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :returns: Response back to requestor.
+        :rtype: list
+        """
+        loop = asyncio.get_event_loop()
+        denied = await loop.run_in_executor(
+            None, self._authenticate, environ, start_response)
+        if denied is not None:
+            return denied
+        return await call_app_async(self._app, environ, start_response)
+
+    def _authenticate(self, environ, start_response):
+        """
+        Runs through the configured Authenticators.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :returns: None if the request may pass, else the response body.
+        :rtype: None or list
+        """
         # If the endpoint self authenticates then pass directly
         # to the handler
         if environ['PATH_INFO'] in self.self_auths:
             self.logger.debug(('%s is in the self_auths list. '
                                'Passing directly to the endpoint.'),
                               environ['PATH_INFO'])
-            return self._app(environ, start_response)
+            return None
 
         # Create the fake start_response instance
         fake_start_response = FakeStartResponse()
@@ -158,7 +261,7 @@ class AuthenticationManager:
                 self.logger.debug(
                     '%s succeeded authentication.',
                     authenticator.__class__.__name__)
-                return self._app(environ, start_response)
+                return None
             # The plugin handled it's own start_response and
             # return data. Pull from the fake_start_response and return
             # the result from authenticate.
@@ -51,12 +51,19 @@ class HTTPClientCertAuth(Authenticator):
         :returns: True on success, False on failure
         :rtype: bool
         """
+        # The server extracts the first commonName once per connection
+        common_name = environ.get('SSL_CLIENT_S_DN_CN')
+        if common_name is not None and (not self.cn or common_name == self.cn):
+            environ['REMOTE_USER'] = common_name
+            return True
+
         cert = environ.get('SSL_CLIENT_VERIFY')
         if cert:
             for obj in cert.get('subject', ()):
                 for key, value in obj:
                     if key == 'commonName' and \
                             (not self.cn or value == self.cn):
+                        environ['REMOTE_USER'] = value
                         return True
 
         # Forbid by default
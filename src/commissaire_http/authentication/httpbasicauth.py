@@ -136,6 +136,7 @@ class HTTPBasicAuth(Authenticator):
             if user in self._data.keys():
                 self.logger.debug('User %s found in datastore.', user)
                 if self.check_authentication(user, passwd):
+                    environ['REMOTE_USER'] = user
                     return True  # Authentication is good
 
         # Forbid by default
@@ -95,6 +95,7 @@ class KeystonePassword(Authenticator):
             start_response('200 OK', [
                            ('content-type', 'application/json'),
                            (subject_token_name, token)])
+            environ['REMOTE_USER'] = user
             return True
 
         # Forbid by default
@@ -16,13 +16,30 @@
 Bus related classes and functions.
 """
 
+import asyncio
 import logging
+import time
+
+from functools import partial
 
 from kombu import Connection, Exchange, Producer, Queue
 
-from commissaire.bus import BusMixin
+from commissaire.bus import BusMixin, RemoteProcedureCallError
 from commissaire.storage.client import StorageClient
 
+from commissaire_http import deadline, timing
+from commissaire_http.circuitbreaker import BREAKERS
+from commissaire_http.metrics import REGISTRY
+
+#: Seconds bus requests took by routing key
+REQUEST_DURATION = REGISTRY.histogram(
+    'commissaire_http_bus_request_duration_seconds',
+    'Seconds taken by bus requests.', ('routing_key',))
+#: Bus requests which raised by routing key
+REQUEST_ERRORS = REGISTRY.counter(
+    'commissaire_http_bus_request_errors_total',
+    'Bus requests which failed.', ('routing_key',))
+
 
 class Bus(BusMixin):
     """
@@ -44,6 +61,7 @@ class Bus(BusMixin):
         self.logger.debug('Initializing bus connection')
         self.connection = None
         self._channel = None
+        self._ping_connection = None
         self._exchange = None
         self.exchange_name = exchange_name
         self.connection_url = connection_url
@@ -95,6 +113,114 @@ class Bus(BusMixin):
         self.logger.debug('Bus connection finished')
         return self
 
+    @property
+    def connected(self):
+        """
+        Returns the connection state without doing any I/O.
+
+        :returns: True if the bus is connected.
+        :rtype: bool
+        """
+        return bool(self.connection is not None and self.connection.connected)
+
+    def ping(self, timeout=2.0):
+        """
+        Checks that the broker answers and the exchange exists. A separate
+        connection is used since channels can not be shared between
+        threads.
+
+        :param timeout: Seconds the broker may take to answer.
+        :type timeout: float
+        :raises: Exception if the broker can not be reached.
+        """
+        if self.connection is None:
+            raise ConnectionError('Bus is not connected')
+        if self._ping_connection is None:
+            self._ping_connection = self.connection.clone(
+                connect_timeout=timeout)
+        try:
+            self._ping_connection.ensure_connection(max_retries=1)
+            Exchange(self.exchange_name, type='topic').bind(
+                self._ping_connection.default_channel).declare(passive=True)
+        except Exception:
+            # Reconnect on the next ping
+            self._ping_connection.release()
+            self._ping_connection = None
+            raise
+
+    def request(self, routing_key, *args, **kwargs):
+        """
+        Sends a request and waits for the response, recording how long the
+        request took. Storage requests are timed as their own stage.
+
+        Requests which can not reach the service count towards opening the
+        circuit breaker of the routing key, and while it is open requests
+        fail right away.
+
+        When the caller is bound to a request deadline, requests are not
+        sent once it passed, and a response arriving after it is dropped.
+
+        :param routing_key: Routing key for the request.
+        :type routing_key: str
+        :param args: Other non-keyword arguments to pass to request.
+        :type args: tuple
+        :param kwargs: Keyword arguments to pass to request.
+        :type kwargs: dict
+        :returns: The jsonrpc response.
+        :rtype: dict
+        :raises: commissaire_http.circuitbreaker.CircuitOpenError
+        :raises: commissaire_http.deadline.DeadlineExceededError
+        """
+        deadline.check(routing_key)
+        breaker = None
+        if BREAKERS.enabled:
+            breaker = BREAKERS.get(routing_key)
+            breaker.before()
+        started = time.monotonic()
+        failed = False
+        try:
+            response = super(Bus, self).request(routing_key, *args, **kwargs)
+        except RemoteProcedureCallError:
+            # The service answered with an error
+            REQUEST_ERRORS.inc((routing_key,))
+            raise
+        except Exception:
+            failed = True
+            REQUEST_ERRORS.inc((routing_key,))
+            raise
+        finally:
+            if breaker is not None:
+                breaker.record(failed)
+            elapsed = time.monotonic() - started
+            REQUEST_DURATION.observe(elapsed, (routing_key,))
+            if timing.enabled:
+                timing.record(
+                    'storage' if routing_key.startswith('storage.')
+                    else 'bus', elapsed)
+        # The client stopped waiting while the request was sent
+        deadline.check('using the response of ' + routing_key)
+        return response
+
+    def request_async(self, routing_key, *args, **kwargs):
+        """
+        Sends a request from a coroutine. The blocking request is run in
+        the event loop's executor so the loop itself is never blocked. The
+        deadline of the calling task is carried into the executor.
+
+        :param routing_key: Routing key for the request.
+        :type routing_key: str
+        :param args: Other non-keyword arguments to pass to request.
+        :type args: tuple
+        :param kwargs: Keyword arguments to pass to request.
+        :type kwargs: dict
+        :returns: A future for the jsonrpc response.
+        :rtype: asyncio.Future
+        """
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(None, partial(
+            deadline.call_bound, deadline.get_deadline(),
+            self.request, routing_key, *args, **kwargs))
+
     def respond(self, queue_name, id, payload, **kwargs):  # pragma: no cover
         """
         Sends a response to a simple queue. Responses are sent back to a
@@ -0,0 +1,282 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Circuit breakers for bus requests.
+
+A breaker opens once too many requests for a routing key fail, and while
+open requests for the key fail right away instead of waiting for the bus
+to time out. After a while a single request is let through to probe if
+the service is back.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+from commissaire_http.metrics import REGISTRY
+
+#: Requests are passed on and failures counted
+CLOSED = 'closed'
+#: Requests fail right away
+OPEN = 'open'
+#: A single request is passed on to probe the service
+HALF_OPEN = 'half_open'
+
+#: Values of the states in the state metric
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+#: Requests failed right away by routing key
+REJECTED = REGISTRY.counter(
+    'commissaire_http_circuit_breaker_rejected_total',
+    'Bus requests failed by an open circuit breaker.', ('routing_key',))
+#: Times breakers opened by routing key
+OPENED = REGISTRY.counter(
+    'commissaire_http_circuit_breaker_opened_total',
+    'Times circuit breakers opened.', ('routing_key',))
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request while its breaker is open.
+    """
+
+    def __init__(self, key, retry_after):
+        """
+        Initializes a new CircuitOpenError instance.
+
+        :param key: The routing key of the breaker.
+        :type key: str
+        :param retry_after: Seconds until the breaker lets a probe through.
+        :type retry_after: float
+        """
+        super(CircuitOpenError, self).__init__(
+            'Circuit breaker for {} is open'.format(key))
+        self.key = key
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Breaker for the requests of a single routing key. Failures are counted
+    in buckets over a sliding window.
+    """
+
+    #: Logger for CircuitBreaker
+    logger = logging.getLogger('CircuitBreaker')
+
+    #: Buckets the window is split in
+    buckets = 10
+
+    def __init__(self, key, failure_ratio=0.5, min_requests=10,
+                 window=10.0, reset_timeout=5.0):
+        """
+        Initializes a new CircuitBreaker instance.
+
+        :param key: The routing key of the requests.
+        :type key: str
+        :param failure_ratio: Ratio of failed requests in the window which
+                              opens the breaker.
+        :type failure_ratio: float
+        :param min_requests: Requests in the window before the ratio is
+                             considered.
+        :type min_requests: int
+        :param window: Seconds requests are counted for.
+        :type window: float
+        :param reset_timeout: Seconds the breaker stays open before a probe.
+        :type reset_timeout: float
+        """
+        self.key = key
+        self.failure_ratio = failure_ratio
+        self.min_requests = min_requests
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.opened = None
+        self._probing = False
+        #: Buckets of [started, requests, failures]
+        self._counts = collections.deque()
+        self._lock = threading.Lock()
+
+    def before(self):
+        """
+        Called before sending a request.
+
+        :raises: CircuitOpenError if the request may not be sent.
+        """
+        if self.state == CLOSED:
+            return
+        with self._lock:
+            if self.state == OPEN:
+                retry_after = (
+                    self.opened + self.reset_timeout - time.monotonic())
+                if retry_after > 0:
+                    REJECTED.inc((self.key,))
+                    raise CircuitOpenError(self.key, retry_after)
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    REJECTED.inc((self.key,))
+                    raise CircuitOpenError(self.key, self.reset_timeout)
+                self._probing = True
+
+    def record(self, failed):
+        """
+        Called with the outcome of a request which was sent.
+
+        :param failed: True if the service could not be reached.
+        :type failed: bool
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if failed:
+                    self._open(now)
+                else:
+                    self._counts.clear()
+                    self._set_state(CLOSED)
+                return
+            if self.state == OPEN:
+                # Sent before the breaker opened
+                return
+
+            counts = self._counts
+            while counts and now - counts[0][0] >= self.window:
+                counts.popleft()
+            if not counts or now - counts[-1][0] >= self.window / self.buckets:
+                counts.append([now, 0, 0])
+            counts[-1][1] += 1
+            if failed:
+                counts[-1][2] += 1
+                requests = sum(bucket[1] for bucket in counts)
+                failures = sum(bucket[2] for bucket in counts)
+                if (requests >= self.min_requests and
+                        failures >= requests * self.failure_ratio):
+                    self._open(now)
+
+    def _open(self, now):
+        """
+        Opens the breaker.
+
+        :param now: time.monotonic() of the failure which opened it.
+        :type now: float
+        """
+        self.opened = now
+        self._counts.clear()
+        OPENED.inc((self.key,))
+        self._set_state(OPEN)
+
+    def _set_state(self, state):
+        """
+        Changes the state of the breaker.
+
+        :param state: The new state.
+        :type state: str
+        """
+        self.logger.warning(
+            'Circuit breaker for %s changed from %s to %s',
+            self.key, self.state, state)
+        self.state = state
+
+
+class CircuitBreakers:
+    """
+    The circuit breakers of all routing keys.
+    """
+
+    def __init__(self, failure_ratio=0.5, min_requests=10, window=10.0,
+                 reset_timeout=5.0):
+        """
+        Initializes a new CircuitBreakers instance.
+
+        :param failure_ratio: Ratio of failed requests in the window which
+                              opens a breaker. 0 disables the breakers.
+        :type failure_ratio: float
+        :param min_requests: Requests in the window before the ratio is
+                             considered.
+        :type min_requests: int
+        :param window: Seconds requests are counted for.
+        :type window: float
+        :param reset_timeout: Seconds a breaker stays open before a probe.
+        :type reset_timeout: float
+        """
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self.configure(failure_ratio, min_requests, window, reset_timeout)
+
+    def configure(self, failure_ratio=0.5, min_requests=10, window=10.0,
+                  reset_timeout=5.0):
+        """
+        Changes the settings of the breakers. Existing breakers are reset.
+
+        :param failure_ratio: Ratio of failed requests in the window which
+                              opens a breaker. 0 disables the breakers.
+        :type failure_ratio: float
+        :param min_requests: Requests in the window before the ratio is
+                             considered.
+        :type min_requests: int
+        :param window: Seconds requests are counted for.
+        :type window: float
+        :param reset_timeout: Seconds a breaker stays open before a probe.
+        :type reset_timeout: float
+        """
+        with self._lock:
+            self.enabled = failure_ratio > 0
+            self._settings = {
+                'failure_ratio': failure_ratio,
+                'min_requests': min_requests,
+                'window': window,
+                'reset_timeout': reset_timeout,
+            }
+            self._breakers = {}
+
+    def get(self, key):
+        """
+        Gets the breaker of a routing key, creating it when first used.
+
+        :param key: The routing key.
+        :type key: str
+        :returns: The breaker.
+        :rtype: CircuitBreaker
+        """
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(key)
+                if breaker is None:
+                    breaker = CircuitBreaker(key, **self._settings)
+                    self._breakers[key] = breaker
+        return breaker
+
+    def states(self):
+        """
+        Returns the states of the breakers for use in metrics.
+
+        :returns: Mapping of (routing key,) to the value of the state.
+        :rtype: dict
+        """
+        return {
+            (key,): STATE_VALUES[breaker.state]
+            for key, breaker in list(self._breakers.items())}
+
+
+#: The circuit breakers of the server's bus requests
+BREAKERS = CircuitBreakers()
+
+REGISTRY.callback(
+    'commissaire_http_circuit_breaker_state',
+    'State of circuit breakers. 0 is closed, 1 half open and 2 open.',
+    BREAKERS.states, ('routing_key',))
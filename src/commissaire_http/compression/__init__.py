@@ -0,0 +1,324 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Response compression for Commissaire.
+"""
+
+import asyncio
+import hashlib
+import itertools
+import logging
+import threading
+import zlib
+
+from collections import OrderedDict
+
+from commissaire_http.util.wsgi import (
+    ClosingIterator, FakeStartResponse, call_app_async)
+
+
+def parse_accept_encoding(header):
+    """
+    Parses an Accept-Encoding header.
+
+    :param header: The value of the Accept-Encoding header.
+    :type header: str
+    :returns: Mapping of lower case coding to its quality.
+    :rtype: dict
+    """
+    codings = {}
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        codings[coding] = quality
+    return codings
+
+
+class CompressionMiddleware:
+    """
+    WSGI middleware compressing responses for clients which accept it.
+
+    Only bodies of compressible content types and at least min_size bytes
+    are compressed. When cache_size is set, compressed bodies are kept so
+    identical responses, such as a polled list, are compressed once.
+
+    Streamed bodies are read ahead up to min_size, or max_cached_size when
+    caching. Bodies which end within that are handled like any other body,
+    so they are cached or, when small, sent as is. Longer ones are
+    compressed a chunk at a time as they are sent.
+    """
+
+    #: Logger for CompressionMiddleware
+    logger = logging.getLogger('CompressionMiddleware')
+
+    #: Supported codings in order of preference
+    codings = ('gzip', 'deflate')
+
+    #: Content types which are compressed
+    compressible_types = ('application/json', 'text/')
+
+    #: Largest streamed body in bytes read ahead to be cached
+    max_cached_size = 1048576
+
+    def __init__(self, app, min_size=1024, level=6, cache_size=0):
+        """
+        Initializes a new CompressionMiddleware instance.
+
+        :param app: A WSGI app to wrap.
+        :type app: instance
+        :param min_size: Smallest body in bytes which is compressed.
+        :type min_size: int
+        :param level: zlib compression level from 1 to 9.
+        :type level: int
+        :param cache_size: Compressed bodies to cache. 0 disables caching.
+        :type cache_size: int
+        """
+        self._app = app
+        self.min_size = min_size
+        self.level = level
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        """
+        Calls the app and compresses its response if possible.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :returns: Response back to requestor.
+        :rtype: list
+        """
+        app_start_response = FakeStartResponse()
+        result = self._app(environ, app_start_response)
+        return self._respond(
+            environ, start_response, app_start_response, result)
+
+    async def call_async(self, environ, start_response):
+        """
+        Coroutine version of __call__ used by the asyncio server.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :returns: Response back to requestor.
+        :rtype: list
+        """
+        app_start_response = FakeStartResponse()
+        result = await call_app_async(
+            self._app, environ, app_start_response)
+        if isinstance(result, (list, tuple)):
+            return self._respond(
+                environ, start_response, app_start_response, result)
+        # Reading ahead produces the body, which is kept off the event loop
+        return await asyncio.get_event_loop().run_in_executor(
+            None, self._respond, environ, start_response,
+            app_start_response, result)
+
+    def choose_coding(self, environ):
+        """
+        Chooses the coding to use for the client.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :returns: The coding or None to send the body as is.
+        :rtype: str or None
+        """
+        accepted = parse_accept_encoding(
+            environ.get('HTTP_ACCEPT_ENCODING', ''))
+        best = None
+        for coding in self.codings:
+            quality = accepted.get(coding, accepted.get('*', 0))
+            if quality > 0 and (best is None or quality > best[1]):
+                best = (coding, quality)
+        return best[0] if best else None
+
+    def compress(self, body, coding):
+        """
+        Compresses a body, using the cache when enabled.
+
+        :param body: The body to compress.
+        :type body: bytes
+        :param coding: gzip or deflate.
+        :type coding: str
+        :returns: The compressed body.
+        :rtype: bytes
+        """
+        if not self.cache_size:
+            return self._compress(body, coding)
+
+        key = (coding, len(body), hashlib.sha1(body).digest())
+        with self._cache_lock:
+            compressed = self._cache.get(key)
+            if compressed is not None:
+                self._cache.move_to_end(key)
+                return compressed
+
+        compressed = self._compress(body, coding)
+        with self._cache_lock:
+            self._cache[key] = compressed
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return compressed
+
+    def _compress(self, body, coding):
+        """
+        Compresses a body.
+
+        :param body: The body to compress.
+        :type body: bytes
+        :param coding: gzip or deflate.
+        :type coding: str
+        :returns: The compressed body.
+        :rtype: bytes
+        """
+        compressor = self._compressor(coding)
+        return compressor.compress(body) + compressor.flush()
+
+    def _compress_stream(self, result, coding):
+        """
+        Compresses a body as it is iterated.
+
+        :param result: The body to compress.
+        :type result: iterable
+        :param coding: gzip or deflate.
+        :type coding: str
+        :returns: A generator of compressed data.
+        :rtype: generator
+        """
+        compressor = self._compressor(coding)
+        for data in result:
+            data = compressor.compress(data)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    def _read_ahead(self, result):
+        """
+        Reads the start of a streamed body.
+
+        :param result: The streamed body.
+        :type result: iterable
+        :returns: The whole body as a list if it ended within the read
+                  ahead limit, else an iterator over the whole body.
+        :rtype: list or ClosingIterator
+        """
+        limit = self.min_size
+        if self.cache_size:
+            limit = max(limit, self.max_cached_size)
+        close = getattr(result, 'close', None)
+        iterator = iter(result)
+        chunks = []
+        size = 0
+        try:
+            for data in iterator:
+                chunks.append(data)
+                size += len(data)
+                if size > limit:
+                    callbacks = [close] if close is not None else []
+                    return ClosingIterator(
+                        itertools.chain(chunks, iterator), *callbacks)
+        except BaseException:
+            if close is not None:
+                close()
+            raise
+        if close is not None:
+            close()
+        return chunks
+
+    def _compressor(self, coding):
+        """
+        Creates a compressor.
+
+        :param coding: gzip or deflate.
+        :type coding: str
+        :returns: A new compressor.
+        :rtype: zlib.Compress
+        """
+        if coding == 'gzip':
+            # A gzip header without a timestamp
+            return zlib.compressobj(
+                self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return zlib.compressobj(self.level)
+
+    def _respond(self, environ, start_response, app_start_response, result):
+        """
+        Starts the response of the app, compressing the body if possible.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :param app_start_response: What the app passed to start_response.
+        :type app_start_response: FakeStartResponse
+        :param result: The body returned by the app.
+        :type result: iterable
+        :returns: Response back to requestor.
+        :rtype: list or generator
+        """
+        headers = list(app_start_response.headers)
+        names = {name.lower(): value for name, value in headers}
+        content_type = names.get('content-type', '')
+        if ('content-encoding' in names or
+                not content_type.startswith(self.compressible_types)):
+            start_response(app_start_response.code, headers)
+            return result
+
+        # The response differs depending on Accept-Encoding
+        vary = names.get('vary')
+        headers = [(n, v) for n, v in headers if n.lower() != 'vary']
+        headers.append((
+            'Vary', vary + ', Accept-Encoding' if vary else 'Accept-Encoding'))
+
+        coding = self.choose_coding(environ)
+        if coding is not None and not isinstance(result, (list, tuple)):
+            result = self._read_ahead(result)
+        if coding is not None and not isinstance(result, (list, tuple)):
+            # Long streamed bodies are compressed as they are sent
+            headers = [(n, v) for n, v in headers
+                       if n.lower() != 'content-length']
+            headers.append(('Content-Encoding', coding))
+            # The body is closed even if it is never iterated
+            callbacks = [result.close] if hasattr(result, 'close') else []
+            result = ClosingIterator(
+                self._compress_stream(result, coding), *callbacks)
+        elif coding is not None:
+            body = b''.join(result)
+            if hasattr(result, 'close'):
+                result.close()
+            if len(body) >= self.min_size:
+                body = self.compress(body, coding)
+                headers = [(n, v) for n, v in headers
+                           if n.lower() != 'content-length']
+                headers.extend([
+                    ('Content-Encoding', coding),
+                    ('Content-Length', str(len(body)))])
+            result = [body]
+
+        start_response(app_start_response.code, headers)
+        return result
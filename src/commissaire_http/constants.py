@@ -22,6 +22,10 @@ from commissaire.constants import JSONRPC_ERRORS
 JSONRPC_ERRORS['404'] = JSONRPC_ERRORS['NOT_FOUND']
 JSONRPC_ERRORS['400'] = JSONRPC_ERRORS['INVALID_REQUEST']
 JSONRPC_ERRORS['BAD_REQUEST'] = JSONRPC_ERRORS['INVALID_REQUEST']
+# A service on the bus can not be reached
+JSONRPC_ERRORS['SERVICE_UNAVAILABLE'] = -32001
+# The deadline of the request passed
+JSONRPC_ERRORS['GATEWAY_TIMEOUT'] = -32002
 
 ROUTING_RX_PARAMS = {
     'name': R'[a-zA-Z0-9\-\_]+',
@@ -0,0 +1,291 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Per request deadlines.
+
+A request's deadline comes from the server configuration and may be
+shortened by the client with the X-Request-Timeout header. Handlers run
+bound to the deadline of their request, and every bus request made while
+bound checks the time left first, so work stops once the client stopped
+waiting.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+import weakref
+
+from commissaire_http.util.wsgi import ClosingIterator, call_app_async
+
+#: Key of the deadline, a time.monotonic() value, in the WSGI environment
+ENVIRON_KEY = 'commissaire.deadline'
+
+#: WSGI environment key of the X-Request-Timeout header
+HEADER_KEY = 'HTTP_X_REQUEST_TIMEOUT'
+
+_local = threading.local()
+
+#: Deadlines of coroutine handlers by task
+_tasks = weakref.WeakKeyDictionary()
+
+try:
+    _current_task = asyncio.current_task
+except AttributeError:  # pragma: no cover
+    # Python < 3.7
+    _current_task = asyncio.Task.current_task
+
+
+class DeadlineExceededError(Exception):
+    """
+    Raised instead of doing work for a request whose deadline has passed.
+    """
+    pass
+
+
+def _task():
+    """
+    Returns the task running in the calling thread, if any.
+
+    :returns: The task or None.
+    :rtype: asyncio.Task or None
+    """
+    try:
+        return _current_task()
+    except RuntimeError:
+        # No event loop in this thread
+        return None
+
+
+def get_deadline():
+    """
+    Returns the deadline the calling thread or task is bound to.
+
+    :returns: The time.monotonic() value of the deadline or None.
+    :rtype: float or None
+    """
+    task = _task()
+    if task is not None and task in _tasks:
+        return _tasks[task]
+    return getattr(_local, 'deadline', None)
+
+
+def check(what='request'):
+    """
+    Checks that the deadline the caller is bound to has not passed.
+
+    :param what: Description of the work about to be done, for the error.
+    :type what: str
+    :returns: Seconds left or None without a deadline.
+    :rtype: float or None
+    :raises: DeadlineExceededError
+    """
+    deadline = get_deadline()
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceededError(
+            'Deadline exceeded by {:.3f}s before {}'.format(-remaining, what))
+    return remaining
+
+
+class BoundDeadline:
+    """
+    Context manager binding the calling thread, or the running task, to a
+    deadline.
+    """
+
+    def __init__(self, deadline):
+        """
+        Initializes a new BoundDeadline instance.
+
+        :param deadline: The time.monotonic() value of the deadline or None.
+        :type deadline: float or None
+        """
+        self.deadline = deadline
+        self._task = None
+        self._previous = None
+
+    def __enter__(self):
+        """
+        Binds to the deadline.
+        """
+        self._task = _task()
+        if self._task is not None:
+            self._previous = _tasks.get(self._task)
+            _tasks[self._task] = self.deadline
+        else:
+            self._previous = getattr(_local, 'deadline', None)
+            _local.deadline = self.deadline
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Restores the deadline bound before.
+        """
+        if self._task is not None:
+            if self._previous is None:
+                _tasks.pop(self._task, None)
+            else:
+                _tasks[self._task] = self._previous
+        else:
+            _local.deadline = self._previous
+
+
+def call_bound(deadline, func, *args, **kwargs):
+    """
+    Calls a function bound to a deadline. Used to carry the deadline into
+    executor threads.
+
+    :param deadline: The time.monotonic() value of the deadline or None.
+    :type deadline: float or None
+    :param func: The function to call.
+    :type func: callable
+    :param args: Non-keyword arguments for the function.
+    :type args: tuple
+    :param kwargs: Keyword arguments for the function.
+    :type kwargs: dict
+    :returns: What the function returns.
+    :rtype: mixed
+    """
+    with BoundDeadline(deadline):
+        return func(*args, **kwargs)
+
+
+class BoundIterator(ClosingIterator):
+    """
+    Iterates a response body bound to a deadline. Streamed bodies are
+    produced after the handler returned, possibly in other threads.
+    """
+
+    def __init__(self, deadline, iterable):
+        """
+        Initializes a new BoundIterator instance.
+
+        :param deadline: The time.monotonic() value of the deadline or None.
+        :type deadline: float or None
+        :param iterable: The response body.
+        :type iterable: iterable
+        """
+        super(BoundIterator, self).__init__(iterable)
+        self.deadline = deadline
+
+    def __next__(self):
+        """
+        Returns the next part of the response body.
+        """
+        with BoundDeadline(self.deadline):
+            return next(self._iterator)
+
+
+class DeadlineMiddleware:
+    """
+    WSGI middleware which sets the deadline of each request. Requests for
+    exempt paths, such as probes and metrics, get no deadline.
+    """
+
+    #: Logger for DeadlineMiddleware
+    logger = logging.getLogger('DeadlineMiddleware')
+
+    def __init__(self, app, timeout=0, exempt_paths=None):
+        """
+        Initializes a new DeadlineMiddleware instance.
+
+        :param app: A WSGI app to wrap.
+        :type app: instance
+        :param timeout: Seconds requests may take. 0 only applies timeouts
+                        given by clients.
+        :type timeout: float
+        :param exempt_paths: Paths passed through without a deadline.
+        :type exempt_paths: None or [str]
+        """
+        self._app = app
+        self.timeout = timeout
+        self.exempt_paths = frozenset(exempt_paths or ())
+
+    def __call__(self, environ, start_response):
+        """
+        Sets the deadline and passes the request to the app.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :returns: Response back to requestor.
+        :rtype: list
+        """
+        if environ.get('PATH_INFO') in self.exempt_paths:
+            return self._app(environ, start_response)
+        if not self._set_deadline(environ):
+            return self._bad_request(start_response)
+        return self._app(environ, start_response)
+
+    async def call_async(self, environ, start_response):
+        """
+        Coroutine version of __call__ used by the asyncio server.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :returns: Response back to requestor.
+        :rtype: list
+        """
+        if environ.get('PATH_INFO') in self.exempt_paths:
+            return await call_app_async(self._app, environ, start_response)
+        if not self._set_deadline(environ):
+            return self._bad_request(start_response)
+        return await call_app_async(self._app, environ, start_response)
+
+    def _set_deadline(self, environ):
+        """
+        Adds the deadline to the WSGI environment. A client may only make
+        it earlier than the configured one.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :returns: False if the header is not a positive number of seconds.
+        :rtype: bool
+        """
+        timeout = self.timeout
+        header = environ.get(HEADER_KEY)
+        if header is not None:
+            try:
+                requested = float(header)
+            except ValueError:
+                requested = 0
+            # NaN and infinite timeouts are not accepted either
+            if not 0 < requested < float('inf'):
+                self.logger.debug('Invalid X-Request-Timeout: %s', header)
+                return False
+            if timeout <= 0 or requested < timeout:
+                timeout = requested
+        if timeout > 0:
+            environ[ENVIRON_KEY] = time.monotonic() + timeout
+        return True
+
+    def _bad_request(self, start_response):
+        """
+        Answers a request with an invalid X-Request-Timeout header.
+
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :returns: Response back to requestor.
+        :rtype: list
+        """
+        start_response(
+            '400 Bad Request', [('content-type', 'text/html')])
+        return [bytes('Invalid X-Request-Timeout', 'utf8')]
@@ -16,14 +16,38 @@
 Prototype dispatcher.
 """
 
+import ast
+import importlib.util
 import logging
+import math
+import os
+import sys
+import threading
+import time
 import traceback
 
+from functools import lru_cache, partial
 from importlib import import_module
 from inspect import isclass
 
+from commissaire_http import timing
 from commissaire_http.bus import Bus
-from commissaire_http.handlers import BasicHandler
+from commissaire_http.circuitbreaker import CircuitOpenError
+from commissaire_http.deadline import DeadlineExceededError
+from commissaire_http.metrics import REGISTRY
+from commissaire_http.util.wsgi import call_app_async, close_when_done
+
+#: Requests dispatched by controller, method and status code
+REQUESTS = REGISTRY.counter(
+    'commissaire_http_requests_total', 'Requests dispatched.',
+    ('controller', 'method', 'code'))
+#: Seconds handlers took by controller
+REQUEST_DURATION = REGISTRY.histogram(
+    'commissaire_http_request_duration_seconds',
+    'Seconds taken to handle requests.', ('controller',))
+#: Requests currently being handled
+IN_FLIGHT = REGISTRY.gauge(
+    'commissaire_http_requests_in_flight', 'Requests being handled.')
 
 
 def ls_mod(mod, pkg):
@@ -45,6 +69,31 @@ def ls_mod(mod, pkg):
             yield item, attr, mod_path
 
 
+class _StatusRecorder:
+    """
+    Wraps start_response remembering the status code of the response.
+    """
+
+    __slots__ = ('start_response', 'code')
+
+    def __init__(self, start_response):
+        """
+        Initializes a new _StatusRecorder instance.
+
+        :param start_response: WSGI start_response callable.
+        :type start_response: callable
+        """
+        self.start_response = start_response
+        self.code = ''
+
+    def __call__(self, status, headers, *args):
+        """
+        Records the status code and calls the wrapped start_response.
+        """
+        self.code = status[:3]
+        return self.start_response(status, headers, *args)
+
+
 class DispatcherError(Exception):  # pragma: no cover
     """
     Dispatcher related errors.
@@ -52,6 +101,115 @@ class DispatcherError(Exception):  # pragma: no cover
     pass
 
 
+class _DispatchEntry:
+    """
+    A route of the dispatch table.
+    """
+
+    __slots__ = ('controller', 'name', 'middleware', 'handler')
+
+    def __init__(self, controller, name, middleware=(), handler=None):
+        """
+        Initializes a new _DispatchEntry instance.
+
+        :param controller: A callable or a handler map key.
+        :type controller: mixed
+        :param name: Name of the controller for use in metrics.
+        :type name: str
+        :param middleware: Callables wrapping the handler, outermost first.
+        :type middleware: tuple
+        :param handler: The handler chain to call or None until the
+                        handler is loaded.
+        :type handler: callable or None
+        """
+        self.controller = controller
+        self.name = name
+        self.middleware = middleware
+        self.handler = handler
+
+
+@lru_cache(maxsize=64)
+def _module_names(path, mtime, size):
+    """
+    Returns the names a module defines at its top level, found by parsing
+    its source instead of importing it.
+
+    :param path: Path of the module source.
+    :type path: str
+    :param mtime: Modification time of the source, so edits are seen.
+    :type mtime: int
+    :param size: Size of the source, so edits are seen.
+    :type size: int
+    :returns: The names or None if they can not be known from the source.
+    :rtype: frozenset or None
+    """
+    try:
+        with open(path, 'rb') as source:
+            tree = ast.parse(source.read(), path)
+    except SyntaxError:
+        # Importing the module fails, so it has no handlers
+        return frozenset()
+    names = set()
+    for node in tree.body:
+        if isinstance(node, (
+                ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+            continue
+        # Names bound by assignments, imports and nested statements
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name) and isinstance(
+                    child.ctx, ast.Store):
+                names.add(child.id)
+            elif isinstance(child, (
+                    ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                names.add(child.name)
+            elif isinstance(child, (ast.Import, ast.ImportFrom)):
+                for alias in child.names:
+                    if alias.name == '*':
+                        return None
+                    names.add(alias.asname or alias.name.partition('.')[0])
+    if '__getattr__' in names:
+        return None
+    return frozenset(names)
+
+
+def _handler_exists(mod_path):
+    """
+    Checks that a handler function exists without importing its module.
+    The source of the module is parsed instead. The module of a method of
+    a class handler is imported to find the class.
+
+    :param mod_path: The full path of a handler function, or of a method
+                     of a handler class.
+    :type mod_path: str
+    :returns: True if the handler's function or class method was found.
+    :rtype: bool
+    """
+    pkg, _, item = mod_path.rpartition('.')
+    try:
+        spec = importlib.util.find_spec(pkg)
+    except (ImportError, ValueError):
+        spec = None
+    if spec is not None:
+        origin = spec.origin
+        if not spec.has_location or not origin.endswith('.py'):
+            # Only modules with a source can be checked without importing
+            return True
+        try:
+            stat = os.stat(origin)
+        except OSError:
+            return True
+        names = _module_names(origin, stat.st_mtime_ns, stat.st_size)
+        return names is None or item in names
+    # A method of a class handler
+    pkg, _, class_name = pkg.rpartition('.')
+    try:
+        handler_class = getattr(import_module(pkg), class_name, None)
+    except (ImportError, ValueError):
+        return False
+    return isclass(handler_class) and hasattr(handler_class, item)
+
+
 class Dispatcher:
     """
     Dispatches and translates between HTTP requests and bus services.
@@ -60,7 +218,7 @@ class Dispatcher:
     #: Logging instance for all Dispatchers
     logger = logging.getLogger('Dispatcher')
 
-    def __init__(self, router, handler_packages):
+    def __init__(self, router, handler_packages, lazy=False):
         """
         Initializes a new Dispatcher instance.
 
@@ -68,11 +226,21 @@ class Dispatcher:
         :type router: router.TopicRouter
         :param handler_packages: List of packages to load handlers from.
         :type handler_packages: list
+        :param lazy: If handlers are loaded when first requested instead of
+                     loading all handler packages now.
+        :type lazy: bool
         """
         self._router = router
         self._handler_packages = handler_packages
         self._handler_map = {}
-        self.reload_handlers()
+        self._controller_names = {}
+        self._lazy = lazy
+        self._table = {}
+        self._reload_lock = threading.Lock()
+        if lazy:
+            self.compile_routes()
+        else:
+            self.reload_handlers()
         self._bus = None
 
     @property
@@ -82,6 +250,13 @@ class Dispatcher:
         """
         return self._router
 
+    @property
+    def bus(self):
+        """
+        Get the bus instance or None before setup_bus is called.
+        """
+        return self._bus
+
     def setup_bus(self, exchange_name, connection_url, qkwargs):
         """
         Sets up a bus connection with the given configuration.
@@ -111,21 +286,141 @@ class Dispatcher:
         """
         Reloads the handler mapping.
         """
+        self._import_handlers(self._handler_map)
+        self.compile_routes()
+
+    def hot_reload(self):
+        """
+        Imports the handler packages again and swaps in a new handler
+        mapping and dispatch table built from them. The new modules are
+        imported next to the ones in use, so requests already routed
+        finish with the handlers they started with and nothing waits for
+        the reload.
+
+        Lazy dispatchers load the handlers they had loaded again.
+
+        :raises: DispatcherError if a controller can not be resolved.
+                 Errors importing the modules are raised as is. Either way
+                 the modules and handlers in use are kept.
+        """
+        with self._reload_lock:
+            old_modules = {
+                name: module for name, module in list(sys.modules.items())
+                if self._is_handler_module(name)}
+            for name in old_modules:
+                del sys.modules[name]
+            try:
+                # Packages are imported before their modules
+                for name in sorted(old_modules):
+                    import_module(name)
+                handler_map = {}
+                unresolved = []
+                if self._lazy:
+                    for mod_path in list(self._handler_map.keys()):
+                        handler = self._import_handler(mod_path)
+                        if handler is None:
+                            unresolved.append(mod_path)
+                        else:
+                            handler_map[mod_path] = handler
+                else:
+                    self._import_handlers(handler_map)
+                table, missing = self._compile(handler_map)
+                unresolved = sorted(set(unresolved + missing))
+                if unresolved:
+                    raise DispatcherError(
+                        'Unable to resolve controllers: {}'.format(
+                            ', '.join(unresolved)))
+            except BaseException:
+                self._restore_modules(old_modules)
+                raise
+            # Dispatching reads the table once per request
+            self._handler_map = handler_map
+            self._table = table
+        self.logger.info(
+            'Reloaded handler modules %s.', ', '.join(sorted(old_modules)))
+
+    def load_handlers(self):
+        """
+        Loads the handler of every route now. A lazy dispatcher calls this
+        before forking workers, so the workers share the loaded handlers
+        and hot_reload imports and checks every one of them.
+
+        :raises: DispatcherError if a handler can not be loaded.
+        """
+        with self._reload_lock:
+            handler_map = dict(self._handler_map)
+            unresolved = set()
+            for entry in self._table.values():
+                controller = entry.controller
+                if entry.handler is not None or controller in handler_map:
+                    continue
+                handler = self._import_handler(controller)
+                if handler is None:
+                    unresolved.add(controller)
+                else:
+                    handler_map[controller] = handler
+            if unresolved:
+                raise DispatcherError('Unable to load handlers: {}'.format(
+                    ', '.join(sorted(unresolved))))
+            self._table, _ = self._compile(handler_map)
+            self._handler_map = handler_map
+        self.logger.info('Loaded %s handlers.', len(handler_map))
+
+    def _is_handler_module(self, name):
+        """
+        Checks if a module is one of the handler packages or in one.
+
+        :param name: Name of the module.
+        :type name: str
+        :returns: True if it is a handler module.
+        :rtype: bool
+        """
+        for pkg in self._handler_packages:
+            if name == pkg or name.startswith(pkg + '.'):
+                return True
+        return False
+
+    def _restore_modules(self, modules):
+        """
+        Puts back handler modules replaced during a failed reload.
+
+        :param modules: The modules by name.
+        :type modules: dict
+        """
+        for name in list(sys.modules.keys()):
+            if self._is_handler_module(name):
+                del sys.modules[name]
+        sys.modules.update(modules)
+        # Importing a module also binds it in its package
+        for name, module in modules.items():
+            pkg, _, item = name.rpartition('.')
+            if pkg in sys.modules:
+                setattr(sys.modules[pkg], item, module)
+
+    def _import_handlers(self, handler_map):
+        """
+        Imports the handler packages adding their handlers to a mapping.
+
+        :param handler_map: The mapping of paths to handlers to add to.
+        :type handler_map: dict
+        """
+        # Looked up as the handlers module may have been imported again
+        basic_handler = import_module('commissaire_http.handlers').BasicHandler
         for pkg in self._handler_packages:
             try:
                 mod = import_module(pkg)
                 for item, attr, mod_path in ls_mod(mod, pkg):
-                    if isinstance(attr, BasicHandler):
-                        self._handler_map[mod_path] = attr
+                    if isinstance(attr, basic_handler):
+                        handler_map[mod_path] = attr
                         self.logger.info(
                             'Loaded function handler %s to %s', mod_path, attr)
                     elif (isclass(attr) and issubclass(attr, object) and
-                            not issubclass(attr, BasicHandler)):
+                            not issubclass(attr, basic_handler)):
                         handler_instance = attr()
                         for handler_meth, sub_attr, sub_mod_path in \
                                 ls_mod(handler_instance, pkg):
                             key = '.'.join([mod_path, handler_meth])
-                            self._handler_map[key] = getattr(
+                            handler_map[key] = getattr(
                                 handler_instance, handler_meth)
                             self.logger.info(
                                 'Instantiated and loaded class '
@@ -138,6 +433,122 @@ class Dispatcher:
                     'Unable to import handler package "{}". {}: {}'.format(
                         pkg, type(error), error))
 
+    def compile_routes(self):
+        """
+        Builds the dispatch table which maps each route of the router to
+        the handler it calls, wrapped in the middleware given when the
+        route was connected. Call again after connecting more routes.
+
+        Lazy dispatchers only check that handlers exist, without importing
+        their modules, and load each handler the first time a request is
+        routed to it.
+
+        :raises: DispatcherError if a controller can not be resolved.
+        """
+        self._table, unresolved = self._compile(self._handler_map)
+        if unresolved:
+            raise DispatcherError('Unable to resolve controllers: {}'.format(
+                ', '.join(unresolved)))
+        self.logger.debug('Compiled %s routes.', len(self._table))
+
+    def _compile(self, handler_map):
+        """
+        Builds a dispatch table.
+
+        :param handler_map: The mapping of paths to handlers to use. Handlers
+                            which are imported are added to it.
+        :type handler_map: dict
+        :returns: The table and the sorted controllers not resolved.
+        :rtype: tuple
+        """
+        table = {}
+        unresolved = set()
+        for route in self._router.matchlist:
+            controller = route.defaults.get('controller')
+            if controller is None:
+                continue
+            entry = _DispatchEntry(
+                controller, self.controller_name(controller),
+                getattr(route, 'middleware', ()))
+            if callable(controller):
+                entry.handler = self._wrap(controller, entry.middleware)
+            elif self._lazy:
+                if not _handler_exists(controller):
+                    unresolved.add(controller)
+                elif controller in handler_map:
+                    entry.handler = self._wrap(
+                        handler_map[controller], entry.middleware)
+            else:
+                handler = handler_map.get(controller)
+                if handler is None:
+                    handler = self._import_handler(controller)
+                if handler is None:
+                    unresolved.add(controller)
+                else:
+                    handler_map[controller] = handler
+                    entry.handler = self._wrap(handler, entry.middleware)
+            table[route] = entry
+        return table, sorted(unresolved)
+
+    def _wrap(self, handler, middleware):
+        """
+        Wraps a handler in middleware.
+
+        :param handler: The handler.
+        :type handler: callable
+        :param middleware: Callables wrapping the handler, outermost first.
+        :type middleware: tuple
+        :returns: The handler chain.
+        :rtype: callable
+        """
+        if timing.enabled:
+            handler = timing.TimedStage('handler', handler)
+        for wrapper in reversed(middleware):
+            handler = wrapper(handler)
+        return handler
+
+    def load_handler(self, mod_path):
+        """
+        Imports a single handler and adds it to the handler mapping.
+
+        :param mod_path: The full path of a handler function, or of a
+                         method of a handler class.
+        :type mod_path: str
+        :returns: The handler or None if it can not be imported.
+        :rtype: callable or None
+        """
+        handler = self._import_handler(mod_path)
+        if handler is not None:
+            self._handler_map[mod_path] = handler
+        return handler
+
+    def _import_handler(self, mod_path):
+        """
+        Imports a single handler.
+
+        :param mod_path: The full path of a handler function, or of a
+                         method of a handler class.
+        :type mod_path: str
+        :returns: The handler or None if it can not be imported.
+        :rtype: callable or None
+        """
+        pkg, _, item = mod_path.rpartition('.')
+        try:
+            try:
+                handler = getattr(import_module(pkg), item)
+            except ImportError:
+                # A method of a class handler
+                pkg, _, class_name = pkg.rpartition('.')
+                handler = getattr(
+                    getattr(import_module(pkg), class_name)(), item)
+        except (ImportError, AttributeError, ValueError) as error:
+            self.logger.error(
+                'Unable to import handler "{}". {}: {}'.format(
+                    mod_path, type(error), error))
+            return None
+        self.logger.info('Loaded handler %s to %s', mod_path, handler)
+        return handler
+
     def dispatch(self, environ, start_response):
         """
         Dispatches an HTTP request into a jsonrpc message, passes it to a
@@ -151,6 +562,117 @@ class Dispatcher:
         :returns: The body of the HTTP response.
         :rtype: Mixed
         """
+        entry = self._prepare_environ(environ)
+
+        # Set by RoutesMiddleware.
+        if entry is None:
+            return self._not_found(environ, start_response)
+
+        IN_FLIGHT.inc()
+        recorder = _StatusRecorder(start_response)
+        record = partial(
+            self._record, environ, entry.name, recorder, time.monotonic())
+        try:
+            handler = entry.handler or self._load_entry(environ, entry)
+            result = handler(environ, recorder)
+        except CircuitOpenError as error:
+            result = self._unavailable(error, recorder)
+        except DeadlineExceededError as error:
+            result = self._gateway_timeout(error, recorder)
+        except Exception:
+            result = self._internal_error(entry.controller, recorder)
+        except BaseException:
+            record()
+            raise
+        # Streamed bodies are recorded once they are sent
+        return close_when_done(result, record)
+
+    async def dispatch_async(self, environ, start_response):
+        """
+        Coroutine version of dispatch used by the asyncio server. Coroutine
+        handlers are awaited directly while other handlers are run in the
+        event loop's executor.
+
+        :param environ: WSGI environment dictionary.
+        :type environ: dict
+        :param start_response: WSGI start_response callable.
+        :type start_response: callable
+        :returns: The body of the HTTP response.
+        :rtype: Mixed
+        """
+        entry = self._prepare_environ(environ)
+
+        # Set by the asyncio server.
+        if entry is None:
+            return self._not_found(environ, start_response)
+
+        IN_FLIGHT.inc()
+        recorder = _StatusRecorder(start_response)
+        record = partial(
+            self._record, environ, entry.name, recorder, time.monotonic())
+        try:
+            handler = entry.handler or self._load_entry(environ, entry)
+            result = await call_app_async(handler, environ, recorder)
+        except CircuitOpenError as error:
+            result = self._unavailable(error, recorder)
+        except DeadlineExceededError as error:
+            result = self._gateway_timeout(error, recorder)
+        except Exception:
+            result = self._internal_error(entry.controller, recorder)
+        except BaseException:
+            record()
+            raise
+        # Streamed bodies are recorded once they are sent
+        return close_when_done(result, record)
+
+    def _record(self, environ, name, recorder, started):
+        """
+        Records the metrics of a dispatched request.
+
+        :param environ: WSGI environment dictionary.
+        :type environ: dict
+        :param name: Name of the controller the request was routed to.
+        :type name: str
+        :param recorder: The start_response holding the status code.
+        :type recorder: _StatusRecorder
+        :param started: time.monotonic() when dispatching started.
+        :type started: float
+        """
+        IN_FLIGHT.dec()
+        REQUEST_DURATION.observe(time.monotonic() - started, (name,))
+        REQUESTS.inc((name, environ['REQUEST_METHOD'], recorder.code))
+
+    def controller_name(self, route_controller):
+        """
+        Names a controller for use in metrics.
+
+        :param route_controller: A callable or a handler map key.
+        :type route_controller: mixed
+        :returns: The dotted path of the handler function.
+        :rtype: str
+        """
+        name = self._controller_names.get(route_controller)
+        if name is None:
+            if callable(route_controller):
+                func = getattr(route_controller, 'handler', route_controller)
+                name = '{}.{}'.format(
+                    getattr(func, '__module__', None),
+                    getattr(func, '__name__', type(func).__name__))
+            else:
+                name = str(route_controller)
+            self._controller_names[route_controller] = name
+        return name
+
+    def _prepare_environ(self, environ):
+        """
+        Adds the bus to the WSGI environment and finds the dispatch table
+        entry of the route the request was routed to.
+
+        :param environ: WSGI environment dictionary.
+        :type environ: dict
+        :returns: The entry or None if no route matched.
+        :rtype: _DispatchEntry or None
+        """
         # Fail early if _bus has never been set.
         if self._bus is None:
             raise DispatcherError(
@@ -160,32 +682,130 @@ class Dispatcher:
         # Add the bus instance to the WSGI environment dictionary.
         environ['commissaire.bus'] = self._bus
 
-        # Set by RoutesMiddleware.
-        if environ.get('routes.route') is None:
-            start_response(
-                '404 Not Found',
-                [('content-type', 'text/html')])
-            return [bytes('Not Found', 'utf8')]
+        route = environ.get('routes.route')
+        if route is None:
+            return None
 
-        route_dict = environ['wsgiorg.routing_args'][1]
-        route_controller = route_dict['controller']
+        entry = self._table.get(route)
+        if entry is None:
+            # A route which was not compiled
+            controller = environ['wsgiorg.routing_args'][1]['controller']
+            entry = _DispatchEntry(
+                controller, self.controller_name(controller))
+        return entry
 
-        try:
-            # If the handler registered is a callable, use it
-            if callable(route_controller):
-                handler = route_controller
-            # Else load what we found earlier
-            else:
-                handler = self._handler_map.get(route_controller)
-            self.logger.debug(
-                'Using controller %s->%s', route_dict, handler)
+    def _get_handler(self, environ, route_controller):
+        """
+        Looks up the handler for a controller.
 
-            return handler(environ, start_response)
-        except Exception as error:
-            self.logger.error(
-                'Exception raised in handler %s:\n%s',
-                route_controller, traceback.format_exc())
-            start_response(
-                '500 Internal Server Error',
-                [('content-type', 'text/html')])
-            return [bytes('Internal Server Error', 'utf8')]
+        :param environ: WSGI environment dictionary.
+        :type environ: dict
+        :param route_controller: A callable or a handler map key.
+        :type route_controller: mixed
+        :returns: The handler or None if it can not be imported.
+        :rtype: callable or None
+        """
+        # If the handler registered is a callable, use it
+        if callable(route_controller):
+            handler = route_controller
+        # Else load what we found earlier or import it now
+        else:
+            handler = self._handler_map.get(route_controller)
+            if handler is None:
+                handler = self.load_handler(route_controller)
+        self.logger.debug(
+            'Using controller %s->%s',
+            environ['wsgiorg.routing_args'][1], handler)
+        return handler
+
+    def _load_entry(self, environ, entry):
+        """
+        Loads the handler of an entry which has none yet and keeps the
+        handler chain in the entry.
+
+        :param environ: WSGI environment dictionary.
+        :type environ: dict
+        :param entry: The dispatch table entry.
+        :type entry: _DispatchEntry
+        :returns: The handler chain to call.
+        :rtype: callable
+        :raises: DispatcherError if the handler can not be loaded.
+        """
+        handler = self._get_handler(environ, entry.controller)
+        if handler is None:
+            raise DispatcherError(
+                'Unable to load handler {}'.format(entry.controller))
+        entry.handler = self._wrap(handler, entry.middleware)
+        return entry.handler
+
+    def _not_found(self, environ, start_response):
+        """
+        Responds with a 404.
+
+        :param environ: WSGI environment dictionary.
+        :type environ: dict
+        :param start_response: WSGI start_response callable.
+        :type start_response: callable
+        :returns: The body of the HTTP response.
+        :rtype: list
+        """
+        REQUESTS.inc(('', environ['REQUEST_METHOD'], '404'))
+        start_response(
+            '404 Not Found',
+            [('content-type', 'text/html')])
+        return [bytes('Not Found', 'utf8')]
+
+    def _unavailable(self, error, start_response):
+        """
+        Responds with a 503 as the bus service a handler needed is
+        unavailable.
+
+        :param error: The error of the open circuit breaker.
+        :type error: commissaire_http.circuitbreaker.CircuitOpenError
+        :param start_response: WSGI start_response callable.
+        :type start_response: callable
+        :returns: The body of the HTTP response.
+        :rtype: list
+        """
+        self.logger.debug('Answering with 503: %s', error)
+        start_response(
+            '503 Service Unavailable', [
+                ('content-type', 'text/html'),
+                ('Retry-After', str(int(math.ceil(error.retry_after))))])
+        return [bytes('Service Unavailable', 'utf8')]
+
+    def _gateway_timeout(self, error, start_response):
+        """
+        Responds with a 504 as the deadline of the request passed.
+
+        :param error: The error raised when the deadline passed.
+        :type error: commissaire_http.deadline.DeadlineExceededError
+        :param start_response: WSGI start_response callable.
+        :type start_response: callable
+        :returns: The body of the HTTP response.
+        :rtype: list
+        """
+        self.logger.debug('Answering with 504: %s', error)
+        start_response(
+            '504 Gateway Timeout',
+            [('content-type', 'text/html')])
+        return [bytes('Gateway Timeout', 'utf8')]
+
+    def _internal_error(self, route_controller, start_response):
+        """
+        Logs the current exception and responds with a 500.
+
+        :param route_controller: The controller which raised.
+        :type route_controller: mixed
+        :param start_response: WSGI start_response callable.
+        :type start_response: callable
+        :returns: The body of the HTTP response.
+        :rtype: list
+        """
+        self.logger.error(
+            'Exception raised in handler %s:\n%s',
+            route_controller, traceback.format_exc())
+        start_response(
+            '500 Internal Server Error',
+            [('content-type', 'text/html')])
+        return [bytes('Internal Server Error', 'utf8')]
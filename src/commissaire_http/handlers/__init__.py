@@ -16,6 +16,8 @@
 Built-in handlers.
 """
 
+import asyncio
+import collections.abc
 import json
 import logging
 import uuid
@@ -23,6 +25,9 @@ import uuid
 from html import escape
 from urllib.parse import parse_qs
 
+from commissaire_http import deadline as _deadline
+from commissaire_http.circuitbreaker import (
+    CircuitOpenError as _CircuitOpenError)
 from commissaire_http.constants import JSONRPC_ERRORS
 
 #: Handler specific logger
@@ -50,6 +55,34 @@ def parse_query_string(qs):
     return new_qs
 
 
+def stream_json_list(items, chunk_size=65536):
+    """
+    Encodes items as a JSON list one item at a time. The output is the
+    same as json.dumps(list(items)) without holding all of it in memory.
+
+    :param items: The items to encode.
+    :type items: iterable
+    :param chunk_size: Bytes collected before a chunk is yielded.
+    :type chunk_size: int
+    :returns: A generator of encoded chunks.
+    :rtype: generator
+    """
+    chunk = [b'[']
+    size = 1
+    separator = b''
+    for item in items:
+        data = bytes(json.dumps(item), 'utf8')
+        chunk.extend((separator, data))
+        size += len(separator) + len(data)
+        separator = b', '
+        if size >= chunk_size:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+    chunk.append(b']')
+    yield b''.join(chunk)
+
+
 def get_params(environ):
     """
     Handles pulling parameters out of the various inputs.
@@ -139,18 +172,31 @@ class JSONRPC_Handler(BasicHandler):
         :param start_response: WSGI start_response callable.
         :type start_response: callable
         """
+        jsonrpc_message = self.create_message(environ)
+        if jsonrpc_message is None:
+            start_response(
+                '400 Bad Request', [('content-type', 'text/html')])
+            return [bytes('Bad Request', 'utf8')]
 
-        bus = environ['commissaire.bus']
+        # Bus requests of the handler stop once the request's deadline passed
+        with _deadline.BoundDeadline(environ.get(_deadline.ENVIRON_KEY)):
+            result = self.handler(
+                jsonrpc_message, environ['commissaire.bus'])
+        return self.create_response(environ, start_response, result)
 
-        # Set by RoutesMiddleware.
-        route_dict = environ['wsgiorg.routing_args'][1]
+    def create_message(self, environ):
+        """
+        Transforms the HTTP request into a JSON-RPC message.
 
+        :param environ: WSGI environment dictionary.
+        :type environ: dict
+        :returns: A jsonrpc structure or None if the parameters are bad.
+        :rtype: dict or None
+        """
         # Extract request parameters.
         param_dict = get_params(environ)
         if param_dict is None:
-            start_response(
-                '400 Bad Request', [('content-type', 'text/html')])
-            return [bytes('Bad Request', 'utf8')]
+            return None
 
         # 'method' is normally supposed to be the method to be
         # called, but we hijack it for the HTTP request method.
@@ -162,8 +208,24 @@ class JSONRPC_Handler(BasicHandler):
         }
         LOGGER.debug(
             'Request transformed to "%s"', jsonrpc_message)
+        return jsonrpc_message
 
-        result = self.handler(jsonrpc_message, bus)
+    def create_response(self, environ, start_response, result):
+        """
+        Transforms the JSON-RPC result of the handler into the HTTP response.
+
+        :param environ: WSGI environment dictionary.
+        :type environ: dict
+        :param start_response: WSGI start_response callable.
+        :type start_response: callable
+        :param result: The jsonrpc structure returned by the handler. A
+                       result which is an iterator is streamed as a list.
+        :type result: dict
+        :returns: The body of the HTTP response.
+        :rtype: list or generator
+        """
+        # Set by RoutesMiddleware.
+        route_dict = environ['wsgiorg.routing_args'][1]
 
         handler_name = self.handler.__name__
         LOGGER.debug('Handler %s returned "%s"', handler_name, result)
@@ -178,11 +240,15 @@ class JSONRPC_Handler(BasicHandler):
                 status = '405 Method Not Allowed'
             elif error_code == JSONRPC_ERRORS['CONFLICT']:
                 status = '409 Conflict'
+            elif error_code == JSONRPC_ERRORS['SERVICE_UNAVAILABLE']:
+                status = '503 Service Unavailable'
+            elif error_code == JSONRPC_ERRORS['GATEWAY_TIMEOUT']:
+                status = '504 Gateway Timeout'
             else:
                 message = 'Unhandled error code {}'.format(error_code)
                 LOGGER.error('%s: %s', message, result)
                 raise Exception(message)
-            start_response(status, [('content-type', 'text/html')])
+            content_type = 'text/html'
             response_body = status[4:]
 
         elif 'result' in result.keys():
@@ -193,15 +259,72 @@ class JSONRPC_Handler(BasicHandler):
                 # is being created, so return 200 OK.
                 if route_dict.get('action') != 'add':
                     status = '201 Created'
-            start_response(status, [('content-type', 'application/json')])
+            content_type = 'application/json'
+            if isinstance(result['result'], collections.abc.Iterator):
+                # The length is unknown so the server chunks the body
+                start_response(status, [('content-type', content_type)])
+                return _deadline.BoundIterator(
+                    environ.get(_deadline.ENVIRON_KEY),
+                    stream_json_list(result['result']))
             response_body = json.dumps(result['result'])
 
         else:
             message = 'Malformed JSON-RPC response message'
-            self.logger.error('%s: %s', message, result)
+            LOGGER.error('%s: %s', message, result)
             raise Exception(message)
 
-        return [bytes(response_body, 'utf8')]
+        response_body = bytes(response_body, 'utf8')
+        start_response(status, [
+            ('content-type', content_type),
+            ('content-length', str(len(response_body)))])
+        return [response_body]
+
+
+class AsyncJSONRPC_Handler(JSONRPC_Handler):
+    """
+    Decorator class for JSON-RPC handler coroutine functions.
+
+    The asyncio server awaits the handler through call_async(). When used
+    by the threaded server the coroutine is run to completion on a private
+    event loop.
+    """
+
+    def __call__(self, environ, start_response):
+        """
+        Runs call_async() to completion on a new event loop.
+
+        :param environ: WSGI environment dictionary.
+        :type environ: dict
+        :param start_response: WSGI start_response callable.
+        :type start_response: callable
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(
+                self.call_async(environ, start_response))
+        finally:
+            loop.close()
+
+    async def call_async(self, environ, start_response):
+        """
+        Awaits the JSON-RPC handler coroutine, with extra processing before
+        and after.
+
+        :param environ: WSGI environment dictionary.
+        :type environ: dict
+        :param start_response: WSGI start_response callable.
+        :type start_response: callable
+        """
+        jsonrpc_message = self.create_message(environ)
+        if jsonrpc_message is None:
+            start_response(
+                '400 Bad Request', [('content-type', 'text/html')])
+            return [bytes('Bad Request', 'utf8')]
+
+        with _deadline.BoundDeadline(environ.get(_deadline.ENVIRON_KEY)):
+            result = await self.handler(
+                jsonrpc_message, environ['commissaire.bus'])
+        return self.create_response(environ, start_response, result)
 
 
 def create_jsonrpc_error(message, error, error_code):
@@ -212,11 +335,17 @@ def create_jsonrpc_error(message, error, error_code):
     :type message: dict
     :param error: The error to send back to the requestor.
     :type error: str or Exception
-    :param error_code: JSONRPC error code.
+    :param error_code: JSONRPC error code. Errors of open circuit breakers
+                       are always reported as SERVICE_UNAVAILABLE and
+                       passed deadlines as GATEWAY_TIMEOUT.
     :type error_code: int
     :returns: A jsonrpc structure.
     :rtype: dict
     """
+    if isinstance(error, _CircuitOpenError):
+        error_code = JSONRPC_ERRORS['SERVICE_UNAVAILABLE']
+    elif isinstance(error, _deadline.DeadlineExceededError):
+        error_code = JSONRPC_ERRORS['GATEWAY_TIMEOUT']
     LOGGER.error('Error dealing with: "%s"', message)
     response = create_jsonrpc_response(
         message['id'], error=error,
@@ -303,6 +432,25 @@ def create_world(message, bus):  # pragma: no cover
         raise error
 
 
+@AsyncJSONRPC_Handler
+async def hello_world_async(message, bus):  # pragma: no cover
+    """
+    Example coroutine handler that simply says hello. If name is given
+    in the query string it uses it.
+
+    :param message: jsonrpc message structure.
+    :type message: dict
+    :returns: A jsonrpc structure.
+    :rtype: dict
+    """
+    response_msg = {'Hello': 'there'}
+    # Example of awaiting the bus ...
+    # print(await bus.request_async('simple.add', 'add', params=[10, 20]))
+    if message['params'].get('name'):
+        response_msg['Hello'] = message['params']['name']
+    return create_jsonrpc_response(message['id'], response_msg)
+
+
 class ClassHandlerExample:  # pragma: no cover
     """
     Example class based handlers.
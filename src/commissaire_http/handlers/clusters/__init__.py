@@ -25,76 +25,6 @@ from commissaire_http.handlers import (
     LOGGER, JSONRPC_Handler, create_jsonrpc_response, create_jsonrpc_error)
 
 
-def _register(router):
-    """
-    Sets up routing for clusters.
-
-    :param router: Router instance to attach to.
-    :type router: commissaire_http.router.Router
-    :returns: The router.
-    :rtype: commissaire_http.router.Router
-    """
-    from commissaire_http.constants import ROUTING_RX_PARAMS
-
-    router.connect(
-        R'/api/v0/clusters/',
-        controller=list_clusters,
-        conditions={'method': 'GET'})
-    router.connect(
-        R'/api/v0/cluster/{name}/',
-        requirements={'name': ROUTING_RX_PARAMS['name']},
-        controller=get_cluster,
-        conditions={'method': 'GET'})
-    router.connect(
-        R'/api/v0/cluster/{name}/',
-        requirements={'name': ROUTING_RX_PARAMS['name']},
-        controller=create_cluster,
-        conditions={'method': 'PUT'})
-    router.connect(
-        R'/api/v0/cluster/{name}/',
-        requirements={'name': ROUTING_RX_PARAMS['name']},
-        controller=delete_cluster,
-        conditions={'method': 'DELETE'})
-    router.connect(
-        R'/api/v0/cluster/{name}/hosts/',
-        requirements={'name': ROUTING_RX_PARAMS['name']},
-        controller=list_cluster_members,
-        conditions={'method': 'GET'})
-    router.connect(
-        R'/api/v0/cluster/{name}/hosts/',
-        requirements={'name': ROUTING_RX_PARAMS['name']},
-        controller=update_cluster_members,
-        conditions={'method': 'PUT'},
-        action='add')
-    router.connect(
-        R'/api/v0/cluster/{name}/hosts/{host}/',
-        requirements={
-            'name': ROUTING_RX_PARAMS['name'],
-            'host': ROUTING_RX_PARAMS['host'],
-        },
-        controller=check_cluster_member,
-        conditions={'method': 'GET'})
-    router.connect(
-        R'/api/v0/cluster/{name}/hosts/{host}/',
-        requirements={
-            'name': ROUTING_RX_PARAMS['name'],
-            'host': ROUTING_RX_PARAMS['host'],
-        },
-        controller=add_cluster_member,
-        conditions={'method': 'PUT'},
-        action='add')
-    router.connect(
-        R'/api/v0/cluster/{name}/hosts/{host}/',
-        requirements={
-            'name': ROUTING_RX_PARAMS['name'],
-            'host': ROUTING_RX_PARAMS['host'],
-        },
-        controller=delete_cluster_member,
-        conditions={'method': 'DELETE'})
-
-    return router
-
-
 def host_suitable_for_cluster(host):
     """
     Captures the policy for adding a host to a cluster.  Returns true if the
@@ -158,7 +88,7 @@ def list_clusters(message, bus):
     container = bus.storage.list(models.Clusters)
     return create_jsonrpc_response(
         message['id'],
-        [cluster.name for cluster in container.clusters])
+        (cluster.name for cluster in container.clusters))
 
 
 @JSONRPC_Handler
@@ -26,53 +26,6 @@ from commissaire_http.handlers import (
     LOGGER, JSONRPC_Handler, create_jsonrpc_response, create_jsonrpc_error)
 
 
-def _register(router):
-    """
-    Sets up routing for cluster operations.
-
-    :param router: Router instance to attach to.
-    :type router: commissaire_http.router.Router
-    :returns: The router.
-    :rtype: commissaire_http.router.Router
-    """
-    from commissaire_http.constants import ROUTING_RX_PARAMS
-
-    router.connect(
-        R'/api/v0/cluster/{name}/deploy',
-        requirements={'name': ROUTING_RX_PARAMS['name']},
-        controller=get_cluster_deploy,
-        conditions={'method': 'GET'})
-    router.connect(
-        R'/api/v0/cluster/{name}/deploy',
-        requirements={'name': ROUTING_RX_PARAMS['name']},
-        controller=create_cluster_deploy,
-        conditions={'method': 'PUT'})
-    # Upgrade
-    router.connect(
-        R'/api/v0/cluster/{name}/upgrade',
-        requirements={'name': ROUTING_RX_PARAMS['name']},
-        controller=get_cluster_upgrade,
-        conditions={'method': 'GET'})
-    router.connect(
-        R'/api/v0/cluster/{name}/upgrade',
-        requirements={'name': ROUTING_RX_PARAMS['name']},
-        controller=create_cluster_upgrade,
-        conditions={'method': 'PUT'})
-    # Restart
-    router.connect(
-        R'/api/v0/cluster/{name}/restart',
-        requirements={'name': ROUTING_RX_PARAMS['name']},
-        controller=get_cluster_restart,
-        conditions={'method': 'GET'})
-    router.connect(
-        R'/api/v0/cluster/{name}/restart',
-        requirements={'name': ROUTING_RX_PARAMS['name']},
-        controller=create_cluster_restart,
-        conditions={'method': 'PUT'})
-
-    return router
-
-
 @JSONRPC_Handler
 def get_cluster_deploy(message, bus):
     """
@@ -23,41 +23,6 @@ from commissaire_http.handlers import (
     LOGGER, JSONRPC_Handler, create_jsonrpc_response, create_jsonrpc_error)
 
 
-def _register(router):  # pragma: no cover
-    """
-    Sets up routing for ContainerManagerConfigs.
-
-    :param router: Router instance to attach to.
-    :type router: commissaire_http.router.Router
-    :returns: The router.
-    :rtype: commissaire_http.router.Router
-    """
-    from commissaire_http.constants import ROUTING_RX_PARAMS
-
-    # Networks
-    router.connect(
-        R'/api/v0/containermanagers/',
-        controller=list_container_managers,
-        conditions={'method': 'GET'})
-    router.connect(
-        R'/api/v0/containermanager/{name}/',
-        requirements={'name': ROUTING_RX_PARAMS['name']},
-        controller=get_container_manager,
-        conditions={'method': 'GET'})
-    router.connect(
-        R'/api/v0/containermanager/{name}/',
-        requirements={'name': ROUTING_RX_PARAMS['name']},
-        controller=create_container_manager,
-        conditions={'method': 'PUT'})
-    router.connect(
-        R'/api/v0/containermanager/{name}/',
-        requirements={'name': ROUTING_RX_PARAMS['name']},
-        controller=delete_container_manager,
-        conditions={'method': 'DELETE'})
-
-    return router
-
-
 @JSONRPC_Handler
 def list_container_managers(message, bus):
     """
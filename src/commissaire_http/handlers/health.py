@@ -0,0 +1,66 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Health and readiness probe handlers.
+"""
+
+from commissaire_http.health import HEALTH as _HEALTH
+
+
+def _respond(start_response, response):
+    """
+    Starts a probe response.
+
+    :param start_response: WSGI start response callable.
+    :type start_response: callable
+    :param response: The status and body of the response.
+    :type response: tuple
+    :returns: The body.
+    :rtype: list
+    """
+    status, body = response
+    start_response(status, [
+        ('content-type', 'application/json'),
+        ('Cache-Control', 'no-store')])
+    return [body]
+
+
+def get_healthz(environ, start_response):
+    """
+    Liveness probe. Responds with 200 while the server is answering.
+
+    :param environ: WSGI environment instance.
+    :type environ: dict
+    :param start_response: WSGI start response callable.
+    :type start_response: callable
+    :returns: The probe result.
+    :rtype: list
+    """
+    return _respond(start_response, _HEALTH.liveness())
+
+
+def get_readyz(environ, start_response):
+    """
+    Readiness probe. Responds with 200 if the last background check of the
+    bus succeeded, else with 503.
+
+    :param environ: WSGI environment instance.
+    :type environ: dict
+    :param start_response: WSGI start response callable.
+    :type start_response: callable
+    :returns: The probe result.
+    :rtype: list
+    """
+    return _respond(start_response, _HEALTH.readiness())
@@ -0,0 +1,37 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Metrics handlers.
+"""
+
+from commissaire_http.metrics import REGISTRY as _REGISTRY
+
+#: Content type of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def get_metrics(environ, start_response):
+    """
+    Responds with all metrics in the Prometheus text format.
+
+    :param environ: WSGI environment instance.
+    :type environ: dict
+    :param start_response: WSGI start response callable.
+    :type start_response: callable
+    :returns: The rendered metrics.
+    :rtype: list
+    """
+    start_response('200 OK', [('content-type', CONTENT_TYPE)])
+    return [bytes(_REGISTRY.render(), 'utf8')]
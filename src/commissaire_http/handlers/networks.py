@@ -23,41 +23,6 @@ from commissaire_http.handlers import (
     LOGGER, JSONRPC_Handler, create_jsonrpc_response, create_jsonrpc_error)
 
 
-def _register(router):
-    """
-    Sets up routing for clusters.
-
-    :param router: Router instance to attach to.
-    :type router: commissaire_http.router.Router
-    :returns: The router.
-    :rtype: commissaire_http.router.Router
-    """
-    from commissaire_http.constants import ROUTING_RX_PARAMS
-
-    # Networks
-    router.connect(
-        R'/api/v0/networks/',
-        controller=list_networks,
-        conditions={'method': 'GET'})
-    router.connect(
-        R'/api/v0/network/{name}/',
-        requirements={'name': ROUTING_RX_PARAMS['name']},
-        controller=get_network,
-        conditions={'method': 'GET'})
-    router.connect(
-        R'/api/v0/network/{name}/',
-        requirements={'name': ROUTING_RX_PARAMS['name']},
-        controller=create_network,
-        conditions={'method': 'PUT'})
-    router.connect(
-        R'/api/v0/network/{name}/',
-        requirements={'name': ROUTING_RX_PARAMS['name']},
-        controller=delete_network,
-        conditions={'method': 'DELETE'})
-
-    return router
-
-
 @JSONRPC_Handler
 def list_networks(message, bus):
     """
@@ -72,9 +37,9 @@ def list_networks(message, bus):
     """
     try:
         container = bus.storage.list(models.Networks)
-        return create_jsonrpc_response(
-            message['id'],
-            [network.name for network in container.networks])
+        # Names are taken here so errors are answered as JSON-RPC errors
+        names = [network.name for network in container.networks]
+        return create_jsonrpc_response(message['id'], iter(names))
     except Exception as error:
         return create_jsonrpc_error(
             message, error, JSONRPC_ERRORS['INTERNAL_ERROR'])
@@ -0,0 +1,196 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Health and readiness checks for Commissaire.
+
+Probes are answered from cached results. Readiness is checked by a
+background thread so a probe never waits on the bus.
+"""
+
+import json
+import logging
+import threading
+import time
+
+
+class HealthCheck:
+    """
+    Periodically checks if the server is ready to handle requests and
+    caches the rendered probe responses.
+    """
+
+    #: Logger for HealthCheck
+    logger = logging.getLogger('HealthCheck')
+
+    def __init__(self, interval=5.0, timeout=2.0):
+        """
+        Initializes a new HealthCheck instance.
+
+        :param interval: Seconds between readiness checks. Probe responses
+                         are cached for as long.
+        :type interval: float
+        :param timeout: Seconds a readiness check may take.
+        :type timeout: float
+        """
+        self.interval = interval
+        self.timeout = timeout
+        self.bus = None
+        self.ready = False
+        self.error = 'Not checked yet'
+        self.checked = None
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, bus):
+        """
+        Starts checking the readiness of a bus in a background thread.
+
+        :param bus: The bus to check.
+        :type bus: commissaire_http.bus.Bus
+        """
+        self.stop()
+        self.bus = bus
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='HealthCheck', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.timeout + 1)
+            self._thread = None
+
+    def _run(self):
+        """
+        Checks readiness every interval until stopped.
+        """
+        while not self._stop.is_set():
+            self.check()
+            self._stop.wait(self.interval)
+
+    def check(self):
+        """
+        Checks the readiness of the bus once and stores the result.
+
+        :returns: True if the server is ready.
+        :rtype: bool
+        """
+        error = None
+        if self.bus is None:
+            error = 'No bus'
+        else:
+            try:
+                self.bus.ping(self.timeout)
+            except Exception as err:
+                error = '{}: {}'.format(type(err).__name__, err)
+        with self._lock:
+            if (error is None) != self.ready:
+                self.logger.info(
+                    'Readiness changed to %s. %s', error is None, error or '')
+            self.ready = error is None
+            self.error = error
+            self.checked = time.monotonic()
+            self._cache.clear()
+        return self.ready
+
+    def is_ready(self):
+        """
+        Checks if the last readiness check succeeded recently enough. A
+        check which stopped running, such as a hung one, is not trusted.
+
+        :returns: True if the server is ready.
+        :rtype: bool
+        """
+        checked = self.checked
+        return bool(
+            self.ready and checked is not None and
+            time.monotonic() - checked <= self.interval * 3 + self.timeout)
+
+    def liveness(self):
+        """
+        Returns the cached liveness probe response. The server is alive as
+        long as it answers. The bus connection state is informational.
+
+        :returns: The status and body of the response.
+        :rtype: tuple
+        """
+        return self._cached('healthz', lambda: ('200 OK', {
+            'status': 'ok',
+            'bus': 'connected' if self._bus_connected() else 'disconnected',
+        }))
+
+    def readiness(self):
+        """
+        Returns the cached readiness probe response.
+
+        :returns: The status and body of the response.
+        :rtype: tuple
+        """
+        def render():
+            ready = self.is_ready()
+            body = {
+                'status': 'ready' if ready else 'not ready',
+                'bus': 'connected' if self._bus_connected() else
+                       'disconnected',
+            }
+            if self.checked is not None:
+                body['checked_seconds_ago'] = round(
+                    time.monotonic() - self.checked, 3)
+            if not ready:
+                body['error'] = self.error or 'Readiness check is stale'
+                return '503 Service Unavailable', body
+            return '200 OK', body
+        return self._cached('readyz', render)
+
+    def _bus_connected(self):
+        """
+        Reads the bus connection state without any I/O.
+
+        :returns: True if the bus is connected.
+        :rtype: bool
+        """
+        return bool(self.bus is not None and self.bus.connected)
+
+    def _cached(self, name, render):
+        """
+        Returns a cached response, rendering it when older than interval.
+
+        :param name: Name of the probe.
+        :type name: str
+        :param render: Returns the status and body as a dict.
+        :type render: callable
+        :returns: The status and encoded body of the response.
+        :rtype: tuple
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(name)
+            if cached is not None and now - cached[0] < self.interval:
+                return cached[1]
+        status, body = render()
+        response = (status, bytes(json.dumps(body), 'utf8'))
+        with self._lock:
+            self._cache[name] = (now, response)
+        return response
+
+
+#: The health check of the server
+HEALTH = HealthCheck()
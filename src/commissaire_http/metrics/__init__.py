@@ -0,0 +1,642 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Metrics in the Prometheus text format.
+
+Values are recorded in shards. Each thread is assigned a shard with its
+own lock, so recording threads rarely wait for each other and the
+shards are only summed when the metrics are rendered.
+
+Worker processes share their metrics through a directory, see
+MetricsRegistry.share, so every worker renders the values of all of them.
+"""
+
+import fcntl
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+from bisect import bisect_left
+from contextlib import contextmanager
+
+#: Number of shards values are spread over
+SHARDS = 16
+
+_shard_assignment = itertools.count()
+_thread_shard = threading.local()
+
+
+def shard_index():
+    """
+    Returns the shard index assigned to the calling thread.
+
+    :returns: The shard index.
+    :rtype: int
+    """
+    try:
+        return _thread_shard.index
+    except AttributeError:
+        _thread_shard.index = next(_shard_assignment) % SHARDS
+        return _thread_shard.index
+
+
+def format_labels(labelnames, labels, extra=()):
+    """
+    Formats labels for the text format.
+
+    :param labelnames: The names of the labels.
+    :type labelnames: tuple
+    :param labels: The values of the labels.
+    :type labels: tuple
+    :param extra: Additional name and value pairs.
+    :type extra: tuple
+    :returns: The formatted labels, including braces, or ''.
+    :rtype: str
+    """
+    pairs = list(zip(labelnames, labels)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs) + '}'
+
+
+def add_values(total, value):
+    """
+    Adds values of the same metric and labels recorded by two processes.
+
+    :param total: The value so far or None.
+    :type total: int or float or list or None
+    :param value: The value to add.
+    :type value: int or float or list
+    :returns: The sum. Histogram bucket counts are added per bucket.
+    :rtype: int or float or list
+    """
+    if total is None:
+        return list(value) if isinstance(value, list) else value
+    if isinstance(total, list):
+        return [a + b for a, b in zip(total, value)]
+    return total + value
+
+
+def format_value(value):
+    """
+    Formats a sample value for the text format.
+
+    :param value: The value.
+    :type value: int or float
+    :returns: The formatted value.
+    :rtype: str
+    """
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Shard:
+    """
+    Values of a metric recorded by the threads assigned to this shard.
+    """
+
+    __slots__ = ('lock', 'values')
+
+    def __init__(self):
+        """
+        Initializes a new, empty, _Shard instance.
+        """
+        self.lock = threading.Lock()
+        self.values = {}
+
+
+class Counter:
+    """
+    A value which only goes up, such as the number of requests.
+    """
+
+    #: The metric type in the text format
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        """
+        Initializes a new Counter instance.
+
+        :param name: The name of the metric.
+        :type name: str
+        :param help: Description of the metric.
+        :type help: str
+        :param labelnames: The names of the labels.
+        :type labelnames: tuple
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._shards = [_Shard() for _ in range(SHARDS)]
+
+    def inc(self, labels=(), amount=1):
+        """
+        Adds to the value.
+
+        :param labels: The values of the labels.
+        :type labels: tuple
+        :param amount: The amount to add.
+        :type amount: int or float
+        """
+        shard = self._shards[shard_index()]
+        with shard.lock:
+            shard.values[labels] = shard.values.get(labels, 0) + amount
+
+    def values(self):
+        """
+        Sums the values of all shards.
+
+        :returns: Mapping of labels to their value.
+        :rtype: dict
+        """
+        totals = {}
+        for shard in self._shards:
+            with shard.lock:
+                items = list(shard.values.items())
+            for labels, value in items:
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def samples(self, values=None):
+        """
+        Yields the samples of the metric.
+
+        :param values: Values to use instead of the recorded ones.
+        :type values: dict or None
+        :returns: Name, formatted labels and value of each sample.
+        :rtype: generator
+        """
+        if values is None:
+            values = self.values()
+        for labels, value in sorted(values.items()):
+            yield self.name, format_labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    """
+    A value which goes up and down, such as requests in-flight.
+    """
+
+    #: The metric type in the text format
+    type = 'gauge'
+
+    def dec(self, labels=(), amount=1):
+        """
+        Subtracts from the value.
+
+        :param labels: The values of the labels.
+        :type labels: tuple
+        :param amount: The amount to subtract.
+        :type amount: int or float
+        """
+        self.inc(labels, -amount)
+
+
+class Histogram:
+    """
+    Counts observations, such as latencies, in buckets.
+    """
+
+    #: The metric type in the text format
+    type = 'histogram'
+
+    #: Default bucket upper bounds in seconds
+    default_buckets = (
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, help, labelnames=(), buckets=None):
+        """
+        Initializes a new Histogram instance.
+
+        :param name: The name of the metric.
+        :type name: str
+        :param help: Description of the metric.
+        :type help: str
+        :param labelnames: The names of the labels.
+        :type labelnames: tuple
+        :param buckets: Sorted upper bounds of the buckets.
+        :type buckets: tuple or None
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets or self.default_buckets)
+        self._shards = [_Shard() for _ in range(SHARDS)]
+
+    def observe(self, value, labels=()):
+        """
+        Records an observation.
+
+        :param value: The observed value.
+        :type value: float
+        :param labels: The values of the labels.
+        :type labels: tuple
+        """
+        index = bisect_left(self.buckets, value)
+        shard = self._shards[shard_index()]
+        with shard.lock:
+            counts = shard.values.get(labels)
+            if counts is None:
+                # Per bucket counts, the +Inf bucket and the sum
+                counts = shard.values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def values(self):
+        """
+        Sums the values of all shards.
+
+        :returns: Mapping of labels to bucket counts followed by the sum.
+        :rtype: dict
+        """
+        totals = {}
+        for shard in self._shards:
+            with shard.lock:
+                items = [(k, list(v)) for k, v in shard.values.items()]
+            for labels, counts in items:
+                total = totals.get(labels)
+                if total is None:
+                    totals[labels] = counts
+                else:
+                    for i, count in enumerate(counts):
+                        total[i] += count
+        return totals
+
+    def samples(self, values=None):
+        """
+        Yields the samples of the metric.
+
+        :param values: Values to use instead of the recorded ones.
+        :type values: dict or None
+        :returns: Name, formatted labels and value of each sample.
+        :rtype: generator
+        """
+        if values is None:
+            values = self.values()
+        bounds = self.buckets + (float('inf'),)
+        for labels, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield (self.name + '_bucket', format_labels(
+                    self.labelnames, labels,
+                    (('le', format_value(bound)),)), cumulative)
+            formatted = format_labels(self.labelnames, labels)
+            yield self.name + '_sum', formatted, counts[-1]
+            yield self.name + '_count', formatted, cumulative
+
+
+class Callback:
+    """
+    A metric whose values are read from a function when rendered.
+    """
+
+    def __init__(self, name, help, func, labelnames=(), type='gauge'):
+        """
+        Initializes a new Callback instance.
+
+        :param name: The name of the metric.
+        :type name: str
+        :param help: Description of the metric.
+        :type help: str
+        :param func: Returns a value or a mapping of labels to values.
+        :type func: callable
+        :param labelnames: The names of the labels.
+        :type labelnames: tuple
+        :param type: The metric type in the text format.
+        :type type: str
+        """
+        self.name = name
+        self.help = help
+        self.func = func
+        self.labelnames = tuple(labelnames)
+        self.type = type
+
+    def values(self):
+        """
+        Reads the values from the function.
+
+        :returns: Mapping of labels to their value.
+        :rtype: dict
+        """
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return values
+
+    def samples(self, values=None):
+        """
+        Yields the samples of the metric.
+
+        :param values: Values of all worker processes, whose labels end
+                       with the pid of their process, instead of the
+                       values of this process.
+        :type values: dict or None
+        :returns: Name, formatted labels and value of each sample.
+        :rtype: generator
+        """
+        labelnames = self.labelnames
+        if values is None:
+            values = self.values()
+        else:
+            labelnames += ('pid',)
+        for labels, value in sorted(values.items()):
+            yield self.name, format_labels(labelnames, labels), value
+
+
+class MetricsRegistry:
+    """
+    Holds metrics and renders them in the Prometheus text format.
+
+    When shared, each process writes its values to a file of its own in
+    the shared directory, and rendering adds up the files of all
+    processes. The counters and histograms of processes which exited are
+    kept in a retired file so totals never go down. Callback values are
+    per process and are labelled with its pid.
+    """
+
+    #: Class level logger
+    logger = logging.getLogger('MetricsRegistry')
+
+    #: Name of the file holding the values of exited processes
+    retired_name = 'retired'
+
+    def __init__(self):
+        """
+        Initializes a new, empty, MetricsRegistry instance.
+        """
+        self._metrics = {}
+        self._lock = threading.Lock()
+        #: Directory shared by worker processes or None
+        self.directory = None
+
+    def register(self, metric):
+        """
+        Registers a metric, replacing one with the same name.
+
+        :param metric: The metric to register.
+        :type metric: Counter or Gauge or Histogram or Callback
+        :returns: The metric.
+        :rtype: Counter or Gauge or Histogram or Callback
+        """
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        """
+        Creates and registers a Counter.
+
+        :returns: The new Counter.
+        :rtype: Counter
+        """
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        """
+        Creates and registers a Gauge.
+
+        :returns: The new Gauge.
+        :rtype: Gauge
+        """
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=None):
+        """
+        Creates and registers a Histogram.
+
+        :returns: The new Histogram.
+        :rtype: Histogram
+        """
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, func, labelnames=(), type='gauge'):
+        """
+        Creates and registers a Callback.
+
+        :returns: The new Callback.
+        :rtype: Callback
+        """
+        return self.register(Callback(name, help, func, labelnames, type))
+
+    def share(self, directory):
+        """
+        Shares the values of worker processes through a directory. Called
+        before forking the workers.
+
+        :param directory: An existing directory only used for metrics.
+        :type directory: str
+        """
+        self.directory = directory
+
+    def snapshot(self):
+        """
+        Returns the values of all metrics of this process.
+
+        :returns: Mapping of metric names to their kind and values.
+        :rtype: dict
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            metric.name: {
+                'kind': type(metric).__name__.lower(),
+                'values': [
+                    [list(labels), value]
+                    for labels, value in metric.values().items()],
+            } for metric in metrics}
+
+    def write(self):
+        """
+        Writes the values of this process to the shared directory.
+        """
+        self._write(str(os.getpid()), self.snapshot())
+
+    def write_periodically(self, interval=1.0):
+        """
+        Writes the values of this process to the shared directory from a
+        background thread, so other processes render recent values. Called
+        in each worker after forking.
+
+        :param interval: Seconds between writes.
+        :type interval: float
+        :returns: The writing thread.
+        :rtype: threading.Thread
+        """
+        def writer():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.write()
+                except (OSError, ValueError) as error:
+                    self.logger.error(
+                        'Unable to write metrics %s: %s', type(error), error)
+
+        thread = threading.Thread(target=writer, daemon=True)
+        thread.start()
+        return thread
+
+    def retire(self, pid):
+        """
+        Adds the counters and histograms of an exited process to the
+        retired values and removes its file. Its gauges and callbacks are
+        dropped.
+
+        :param pid: The pid of the process.
+        :type pid: int
+        """
+        path = self._path(str(pid))
+        with self._locked(fcntl.LOCK_EX):
+            try:
+                with open(path) as snapshot_file:
+                    snapshot = json.load(snapshot_file)
+            except FileNotFoundError:
+                return
+            retired = self._read(self.retired_name) or {}
+            for name, entry in snapshot.items():
+                if entry['kind'] not in ('counter', 'histogram'):
+                    continue
+                values = {
+                    tuple(labels): value for labels, value in
+                    retired.get(name, {'values': []})['values']}
+                for labels, value in entry['values']:
+                    labels = tuple(labels)
+                    values[labels] = add_values(values.get(labels), value)
+                retired[name] = {
+                    'kind': entry['kind'],
+                    'values': [[list(k), v] for k, v in values.items()]}
+            self._write(self.retired_name, retired)
+            os.remove(path)
+
+    def render(self):
+        """
+        Renders all metrics in the Prometheus text format.
+
+        :returns: The rendered metrics.
+        :rtype: str
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        shared = None
+        if self.directory is not None:
+            self.write()
+            shared = self._read_shared()
+        lines = []
+        for name, metric in metrics:
+            lines.append('# HELP {} {}'.format(name, metric.help))
+            lines.append('# TYPE {} {}'.format(name, metric.type))
+            values = None if shared is None else shared.get(name, {})
+            for sample_name, labels, value in metric.samples(values):
+                lines.append('{}{} {}'.format(
+                    sample_name, labels, format_value(value)))
+        lines.append('')
+        return '\n'.join(lines)
+
+    def _read_shared(self):
+        """
+        Adds up the values of all processes in the shared directory.
+
+        :returns: Mapping of metric names to labels and their value.
+        :rtype: dict
+        """
+        merged = {}
+        with self._locked(fcntl.LOCK_SH):
+            names = [
+                name[:-len('.json')] for name in os.listdir(self.directory)
+                if name.endswith('.json')]
+            for process in names:
+                snapshot = self._read(process)
+                if snapshot is None:
+                    continue
+                for name, entry in snapshot.items():
+                    values = merged.setdefault(name, {})
+                    for labels, value in entry['values']:
+                        labels = tuple(labels)
+                        if entry['kind'] == 'callback':
+                            labels += (process,)
+                        values[labels] = add_values(values.get(labels), value)
+        return merged
+
+    @contextmanager
+    def _locked(self, operation):
+        """
+        Locks the shared directory while reading or changing files of
+        other processes.
+
+        :param operation: fcntl.LOCK_SH or fcntl.LOCK_EX.
+        :type operation: int
+        """
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _path(self, name):
+        """
+        Returns the path of a file in the shared directory.
+
+        :param name: A pid or the retired name.
+        :type name: str
+        :returns: The path.
+        :rtype: str
+        """
+        return os.path.join(self.directory, name + '.json')
+
+    def _read(self, name):
+        """
+        Reads a file of the shared directory.
+
+        :param name: A pid or the retired name.
+        :type name: str
+        :returns: The values or None if there is no such file.
+        :rtype: dict or None
+        """
+        try:
+            with open(self._path(name)) as snapshot_file:
+                return json.load(snapshot_file)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, name, values):
+        """
+        Replaces a file of the shared directory so readers never see a
+        partly written file.
+
+        :param name: A pid or the retired name.
+        :type name: str
+        :param values: The values to write.
+        :type values: dict
+        """
+        path = self._path(name)
+        with open(path + '.tmp', 'w') as snapshot_file:
+            json.dump(values, snapshot_file)
+        os.replace(path + '.tmp', path)
+
+
+#: The registry of all metrics of the server
+REGISTRY = MetricsRegistry()
+
+REGISTRY.callback(
+    'commissaire_http_threads', 'Threads of the server process.',
+    threading.active_count)
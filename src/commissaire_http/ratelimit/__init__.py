@@ -0,0 +1,347 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Rate limiting for Commissaire.
+"""
+
+import logging
+import math
+import threading
+import time
+
+from commissaire_http.util.wsgi import call_app_async
+
+
+class TokenBucket:
+    """
+    Allows rate requests per second with bursts of up to burst requests.
+    """
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        """
+        Initializes a new, full, TokenBucket instance.
+
+        :param rate: Tokens added per second.
+        :type rate: float
+        :param burst: Maximum number of tokens.
+        :type burst: float
+        :param now: The current time.monotonic().
+        :type now: float
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def wait(self, now):
+        """
+        Refills the bucket and checks if a token is available.
+
+        :param now: The current time.monotonic().
+        :type now: float
+        :returns: 0 if available, else seconds until a token is available.
+        :rtype: float
+        """
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        """
+        Takes a token if one is available.
+
+        :param now: The current time.monotonic().
+        :type now: float
+        :returns: 0 on success, else seconds until a token is available.
+        :rtype: float
+        """
+        wait = self.wait(now)
+        if not wait:
+            self.tokens -= 1
+        return wait
+
+    def is_full(self, now):
+        """
+        Checks if the bucket has refilled completely, meaning it is unused.
+
+        :param now: The current time.monotonic().
+        :type now: float
+        :returns: True if the bucket is full.
+        :rtype: bool
+        """
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class RateLimitRule:
+    """
+    Describes which requests are limited and who shares a bucket.
+
+    The key decides who shares a bucket:
+
+    - user: the authenticated REMOTE_USER, else the client address
+    - ip: the client address
+    - route: all clients of a route
+    """
+
+    #: Functions returning the bucket identity for a request
+    keys = {
+        'user': lambda environ: (
+            environ.get('REMOTE_USER') or environ.get('REMOTE_ADDR')),
+        'ip': lambda environ: environ.get('REMOTE_ADDR'),
+        'route': lambda environ: getattr(
+            environ.get('routes.route'), 'routepath', environ['PATH_INFO']),
+    }
+
+    def __init__(self, key, rate, burst=None, path=None, method=None):
+        """
+        Initializes a new RateLimitRule instance.
+
+        :param key: One of user, ip or route.
+        :type key: str
+        :param rate: Requests allowed per second.
+        :type rate: float or str
+        :param burst: Requests allowed at once. Defaults to rate, but at
+                      least 1.
+        :type burst: float or str or None
+        :param path: Only limit paths starting with this.
+        :type path: str or None
+        :param method: Only limit this HTTP method.
+        :type method: str or None
+        :raises: ValueError
+        """
+        if key not in self.keys:
+            raise ValueError(
+                'Unknown rate limit key "{}". Use one of: {}'.format(
+                    key, ', '.join(sorted(self.keys))))
+        self.key = key
+        self.rate = float(rate)
+        if not self.rate > 0:
+            raise ValueError(
+                'Rate limit rate must be above 0, not {}'.format(rate))
+        if burst is None:
+            self.burst = max(1.0, self.rate)
+        else:
+            self.burst = float(burst)
+        if not self.burst >= 1:
+            raise ValueError(
+                'Rate limit burst must be at least 1, not {}'.format(burst))
+        self.path = path
+        self.method = method.upper() if method else None
+        self.identify = self.keys[key]
+
+    def matches(self, environ):
+        """
+        Checks if a request is limited by this rule.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :returns: True if the rule applies.
+        :rtype: bool
+        """
+        if self.method and environ['REQUEST_METHOD'] != self.method:
+            return False
+        if self.path and not environ['PATH_INFO'].startswith(self.path):
+            return False
+        return True
+
+
+class _Shard:
+    """
+    A part of the buckets with its own lock.
+    """
+
+    __slots__ = ('lock', 'buckets')
+
+    def __init__(self):
+        """
+        Initializes a new, empty, _Shard instance.
+        """
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+
+class RateLimiter:
+    """
+    WSGI middleware answering requests over a rate limit with a 429.
+
+    Buckets are spread over shards, each with its own lock, so requests
+    of different clients rarely wait for each other. Requests for exempt
+    paths, such as probes and metrics, are never limited.
+    """
+
+    #: Logger for RateLimiter
+    logger = logging.getLogger('RateLimiter')
+
+    #: Number of shards the buckets are spread over
+    shards = 16
+
+    #: Buckets kept per shard before unused ones are dropped
+    max_buckets = 4096
+
+    def __init__(self, app, rules, exempt_paths=None):
+        """
+        Initializes a new RateLimiter instance.
+
+        :param app: A WSGI app to wrap.
+        :type app: instance
+        :param rules: The rules to enforce.
+        :type rules: list
+        :param exempt_paths: Paths passed through without being limited.
+        :type exempt_paths: None or [str]
+        """
+        self._app = app
+        self.rules = rules
+        self.exempt_paths = frozenset(exempt_paths or ())
+        self._shards = [_Shard() for _ in range(self.shards)]
+
+    def __call__(self, environ, start_response):
+        """
+        Passes the request to the app if no limit is exceeded.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :returns: Response back to requestor.
+        :rtype: list
+        """
+        if environ.get('PATH_INFO') in self.exempt_paths:
+            return self._app(environ, start_response)
+        wait = self.check(environ)
+        if wait:
+            return self._reject(environ, start_response, wait)
+        return self._app(environ, start_response)
+
+    async def call_async(self, environ, start_response):
+        """
+        Coroutine version of __call__ used by the asyncio server.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :returns: Response back to requestor.
+        :rtype: list
+        """
+        if environ.get('PATH_INFO') in self.exempt_paths:
+            return await call_app_async(self._app, environ, start_response)
+        wait = self.check(environ)
+        if wait:
+            return self._reject(environ, start_response, wait)
+        return await call_app_async(self._app, environ, start_response)
+
+    def check(self, environ):
+        """
+        Takes a token from the bucket of every rule matching the request.
+        Tokens are only taken when every bucket has one, so a rejected
+        request does not use up the budget of other rules.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :returns: 0 if allowed, else seconds until the request is allowed.
+        :rtype: float
+        """
+        matched = []
+        for index, rule in enumerate(self.rules):
+            if rule.matches(environ):
+                key = (index, rule.identify(environ))
+                matched.append((key, rule, self._shards[
+                    hash(key) % self.shards]))
+        if not matched:
+            return 0
+
+        # Locks are taken in a fixed order so requests can not deadlock
+        shards = sorted(
+            {id(shard): shard for _, _, shard in matched}.items())
+        for _, shard in shards:
+            shard.lock.acquire()
+        try:
+            now = time.monotonic()
+            buckets = [
+                self._get_bucket(shard, key, rule, now)
+                for key, rule, shard in matched]
+            wait = max(bucket.wait(now) for bucket in buckets)
+            if not wait:
+                for bucket in buckets:
+                    bucket.take(now)
+            return wait
+        finally:
+            for _, shard in reversed(shards):
+                shard.lock.release()
+
+    def _get_bucket(self, shard, key, rule, now):
+        """
+        Returns the bucket of a key, creating it if needed. Must be called
+        with the shard lock held.
+
+        :param shard: The shard holding the bucket.
+        :type shard: _Shard
+        :param key: The rule index and identity of the request.
+        :type key: tuple
+        :param rule: The rule of the bucket.
+        :type rule: RateLimitRule
+        :param now: The current time.monotonic().
+        :type now: float
+        :returns: The bucket.
+        :rtype: TokenBucket
+        """
+        bucket = shard.buckets.get(key)
+        if bucket is None:
+            if len(shard.buckets) >= self.max_buckets:
+                self._prune(shard, now)
+            bucket = TokenBucket(rule.rate, rule.burst, now)
+            shard.buckets[key] = bucket
+        return bucket
+
+    def _prune(self, shard, now):
+        """
+        Drops the buckets of a shard which are not in use. Must be called
+        with the shard lock held.
+
+        :param shard: The shard to prune.
+        :type shard: _Shard
+        :param now: The current time.monotonic().
+        :type now: float
+        """
+        for key in [k for k, b in shard.buckets.items() if b.is_full(now)]:
+            del shard.buckets[key]
+
+    def _reject(self, environ, start_response, wait):
+        """
+        Answers a request which is over a limit.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :param wait: Seconds until the request would be allowed.
+        :type wait: float
+        :returns: Response back to requestor.
+        :rtype: list
+        """
+        self.logger.debug(
+            'Rate limited %s %s from %s.', environ['REQUEST_METHOD'],
+            environ['PATH_INFO'],
+            environ.get('REMOTE_USER') or environ.get('REMOTE_ADDR'))
+        start_response(
+            '429 Too Many Requests', [
+                ('content-type', 'text/html'),
+                ('Retry-After', str(int(math.ceil(wait))))])
+        return [bytes('Too Many Requests', 'utf8')]
@@ -18,39 +18,194 @@ HTTP Router.
 """
 
 import logging
+import re
+import threading
+
+from collections import OrderedDict
 
 from routes import Mapper
 
+from commissaire_http.metrics import REGISTRY
+
+#: Route matches answered from the match cache
+CACHE_HITS = REGISTRY.counter(
+    'commissaire_http_route_cache_hits_total',
+    'Route matches answered from the route match cache.')
+#: Route matches which had to search the routes
+CACHE_MISSES = REGISTRY.counter(
+    'commissaire_http_route_cache_misses_total',
+    'Route matches which missed the route match cache.')
+
+#: Requirements which can not match a /, so parameters span one segment
+_SEGMENT_REQUIREMENT = re.compile(R'^\[(?!\^)(?:\\.|[^\]\\/])+\][+*?]?$')
+
+#: Requirement of parameters without one
+_DEFAULT_REQUIREMENT = R'[^/]+'
+
+#: Requirements of the optional slash Router.connect appends
+_OPTIONAL_SLASH = ('[/]?', '/?')
+
+
+class _Node(object):
+    """
+    Node of the route tree matching one path segment.
+    """
+
+    __slots__ = ('literals', 'params', 'routes')
+
+    def __init__(self):
+        #: Child nodes by literal segment
+        self.literals = {}
+        #: Child nodes by (parameter name, requirement) as (regex, node)
+        self.params = {}
+        #: Routes ending at this node as (index, route, slash parameter)
+        self.routes = []
+
+
+def _split_route(route):
+    """
+    Splits the path of a route into segments for the route tree.
+
+    :param route: The route to split.
+    :type route: routes.route.Route
+    :returns: Segments as literal strings or (name, requirement) and the
+              name of the optional slash parameter, or None if the route
+              must be matched by its regular expression.
+    :rtype: tuple or None
+    """
+    if route.minimization or set(route.conditions or ()) - {'method'}:
+        return None
+    parts = list(route.routelist)
+    slash = None
+    if (parts and isinstance(parts[-1], dict) and
+            route.reqs.get(parts[-1].get('name')) in _OPTIONAL_SLASH):
+        slash = parts.pop()['name']
+
+    pieces = [[]]
+    for part in parts:
+        if isinstance(part, str):
+            head, *tail = part.split('/')
+            if head:
+                pieces[-1].append(head)
+            pieces.extend([piece] if piece else [] for piece in tail)
+        elif part.get('type') == ':' and part['name'] != 'controller':
+            pieces[-1].append(part)
+        else:
+            return None
+    # Paths have to start with a / so the first piece is empty
+    if pieces[0] or len(pieces) == 1:
+        return None
+
+    segments = []
+    for piece in pieces[1:]:
+        if not piece:
+            segments.append('')
+        elif len(piece) > 1:
+            # Literals mixed with parameters
+            return None
+        elif isinstance(piece[0], str):
+            segments.append(piece[0])
+        else:
+            requirement = route.reqs.get(piece[0]['name'])
+            if requirement is None:
+                requirement = _DEFAULT_REQUIREMENT
+            elif not _SEGMENT_REQUIREMENT.match(requirement):
+                return None
+            segments.append((piece[0]['name'], requirement))
+    return segments, slash
+
+
+def _route_result(route, values):
+    """
+    Creates the match result of a route the way routes.route.Route.match
+    does.
+
+    :param route: The route which matched.
+    :type route: routes.route.Route
+    :param values: Values of the parameters in the path.
+    :type values: dict
+    :returns: The match result.
+    :rtype: dict
+    """
+    result = {}
+    for key, value in values.items():
+        if not value and route.defaults.get(key):
+            value = route.defaults[key]
+        result[key] = value
+    for key in route._default_keys - frozenset(values):
+        result[key] = route.defaults[key]
+    return result
+
 
 class Router(Mapper):
     """
     URL router.
+
+    Routes are matched through a tree of path segments instead of trying
+    the regular expression of one route after another. Literal segments
+    are looked up directly and parameters are checked against their
+    requirement per segment, so the time to match does not grow with the
+    number of routes. Routes the tree can not express, such as parameters
+    mixed with literals in one segment, are matched by their regular
+    expressions.
+
+    When cache_size is set, the matches of the most recently used
+    (method, path) pairs are kept until the routes change. Paths which
+    match no route and long paths are not cached, so requests for random
+    paths can not push out the matches of real ones.
     """
 
     #: Class level logger
     logger = logging.getLogger('Router')
 
-    def __init__(self, optional_slash=False, *args, **kwargs):
+    #: Longest path whose match is cached
+    max_cached_path = 256
+
+    def __init__(self, optional_slash=False, cache_size=0, *args, **kwargs):
         """
         :param optional_slash: If /'s are optional when matching directories.
         :type optional_slash: bool
+        :param cache_size: Route matches to cache. 0 disables caching.
+        :type cache_size: int
         :param args: All non-keyword arguments.
         :type args: tuple
         :param kwargs: All other keyword arguments.
         :type kwargs: dict
         """
+        #: Root of the route tree, routes matched by regular expression
+        #: and the match cache
+        self._tree = None
+        self.cache_size = cache_size
+        self._cache_lock = threading.Lock()
         super().__init__(*args, **kwargs)
         self._optional_slash = optional_slash
 
+    def configure_cache(self, cache_size):
+        """
+        Sets the number of route matches to cache, dropping cached matches.
+
+        :param cache_size: Route matches to cache. 0 disables caching.
+        :type cache_size: int
+        """
+        with self._cache_lock:
+            self.cache_size = cache_size
+            if self._tree is not None and self._tree[2] is not None:
+                self._tree[2].clear()
+
     def connect(self, *args, **kwargs):
         """
-        Overrides Mapper.connect adding in support for optional slashses.
+        Overrides Mapper.connect adding in support for optional slashses
+        and for middleware wrapping the route's handler. The middleware
+        keyword lists callables which take a WSGI app and return one, the
+        first listed being the outermost.
 
         :param args: All non-keyword arguments.
         :type args: tuple
         :param kwargs: All other keyword arguments.
         :type kwargs: dict
         """
+        # Route defaults are made strings so middleware is kept on the route
+        middleware = tuple(kwargs.pop('middleware', ()))
         # Cast to a list so we can modify the args
         args = list(args)
         # If we are asked to use an optional slash then find the url_path
@@ -65,6 +220,178 @@ class Router(Mapper):
                 args[url_path_idx] = args[url_path_idx][:-1] + '{_:[/]?}'
         # Call the parent connect to do the rest of the heavy lifting.
         super().connect(*args, **kwargs)
+        self.matchlist[-1].middleware = middleware
+        # Matching falls back to routes until the tree is built again
+        self._tree = None
+
+    def _create_regs(self, *args, **kwargs):
+        """
+        Overrides Mapper._create_regs also building the route tree.
+
+        :param args: All non-keyword arguments.
+        :type args: tuple
+        :param kwargs: All keyword arguments.
+        :type kwargs: dict
+        """
+        super()._create_regs(*args, **kwargs)
+        root = _Node()
+        regex_routes = []
+        # Matches only depend on the method and path without other conditions
+        cacheable = True
+        for index, route in enumerate(self.matchlist):
+            if route.static:
+                continue
+            if set(route.conditions or ()) - {'method'}:
+                cacheable = False
+            split = _split_route(route)
+            if split is None:
+                regex_routes.append((index, route))
+                continue
+            node = root
+            for segment in split[0]:
+                if isinstance(segment, str):
+                    node = node.literals.setdefault(segment, _Node())
+                    continue
+                if segment not in node.params:
+                    node.params[segment] = (
+                        re.compile('(?:{})\\Z'.format(segment[1])), _Node())
+                node = node.params[segment][1]
+            node.routes.append((index, route, split[1]))
+        self.logger.debug(
+            'Route tree built. %s routes use regular expressions.',
+            len(regex_routes))
+        cache = OrderedDict() if cacheable else None
+        self._tree = (root, regex_routes, cache)
+
+    def _match(self, url, environ):
+        """
+        Overrides Mapper._match to look routes up in the route tree.
+        Routes registered first still win.
+
+        :param url: The path to match.
+        :type url: str
+        :param environ: WSGI environment dictionary.
+        :type environ: dict or None
+        :returns: The match result, route and match log.
+        :rtype: tuple
+        """
+        tree = self._tree
+        if (tree is None or not self._created_regs or self.always_scan or
+                self.debug or self.prefix or self.sub_domains or
+                not isinstance(url, str)):
+            return super()._match(url, environ)
+        environ = environ or self.environ
+        root, regex_routes, cache = tree
+        if cache is None or self.cache_size <= 0:
+            return self._tree_lookup(root, regex_routes, url, environ)
+
+        key = (environ.get('REQUEST_METHOD') if environ else None, url)
+        with self._cache_lock:
+            cached = cache.get(key)
+            if cached is not None:
+                cache.move_to_end(key)
+        if cached is not None:
+            CACHE_HITS.inc()
+            match, route = cached
+            # Callers may change the result so each gets its own copy
+            return (dict(match), route, [])
+        CACHE_MISSES.inc()
+
+        result = self._tree_lookup(root, regex_routes, url, environ)
+        if result[0] is None or len(url) > self.max_cached_path:
+            return result
+        with self._cache_lock:
+            cache[key] = (dict(result[0]), result[1])
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return result
+
+    def _tree_lookup(self, root, regex_routes, url, environ):
+        """
+        Looks a path up in the route tree and the routes matched by
+        regular expression.
+
+        :param root: Root of the route tree.
+        :type root: _Node
+        :param regex_routes: Routes matched by regular expression as
+                             (index, route).
+        :type regex_routes: list
+        :param url: The path to match.
+        :type url: str
+        :param environ: WSGI environment dictionary.
+        :type environ: dict or None
+        :returns: The match result, route and match log.
+        :rtype: tuple
+        """
+        best = None
+        if url.startswith('/'):
+            best = self._tree_match(root, url.split('/'), environ)
+        limit = best[0] if best else len(self.matchlist)
+        for index, route in regex_routes:
+            if index >= limit:
+                break
+            match = route.match(
+                url, environ, self.sub_domains, self.sub_domains_ignore,
+                self.domain_match)
+            if isinstance(match, dict) or match:
+                return (match, route, [])
+        if best is None:
+            return (None, None, [])
+        return (_route_result(best[1], best[2]), best[1], [])
+
+    def _tree_match(self, root, segments, environ):
+        """
+        Finds the first registered route in the tree matching a path.
+
+        :param root: Root of the route tree.
+        :type root: _Node
+        :param segments: Segments of the path, starting with the empty
+                         segment before the first /.
+        :type segments: list
+        :param environ: WSGI environment dictionary.
+        :type environ: dict or None
+        :returns: The index, route and parameter values or None.
+        :rtype: tuple or None
+        """
+        method = environ.get('REQUEST_METHOD') if environ else None
+        end = len(segments)
+        best = None
+        pending = [(root, 1, {})]
+        while pending:
+            node, depth, values = pending.pop()
+            # A trailing / is taken by optional slash parameters
+            slash = None
+            if depth == end:
+                slash = ''
+            elif depth == end - 1 and not segments[depth]:
+                slash = '/'
+            if slash is not None:
+                for index, route, slash_name in node.routes:
+                    if best is not None and index >= best[0]:
+                        break
+                    if slash and slash_name is None:
+                        continue
+                    if (method is not None and route.conditions and
+                            'method' in route.conditions and
+                            method not in route.conditions['method']):
+                        continue
+                    found = dict(values)
+                    if slash_name is not None:
+                        found[slash_name] = slash
+                    best = (index, route, found)
+                    break
+            if depth == end:
+                continue
+            segment = segments[depth]
+            child = node.literals.get(segment)
+            if child is not None:
+                pending.append((child, depth + 1, values))
+            for (name, _), (regex, child) in node.params.items():
+                if regex.match(segment):
+                    child_values = dict(values)
+                    child_values[name] = segment
+                    pending.append((child, depth + 1, child_values))
+        return best
 
     def match(self, *args, **kwargs):
         """
@@ -79,6 +406,8 @@ class Router(Mapper):
         :returns: Dictionary of mapped result or None if no match.
         :rtype: dict or None
         """
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return super(Router, self).match(*args, **kwargs)
         self.logger.debug(
             'Executing routes.Mapper.route with: args=%s, kwargs=%s',
             args, kwargs)
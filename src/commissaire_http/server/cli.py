@@ -17,13 +17,38 @@
 Commissaire HTTP based application server.
 """
 import argparse
+import logging
+import shutil
+import signal
+import tempfile
+import threading
 
-from commissaire.util.config import import_plugin
+from concurrent.futures import ThreadPoolExecutor
 
+from commissaire.util.config import ConfigurationError
+
+from commissaire_http import timing
+from commissaire_http.admission import (
+    AdmissionController, AIMDLimit, FixedLimit)
 from commissaire_http.authentication import (
-    AuthenticationManager, Authenticator)
+    AuthenticationManager, Authenticator, LazyAuthenticator)
+from commissaire_http.circuitbreaker import BREAKERS
+from commissaire_http.compression import CompressionMiddleware
+from commissaire_http.deadline import DeadlineMiddleware
+from commissaire_http.health import HEALTH
+from commissaire_http.metrics import REGISTRY
+from commissaire_http.ratelimit import RateLimiter, RateLimitRule
 from commissaire_http.server.routing import DISPATCHER  # noqa
 from commissaire_http import CommissaireHttpServer, parse_args
+from commissaire_http.aio import AsyncCommissaireHttpServer
+from commissaire_http.supervisor import WorkerSupervisor
+from commissaire_http.util.logs import configure_logging
+from commissaire_http.util.sockets import (
+    create_unix_socket, get_systemd_sockets)
+
+#: Paths answered without authentication
+UNAUTHENTICATED_PATHS = [
+    '/metrics', '/metrics/', '/healthz', '/healthz/', '/readyz', '/readyz/']
 
 
 def inject_authentication(plugins, self_auths=None):
@@ -37,16 +62,17 @@ def inject_authentication(plugins, self_auths=None):
     :returns: A wrapped Dispatcher instance
     :rtype: commissaire.dispatcher.Dispatcher
     """
-    global DISPATCHER
     authn_manager = AuthenticationManager(
         DISPATCHER.dispatch, self_auths=self_auths)
     for module_name in plugins:
-        authentication_class = import_plugin(
-            module_name, 'commissaire_http.authentication', Authenticator)
-        # NOTE: We set the app to None as we are not using the
-        #       authentication_class as the dispatcher itself
+        # NOTE: Plugins are imported on first use, or by
+        #       load_authenticators before serving, to speed up start up.
         authn_manager.authenticators.append(
-            authentication_class(None, **plugins[module_name]))
+            LazyAuthenticator(module_name, **plugins[module_name]))
+
+    if timing.enabled:
+        authn_manager._authenticate = timing.TimedStage(
+            'auth', authn_manager._authenticate)
 
     # If there are no authentication managers defined, append the default
     # which will deny all requests
@@ -61,6 +87,238 @@ def inject_authentication(plugins, self_auths=None):
     return DISPATCHER
 
 
+def load_authenticators(authn_manager):
+    """
+    Imports and creates the authentication plugins of a manager.
+
+    :param authn_manager: The manager holding the plugins.
+    :type authn_manager: commissaire_http.authentication.AuthenticationManager
+    """
+    for authenticator in authn_manager.authenticators:
+        if isinstance(authenticator, LazyAuthenticator):
+            authenticator.load()
+
+
+def reload_handlers(signum=None, frame=None):
+    """
+    Reimports the handlers in a background thread so requests keep being
+    served while it happens.
+
+    :param signum: The signal number, if called as a signal handler.
+    :type signum: int or None
+    :param frame: The current stack frame, if called as a signal handler.
+    :type frame: frame or None
+    :returns: The thread doing the reload.
+    :rtype: threading.Thread
+    """
+    thread = threading.Thread(target=_hot_reload, daemon=True)
+    thread.start()
+    return thread
+
+
+def _hot_reload():
+    """
+    Calls DISPATCHER.hot_reload, logging errors instead of raising them.
+    """
+    try:
+        DISPATCHER.hot_reload()
+    except Exception as error:
+        DISPATCHER.logger.error(
+            'Unable to reload handlers. Keeping the current ones. %s: %s',
+            type(error), error)
+
+
+def inject_stage_timing():
+    """
+    Enables timing of the stages of requests and times routing and the
+    dispatcher's dispatch method. It must be injected before anything
+    else.
+
+    :returns: A wrapped Dispatcher instance
+    :rtype: commissaire.dispatcher.Dispatcher
+    """
+    timing.enabled = True
+    timing.time_routing(DISPATCHER.router)
+    # Handlers are wrapped when the dispatch table is compiled
+    DISPATCHER.compile_routes()
+    DISPATCHER.dispatch = timing.TimedStage('dispatch', DISPATCHER.dispatch)
+    return DISPATCHER
+
+
+def inject_server_timing():
+    """
+    Injects the Server-Timing header into the dispatcher's dispatch
+    method. It wraps everything else so all stages are reported.
+
+    :returns: A wrapped Dispatcher instance
+    :rtype: commissaire.dispatcher.Dispatcher
+    """
+    DISPATCHER.dispatch = timing.ServerTimingMiddleware(DISPATCHER.dispatch)
+    return DISPATCHER
+
+
+def inject_compression(min_size, cache_size=0):
+    """
+    Injects response compression into the dispatcher's dispatch method.
+
+    :param min_size: Smallest body in bytes which is compressed.
+    :type min_size: int
+    :param cache_size: Compressed bodies to cache. 0 disables caching.
+    :type cache_size: int
+    :returns: A wrapped Dispatcher instance
+    :rtype: commissaire.dispatcher.Dispatcher
+    """
+    DISPATCHER.dispatch = CompressionMiddleware(
+        DISPATCHER.dispatch, min_size=min_size, cache_size=cache_size)
+    return DISPATCHER
+
+
+def inject_rate_limiting(rate_limits, exempt_paths=None):
+    """
+    Injects rate limiting into the dispatcher's dispatch method. It must
+    be injected before authentication so it runs after it.
+
+    :param rate_limits: Rate limit configurations.
+    :type rate_limits: list
+    :param exempt_paths: Paths which are not limited.
+    :type exempt_paths: None or [str]
+    :returns: A wrapped Dispatcher instance
+    :rtype: commissaire.dispatcher.Dispatcher
+    :raises: ValueError, TypeError
+    """
+    rules = [RateLimitRule(**rate_limit) for rate_limit in rate_limits]
+    DISPATCHER.dispatch = RateLimiter(
+        DISPATCHER.dispatch, rules, exempt_paths=exempt_paths)
+    return DISPATCHER
+
+
+def inject_admission_control(max_in_flight, adaptive=False,
+                             exempt_paths=None):
+    """
+    Injects admission control into the dispatcher's dispatch method. It
+    wraps everything else so rejected requests are cheap.
+
+    :param max_in_flight: Maximum number of requests in-flight.
+    :type max_in_flight: int
+    :param adaptive: If the limit adapts to the latency of requests.
+    :type adaptive: bool
+    :param exempt_paths: Paths which are not limited.
+    :type exempt_paths: None or [str]
+    :returns: A wrapped Dispatcher instance
+    :rtype: commissaire.dispatcher.Dispatcher
+    """
+    if adaptive:
+        limit = AIMDLimit(limit=max_in_flight, max_limit=max_in_flight * 10)
+    else:
+        limit = FixedLimit(max_in_flight)
+    DISPATCHER.dispatch = AdmissionController(
+        DISPATCHER.dispatch, limit, exempt_paths=exempt_paths)
+    return DISPATCHER
+
+
+def inject_request_deadlines(timeout, exempt_paths=None):
+    """
+    Injects the middleware setting the deadline of each request.
+
+    :param timeout: Seconds requests may take. 0 only applies timeouts
+                    given by clients.
+    :type timeout: float
+    :param exempt_paths: Paths which get no deadline.
+    :type exempt_paths: None or [str]
+    :returns: A wrapped Dispatcher instance
+    :rtype: commissaire.dispatcher.Dispatcher
+    """
+    DISPATCHER.dispatch = DeadlineMiddleware(
+        DISPATCHER.dispatch, timeout, exempt_paths=exempt_paths)
+    return DISPATCHER
+
+
+def get_listen_socket(listen_unix=None, backlog=128):
+    """
+    Returns the socket to serve on when not binding an interface and port.
+
+    :param listen_unix: Path of a Unix domain socket to listen on.
+    :type listen_unix: str or None
+    :param backlog: Size of the listen backlog of a new socket.
+    :type backlog: int
+    :returns: The socket passed by systemd, a new Unix domain socket or
+              None.
+    :rtype: socket.socket or None
+    """
+    systemd_sockets = get_systemd_sockets()
+    if systemd_sockets:
+        for extra in systemd_sockets[1:]:
+            logging.getLogger('CommissaireHttpServer').warning(
+                'Ignoring extra socket passed by systemd: %s',
+                extra.getsockname())
+            extra.close()
+        return systemd_sockets[0]
+    if listen_unix:
+        return create_unix_socket(listen_unix, backlog)
+    return None
+
+
+def connect_bus(bus_kwargs, health_check_interval=5.0):
+    """
+    Connects the dispatcher to the bus and starts checking its readiness.
+
+    :param bus_kwargs: Keyword arguments for Dispatcher.setup_bus.
+    :type bus_kwargs: dict
+    :param health_check_interval: Seconds between readiness checks.
+    :type health_check_interval: float
+    """
+    DISPATCHER.setup_bus(**bus_kwargs)
+    HEALTH.interval = health_check_interval
+    HEALTH.start(DISPATCHER.bus)
+
+
+def register_server_metrics(server):
+    """
+    Registers metrics read from the server when rendered.
+
+    :param server: The server to read from.
+    :type server: commissaire_http.CommissaireHttpServer
+    """
+    REGISTRY.callback(
+        'commissaire_http_tls_handshakes_total', 'TLS handshakes completed.',
+        lambda: server.tls_stats()['handshakes'], type='counter')
+    REGISTRY.callback(
+        'commissaire_http_tls_resumed_total',
+        'TLS handshakes which resumed a session.',
+        lambda: server.tls_stats()['resumed'], type='counter')
+
+
+def run_workers(server, workers, worker_init, before_restart):
+    """
+    Supervises pre-forked workers until they are stopped. The workers share
+    their metrics through a temporary directory, so whichever worker is
+    scraped renders the metrics of all of them.
+
+    :param server: The server whose socket is shared with workers.
+    :type server: commissaire_http.CommissaireHttpServer
+    :param workers: The number of worker processes to keep running.
+    :type workers: int
+    :param worker_init: Callable executed in each worker after forking.
+    :type worker_init: callable
+    :param before_restart: Callable executed before restarting workers.
+    :type before_restart: callable
+    """
+    metrics_directory = tempfile.mkdtemp(prefix='commissaire-metrics-')
+    REGISTRY.share(metrics_directory)
+
+    def init():
+        worker_init()
+        REGISTRY.write_periodically()
+
+    supervisor = WorkerSupervisor(
+        server, workers, worker_init=init, before_restart=before_restart,
+        after_exit=REGISTRY.retire)
+    try:
+        supervisor.run()
+    finally:
+        shutil.rmtree(metrics_directory, ignore_errors=True)
+
+
 def main():
     """
     Main entry point.
@@ -71,34 +329,117 @@ def main():
     epilog = 'Example: commissaire -c conf/myconfig.json'
     parser = argparse.ArgumentParser(epilog=epilog)
     args = parse_args(parser)
+    configure_logging(args.debug, args.log_queue_size)
 
     try:
-        # Inject the authentication plugin
+        BREAKERS.configure(
+            args.circuit_breaker_failure_ratio,
+            args.circuit_breaker_min_requests,
+            args.circuit_breaker_window,
+            args.circuit_breaker_reset_timeout)
+        DISPATCHER.router.configure_cache(args.route_cache_size)
+
+        if args.server_timing:
+            DISPATCHER = inject_stage_timing()
+
+        if args.compress_min_size > 0:
+            DISPATCHER = inject_compression(
+                args.compress_min_size, args.compress_cache_size)
+
+        if args.rate_limits:
+            try:
+                DISPATCHER = inject_rate_limiting(
+                    args.rate_limits, UNAUTHENTICATED_PATHS)
+            except (ValueError, TypeError) as error:
+                parser.error(
+                    'Invalid rate limit configuration: {}'.format(error))
+
+        # Inject the authentication plugin. Metrics are scraped and
+        # probes are answered without credentials.
         DISPATCHER = inject_authentication(
             args.authentication_plugins,
-            args.self_auths)
+            (args.self_auths or []) + UNAUTHENTICATED_PATHS)
+        authn_manager = DISPATCHER.dispatch
+
+        if args.max_in_flight > 0:
+            DISPATCHER = inject_admission_control(
+                args.max_in_flight, args.adaptive_admission,
+                UNAUTHENTICATED_PATHS)
 
-        # Connect to the bus
-        DISPATCHER.setup_bus(
-            args.bus_exchange,
-            args.bus_uri,
-            [{'name': 'simple', 'routing_key': 'simple.*'}])
+        if args.server_timing:
+            DISPATCHER = inject_server_timing()
+
+        # Outermost so the deadline also covers authentication. Probes
+        # and metrics pass every layer but authentication untouched.
+        DISPATCHER = inject_request_deadlines(
+            args.request_timeout, UNAUTHENTICATED_PATHS)
+
+        bus_kwargs = {
+            'exchange_name': args.bus_exchange,
+            'connection_url': args.bus_uri,
+            'qkwargs': [{'name': 'simple', 'routing_key': 'simple.*'}],
+        }
+
+        server_class = CommissaireHttpServer
+        if args.asyncio:
+            server_class = AsyncCommissaireHttpServer
 
         # Create the server
-        server = CommissaireHttpServer(
+        server = server_class(
             args.listen_interface,
             args.listen_port,
             DISPATCHER,
             args.tls_pemfile,
-            args.tls_clientverifyfile)
+            args.tls_clientverifyfile,
+            max_threads=args.max_threads,
+            max_queued=args.max_queued,
+            keep_alive_timeout=args.keep_alive_timeout,
+            keep_alive_requests=args.keep_alive_requests,
+            tls_ciphers=args.tls_ciphers,
+            tls_ecdh_curve=args.tls_ecdh_curve,
+            tls_ticket_key_lifetime=args.tls_ticket_key_lifetime,
+            drain_timeout=args.drain_timeout,
+            listen_socket=get_listen_socket(
+                args.listen_unix, args.max_queued),
+            max_body_size=args.max_body_size,
+            header_timeout=args.header_timeout,
+            body_timeout=args.body_timeout,
+            idle_timeout=args.idle_timeout)
+        register_server_metrics(server)
+
+        if args.workers > 0:
+            # Plugins and handlers imported before forking are shared by
+            # the workers. Reloads check every handler before restarting.
+            load_authenticators(authn_manager)
+            DISPATCHER.load_handlers()
+
+            # Each worker needs its own bus connection and log writer
+            # thread so both are set up after forking.
+            def worker_init():
+                configure_logging(args.debug, args.log_queue_size)
+                connect_bus(bus_kwargs, args.health_check_interval)
+
+            # New workers are forked with the reimported handlers
+            run_workers(
+                server, args.workers, worker_init, DISPATCHER.hot_reload)
+        else:
+            # Import the plugins while connecting to the bus. Failing
+            # plugins still stop the server before it serves a request.
+            with ThreadPoolExecutor(1) as executor:
+                loaded = executor.submit(load_authenticators, authn_manager)
+                connect_bus(bus_kwargs, args.health_check_interval)
+                loaded.result()
 
-        # Serve until we are killed off
-        server.serve_forever()
+            # Serve until we are killed off. SIGTERM drains requests and
+            # SIGHUP reloads the handlers.
+            signal.signal(signal.SIGTERM, server.stop)
+            signal.signal(signal.SIGHUP, reload_handlers)
+            server.serve_forever()
     except KeyboardInterrupt:  # pragma: no cover
         server.logger.fatal('Received KeyboardInterrupt. Exiting ...')
-    except ImportError:
-        parser.error('Could not import "{}" for authentication'.format(
-            args.authentication_plugins))
+    except (ImportError, ConfigurationError) as error:
+        parser.error('Could not load authentication plugins: {}'.format(
+            error))
     except Exception as error:  # pragma: no cover
         from traceback import print_exc
         print_exc()
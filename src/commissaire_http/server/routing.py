@@ -14,24 +14,119 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 Routing items.
+
+Routes name their controllers by path so handler modules are only
+imported once a request is routed to them.
 """
 
+from commissaire_http.constants import ROUTING_RX_PARAMS
 from commissaire_http.dispatcher import Dispatcher
 from commissaire_http.router import Router
 
-from commissaire_http.handlers import (
-    clusters, hosts, networks, container_managers)
-from commissaire_http.handlers.clusters import operations
+_NAME = {'name': ROUTING_RX_PARAMS['name']}
+_ADDRESS = {'address': ROUTING_RX_PARAMS['address']}
+_NAME_HOST = {
+    'name': ROUTING_RX_PARAMS['name'],
+    'host': ROUTING_RX_PARAMS['host'],
+}
+
+#: Routes as (path, controller, method, requirements, extra keywords)
+ROUTES = (
+    # Hosts
+    (R'/api/v0/hosts/', 'hosts.list_hosts', 'GET', None, {}),
+    (R'/api/v0/host/{address}/', 'hosts.get_host', 'GET', _ADDRESS, {}),
+    (R'/api/v0/host/{address}/', 'hosts.create_host', 'PUT', _ADDRESS, {}),
+    (R'/api/v0/host/', 'hosts.create_host', 'PUT', None, {}),
+    (R'/api/v0/host/{address}/creds', 'hosts.get_hostcreds', 'GET',
+     _ADDRESS, {}),
+    (R'/api/v0/host/{address}/', 'hosts.delete_host', 'DELETE',
+     _ADDRESS, {}),
+    (R'/api/v0/host/{address}/status/', 'hosts.get_host_status', 'GET',
+     None, {}),
+    # Clusters
+    (R'/api/v0/clusters/', 'clusters.list_clusters', 'GET', None, {}),
+    (R'/api/v0/cluster/{name}/', 'clusters.get_cluster', 'GET', _NAME, {}),
+    (R'/api/v0/cluster/{name}/', 'clusters.create_cluster', 'PUT',
+     _NAME, {}),
+    (R'/api/v0/cluster/{name}/', 'clusters.delete_cluster', 'DELETE',
+     _NAME, {}),
+    (R'/api/v0/cluster/{name}/hosts/', 'clusters.list_cluster_members',
+     'GET', _NAME, {}),
+    (R'/api/v0/cluster/{name}/hosts/', 'clusters.update_cluster_members',
+     'PUT', _NAME, {'action': 'add'}),
+    (R'/api/v0/cluster/{name}/hosts/{host}/',
+     'clusters.check_cluster_member', 'GET', _NAME_HOST, {}),
+    (R'/api/v0/cluster/{name}/hosts/{host}/',
+     'clusters.add_cluster_member', 'PUT', _NAME_HOST, {'action': 'add'}),
+    (R'/api/v0/cluster/{name}/hosts/{host}/',
+     'clusters.delete_cluster_member', 'DELETE', _NAME_HOST, {}),
+    # Networks
+    (R'/api/v0/networks/', 'networks.list_networks', 'GET', None, {}),
+    (R'/api/v0/network/{name}/', 'networks.get_network', 'GET', _NAME, {}),
+    (R'/api/v0/network/{name}/', 'networks.create_network', 'PUT',
+     _NAME, {}),
+    (R'/api/v0/network/{name}/', 'networks.delete_network', 'DELETE',
+     _NAME, {}),
+    # Cluster operations
+    (R'/api/v0/cluster/{name}/deploy',
+     'clusters.operations.get_cluster_deploy', 'GET', _NAME, {}),
+    (R'/api/v0/cluster/{name}/deploy',
+     'clusters.operations.create_cluster_deploy', 'PUT', _NAME, {}),
+    (R'/api/v0/cluster/{name}/upgrade',
+     'clusters.operations.get_cluster_upgrade', 'GET', _NAME, {}),
+    (R'/api/v0/cluster/{name}/upgrade',
+     'clusters.operations.create_cluster_upgrade', 'PUT', _NAME, {}),
+    (R'/api/v0/cluster/{name}/restart',
+     'clusters.operations.get_cluster_restart', 'GET', _NAME, {}),
+    (R'/api/v0/cluster/{name}/restart',
+     'clusters.operations.create_cluster_restart', 'PUT', _NAME, {}),
+    # Container managers
+    (R'/api/v0/containermanagers/',
+     'container_managers.list_container_managers', 'GET', None, {}),
+    (R'/api/v0/containermanager/{name}/',
+     'container_managers.get_container_manager', 'GET', _NAME, {}),
+    (R'/api/v0/containermanager/{name}/',
+     'container_managers.create_container_manager', 'PUT', _NAME, {}),
+    (R'/api/v0/containermanager/{name}/',
+     'container_managers.delete_container_manager', 'DELETE', _NAME, {}),
+    # Metrics
+    (R'/metrics', 'metrics.get_metrics', 'GET', None, {}),
+    # Probes
+    (R'/healthz', 'health.get_healthz', 'GET', None, {}),
+    (R'/readyz', 'health.get_readyz', 'GET', None, {}),
+)
+
+
+def connect_routes(router, routes=ROUTES):
+    """
+    Connects routes to a router and compiles them.
+
+    :param router: Router instance to attach to.
+    :type router: commissaire_http.router.Router
+    :param routes: The routes to connect.
+    :type routes: tuple
+    :returns: The router.
+    :rtype: commissaire_http.router.Router
+    """
+    for path, controller, method, requirements, extra in routes:
+        kwargs = dict(extra)
+        if requirements:
+            kwargs['requirements'] = requirements
+        router.connect(
+            path,
+            controller='commissaire_http.handlers.' + controller,
+            conditions={'method': method},
+            **kwargs)
+    # Compile the route regular expressions now instead of on the first
+    # request. With workers this happens once, before forking.
+    router.create_regs()
+    return router
+
 
 #: Global HTTP router for the dispatcher
-ROUTER = Router(optional_slash=True)
-hosts._register(ROUTER)
-clusters._register(ROUTER)
-networks._register(ROUTER)
-operations._register(ROUTER)
-container_managers._register(ROUTER)
-
-#: Global HTTP dispatcher for the server
+ROUTER = connect_routes(Router(optional_slash=True))
+
+#: Global HTTP dispatcher for the server. Handlers are loaded on first use.
 DISPATCHER = Dispatcher(
     ROUTER,
     handler_packages=[
@@ -40,4 +135,5 @@ DISPATCHER = Dispatcher(
         'commissaire_http.handlers.container_managers',
         'commissaire_http.handlers.clusters.operations',
         'commissaire_http.handlers.networks',
-        'commissaire_http.handlers.hosts'])
+        'commissaire_http.handlers.hosts'],
+    lazy=True)
@@ -0,0 +1,233 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Pre-forking worker supervisor.
+"""
+
+import logging
+import os
+import signal
+import time
+
+
+class WorkerSupervisor:
+    """
+    Forks worker processes which share the listening socket of a
+    CommissaireHttpServer and restarts them when they die.
+
+    SIGTERM and SIGINT stop the workers gracefully. SIGHUP starts a new
+    set of workers and then stops the old ones, so the socket is always
+    being served. Workers ignore SIGHUP so it can be sent to the whole
+    process group. A before_restart callable runs in the supervisor first,
+    and the workers are kept if it raises. An after_exit callable is
+    given the pid of each worker which exited.
+    """
+
+    #: Class level logger
+    logger = logging.getLogger('WorkerSupervisor')
+
+    #: Seconds a worker must stay up before a crash is not considered a flap
+    min_uptime = 1.0
+
+    #: Seconds to wait before restarting a flapping worker
+    restart_delay = 1.0
+
+    #: Seconds between checks for exited workers and requested restarts
+    poll_interval = 0.2
+
+    def __init__(self, server, workers, worker_init=None,
+                 before_restart=None, after_exit=None):
+        """
+        Initializes a new WorkerSupervisor instance.
+
+        :param server: The server whose socket is shared with workers.
+        :type server: commissaire_http.CommissaireHttpServer
+        :param workers: The number of worker processes to keep running.
+        :type workers: int
+        :param worker_init: Callable executed in each worker after forking.
+        :type worker_init: callable or None
+        :param before_restart: Callable executed before restarting workers.
+        :type before_restart: callable or None
+        :param after_exit: Callable given the pid of each exited worker.
+        :type after_exit: callable or None
+        """
+        self.server = server
+        self.workers = workers
+        self.worker_init = worker_init
+        self.before_restart = before_restart
+        self.after_exit = after_exit
+        #: Mapping of worker pid to the time it was started
+        self.children = {}
+        #: Workers which have been told to stop and are not restarted
+        self.retiring = set()
+        self._running = False
+        self._restart_requested = False
+
+    def spawn(self):
+        """
+        Forks a single worker process.
+
+        :returns: The pid of the new worker.
+        :rtype: int
+        """
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            # Workers drain their in-flight requests on SIGTERM
+            signal.signal(signal.SIGTERM, self.server.stop)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            exit_code = 0
+            try:
+                if self.worker_init is not None:
+                    self.worker_init()
+                self.server.serve_forever()
+            except Exception as error:
+                self.logger.error(
+                    'Worker %s exited with %s: %s',
+                    os.getpid(), type(error), error)
+                exit_code = 1
+            finally:
+                # Write buffered log records before exiting
+                logging.shutdown()
+                os._exit(exit_code)
+        self.children[pid] = time.time()
+        self.logger.info('Started worker %s', pid)
+        return pid
+
+    def stop(self, signum=None, frame=None):
+        """
+        Stops the supervisor and terminates all workers.
+
+        :param signum: The signal number, if called as a signal handler.
+        :type signum: int or None
+        :param frame: The current stack frame, if called as a signal handler.
+        :type frame: frame or None
+        """
+        self._running = False
+        for pid in list(self.children.keys()):
+            self.retire(pid)
+
+    def retire(self, pid):
+        """
+        Tells a worker to finish its in-flight requests and exit.
+
+        :param pid: The pid of the worker.
+        :type pid: int
+        """
+        self.children.pop(pid, None)
+        try:
+            os.kill(pid, signal.SIGTERM)
+            self.retiring.add(pid)
+        except OSError:
+            pass
+
+    def request_restart(self, signum=None, frame=None):
+        """
+        Asks the supervisor loop to restart the workers. Reloading and
+        forking are left to the loop as they are not safe in a signal
+        handler.
+
+        :param signum: The signal number, if called as a signal handler.
+        :type signum: int or None
+        :param frame: The current stack frame, if called as a signal handler.
+        :type frame: frame or None
+        """
+        self._restart_requested = True
+
+    def restart(self):
+        """
+        Replaces all workers. New workers are started before the old ones
+        are told to stop so connections keep being accepted.
+        """
+        if not self._running:
+            return
+        if self.before_restart is not None:
+            try:
+                self.before_restart()
+            except Exception as error:
+                self.logger.error(
+                    'Not restarting workers. %s failed with %s: %s',
+                    self.before_restart, type(error), error)
+                return
+        old_workers = list(self.children.keys())
+        self.logger.info('Restarting workers %s', old_workers)
+        for _ in range(self.workers):
+            self.spawn()
+        for pid in old_workers:
+            self.retire(pid)
+
+    def reap(self):
+        """
+        Collects a worker which exited, if any, and restarts it if still
+        running.
+
+        :returns: The pid of the worker that exited or None.
+        :rtype: int or None
+        """
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            self.children.clear()
+            self.retiring.clear()
+            return None
+        if pid == 0:
+            return None
+
+        if self.after_exit is not None:
+            try:
+                self.after_exit(pid)
+            except Exception as error:
+                self.logger.error(
+                    '%s failed for worker %s with %s: %s',
+                    self.after_exit, pid, type(error), error)
+
+        if pid in self.retiring:
+            self.retiring.discard(pid)
+            self.logger.info('Worker %s exited with status %s', pid, status)
+            return pid
+
+        started = self.children.pop(pid, None)
+        if started is None:
+            return pid
+
+        self.logger.warn(
+            'Worker %s exited with status %s', pid, status)
+        if self._running:
+            if time.time() - started < self.min_uptime:
+                self.logger.warn(
+                    'Worker %s exited quickly. Delaying restart %ss',
+                    pid, self.restart_delay)
+                time.sleep(self.restart_delay)
+            self.spawn()
+        return pid
+
+    def run(self):
+        """
+        Starts the workers and supervises them until stopped.
+        """
+        self._running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.request_restart)
+        for _ in range(self.workers):
+            self.spawn()
+
+        while self.children or self.retiring:
+            if self._restart_requested:
+                self._restart_requested = False
+                self.restart()
+            if self.reap() is None:
+                time.sleep(self.poll_interval)
+        self.logger.info('All workers have exited.')
@@ -0,0 +1,380 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Per request timing of the stages of the request pipeline.
+
+Timing is disabled unless enabled is set. Stages are timed by wrappers
+which are only installed once it is enabled, so requests pay nothing for
+it otherwise.
+"""
+
+import asyncio
+import collections.abc
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from functools import partial
+
+from commissaire_http.util.wsgi import (
+    ClosingIterator, FakeStartResponse, call_app_async, close_when_done,
+    get_async_app)
+
+#: If stages are timed. Set before building the request pipeline.
+enabled = False
+
+#: Key of the Timings instance in the WSGI environment
+ENVIRON_KEY = 'commissaire.timings'
+
+_local = threading.local()
+
+
+class Timings:
+    """
+    Seconds spent in each stage of a request.
+    """
+
+    __slots__ = ('stages',)
+
+    def __init__(self):
+        """
+        Initializes a new, empty, Timings instance.
+        """
+        self.stages = OrderedDict()
+
+    def add(self, name, seconds):
+        """
+        Adds time spent in a stage. Stages entered more than once, such as
+        bus requests, are summed.
+
+        :param name: The name of the stage.
+        :type name: str
+        :param seconds: Seconds spent in the stage.
+        :type seconds: float
+        """
+        self.stages[name] = self.stages.get(name, 0) + seconds
+
+    def header(self):
+        """
+        Formats the stages as a Server-Timing header value.
+
+        :returns: The header value.
+        :rtype: str
+        """
+        return ', '.join(
+            '{};dur={:.3f}'.format(name, seconds * 1000)
+            for name, seconds in self.stages.items())
+
+    def log_fields(self):
+        """
+        Formats the stages as key=value fields for logging.
+
+        :returns: The fields in milliseconds.
+        :rtype: str
+        """
+        return ' '.join(
+            '{}_ms={:.3f}'.format(name, seconds * 1000)
+            for name, seconds in self.stages.items())
+
+
+def get_timings(environ):
+    """
+    Returns the Timings of a request, creating them if needed.
+
+    :param environ: WSGI environment instance.
+    :type environ: dict
+    :returns: The Timings of the request.
+    :rtype: Timings
+    """
+    timings = environ.get(ENVIRON_KEY)
+    if timings is None:
+        timings = environ[ENVIRON_KEY] = Timings()
+    return timings
+
+
+def record(name, seconds):
+    """
+    Adds time spent in a stage to the Timings of the request the calling
+    thread is handling, if any.
+
+    :param name: The name of the stage.
+    :type name: str
+    :param seconds: Seconds spent in the stage.
+    :type seconds: float
+    """
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+class _TimedBody(ClosingIterator):
+    """
+    Iterates a streamed response body adding the time spent producing it
+    to a stage.
+    """
+
+    def __init__(self, iterable, timings, name):
+        """
+        Initializes a new _TimedBody instance.
+
+        :param iterable: The response body.
+        :type iterable: iterable
+        :param timings: The Timings of the request.
+        :type timings: Timings
+        :param name: The name of the stage.
+        :type name: str
+        """
+        super(_TimedBody, self).__init__(iterable)
+        self._timings = timings
+        self._name = name
+
+    def __next__(self):
+        """
+        Returns the next part of the response body, timing it.
+        """
+        previous = getattr(_local, 'timings', None)
+        _local.timings = self._timings
+        started = time.monotonic()
+        try:
+            return next(self._iterator)
+        finally:
+            self._timings.add(self._name, time.monotonic() - started)
+            _local.timings = previous
+
+
+class TimedStage:
+    """
+    Wraps a callable taking the WSGI environment and start_response and
+    records the time spent in it as a stage. Calls to record made while it
+    runs in the same thread are added to the request's Timings. Time spent
+    producing a streamed body is added to the stage as it is sent.
+    """
+
+    def __init__(self, name, app):
+        """
+        Initializes a new TimedStage instance.
+
+        :param name: The name of the stage.
+        :type name: str
+        :param app: The callable to time.
+        :type app: callable
+        """
+        self.name = name
+        self._app = app
+
+    def __call__(self, environ, start_response):
+        """
+        Calls the wrapped callable, timing it.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :returns: What the wrapped callable returns.
+        :rtype: mixed
+        """
+        timings = get_timings(environ)
+        previous = getattr(_local, 'timings', None)
+        _local.timings = timings
+        started = time.monotonic()
+        try:
+            return self._time_body(
+                self._app(environ, start_response), timings)
+        finally:
+            timings.add(self.name, time.monotonic() - started)
+            _local.timings = previous
+
+    async def call_async(self, environ, start_response):
+        """
+        Coroutine version of __call__ used by the asyncio server. Callables
+        without a coroutine version run in the executor, where calls to
+        record are still added to the request's Timings.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :returns: What the wrapped callable returns.
+        :rtype: mixed
+        """
+        if get_async_app(self._app) is None:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(
+                None, self, environ, start_response)
+        started = time.monotonic()
+        timings = get_timings(environ)
+        try:
+            return self._time_body(await call_app_async(
+                self._app, environ, start_response), timings)
+        finally:
+            timings.add(self.name, time.monotonic() - started)
+
+    def _time_body(self, result, timings):
+        """
+        Wraps a streamed body so the time spent producing it is recorded.
+
+        :param result: What the wrapped callable returned.
+        :type result: mixed
+        :param timings: The Timings of the request.
+        :type timings: Timings
+        :returns: The result, wrapped if it is a streamed body.
+        :rtype: mixed
+        """
+        if isinstance(result, collections.abc.Iterator):
+            return _TimedBody(result, timings, self.name)
+        return result
+
+
+def time_routing(router):
+    """
+    Times route matching of a router as the route stage.
+
+    :param router: The router to time.
+    :type router: commissaire_http.router.Router
+    :returns: The router.
+    :rtype: commissaire_http.router.Router
+    """
+    routematch = router.routematch
+
+    def timed_routematch(url=None, environ=None):
+        started = time.monotonic()
+        try:
+            return routematch(url=url, environ=environ)
+        finally:
+            # RoutesMiddleware passes the environment through the router
+            if environ is None:
+                environ = router.environ
+            get_timings(environ).add('route', time.monotonic() - started)
+
+    router.routematch = timed_routematch
+    return router
+
+
+class ServerTimingMiddleware:
+    """
+    WSGI middleware adding the timed stages of a request to its response
+    as a Server-Timing header and logging them as an access log line.
+
+    The header is sent before the body, so for streamed bodies it only
+    holds the time until the body started. The log line is written once
+    the body is closed and includes the time spent sending it.
+    """
+
+    #: Logger for ServerTimingMiddleware
+    logger = logging.getLogger('ServerTiming')
+
+    def __init__(self, app):
+        """
+        Initializes a new ServerTimingMiddleware instance.
+
+        :param app: A WSGI app to wrap.
+        :type app: instance
+        """
+        self._app = app
+
+    def __call__(self, environ, start_response):
+        """
+        Calls the app and adds its timings to the response.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :returns: Response back to requestor.
+        :rtype: list
+        """
+        started = time.monotonic()
+        app_start_response = FakeStartResponse()
+        result = self._app(environ, app_start_response)
+        return self._respond(
+            environ, start_response, app_start_response, result, started)
+
+    async def call_async(self, environ, start_response):
+        """
+        Coroutine version of __call__ used by the asyncio server.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :returns: Response back to requestor.
+        :rtype: list
+        """
+        started = time.monotonic()
+        app_start_response = FakeStartResponse()
+        result = await call_app_async(
+            self._app, environ, app_start_response)
+        return self._respond(
+            environ, start_response, app_start_response, result, started)
+
+    def _respond(self, environ, start_response, app_start_response,
+                 result, started):
+        """
+        Starts the response of the app with the Server-Timing header.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param start_response: WSGI start response callable.
+        :type start_response: callable
+        :param app_start_response: What the app passed to start_response.
+        :type app_start_response: FakeStartResponse
+        :param result: The body returned by the app.
+        :type result: iterable
+        :param started: time.monotonic() when the app was called.
+        :type started: float
+        :returns: Response back to requestor.
+        :rtype: list or generator
+        """
+        timings = get_timings(environ)
+        self._add_total(timings, started)
+        headers = list(app_start_response.headers)
+        headers.append(('Server-Timing', timings.header()))
+        start_response(app_start_response.code, headers)
+        return close_when_done(result, partial(
+            self._log, environ, app_start_response.code, timings, started))
+
+    def _add_total(self, timings, started):
+        """
+        Sets the total stage to the time spent on the request so far.
+
+        :param timings: The Timings of the request.
+        :type timings: Timings
+        :param started: time.monotonic() when the app was called.
+        :type started: float
+        """
+        # Routing happens before the app is called
+        timings.stages['total'] = (
+            time.monotonic() - started + timings.stages.get('route', 0))
+
+    def _log(self, environ, status, timings, started):
+        """
+        Logs the timed stages of a finished request.
+
+        :param environ: WSGI environment instance.
+        :type environ: dict
+        :param status: The HTTP status line, such as '200 OK'.
+        :type status: str
+        :param timings: The Timings of the request.
+        :type timings: Timings
+        :param started: time.monotonic() when the app was called.
+        :type started: float
+        """
+        self._add_total(timings, started)
+        self.logger.info(
+            'method=%s path=%s status=%s user=%s %s',
+            environ['REQUEST_METHOD'], environ['PATH_INFO'],
+            status[:3], environ.get('REMOTE_USER', '-'),
+            timings.log_fields())
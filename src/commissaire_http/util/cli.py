@@ -16,6 +16,8 @@
 Utilities for CLI.
 """
 
+import argparse
+
 
 def parse_to_struct(inp):
     """
@@ -36,3 +38,26 @@ def parse_to_struct(inp):
             # Ignore values with out equals
             pass
     return new
+
+
+def parse_rate_limit(inp):
+    """
+    Parses a command line rate limit into the structure used in
+    configuration files.
+
+    :param inp: The input string from argparse, such as user:rate=5.
+    :type inp: str
+    :returns: The parsed rate limit.
+    :rtype: dict
+    :raises: argparse.ArgumentTypeError
+    """
+    try:
+        ((key, kwargs),) = parse_to_struct(inp).items()
+    except ValueError:
+        kwargs = {}
+    if not kwargs.get('rate'):
+        raise argparse.ArgumentTypeError(
+            'rate limits look like KEY:rate=N[,burst=N,path=PATH,'
+            'method=METHOD], not "{}"'.format(inp))
+    kwargs['key'] = key
+    return kwargs
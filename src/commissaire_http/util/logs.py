@@ -0,0 +1,184 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Logging utilities.
+"""
+
+import copy
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+
+#: Format of all log records
+LOG_FORMAT = '%(asctime)s %(name)s %(levelname)s %(message)s'
+
+
+class BufferedLogHandler(logging.handlers.QueueHandler):
+    """
+    Queues log records for a single writer thread which passes them to
+    the real handlers in batches.
+
+    Logging threads never wait for the handlers and do not format records,
+    that is left to the writer thread. Records logged while the queue is
+    full are dropped and counted.
+    """
+
+    #: Formats tracebacks before their frames go away
+    exception_formatter = logging.Formatter()
+
+    def __init__(self, handlers, queue_size=10000, batch_size=256):
+        """
+        Initializes a new BufferedLogHandler instance and starts its writer
+        thread.
+
+        :param handlers: The handlers records are written with.
+        :type handlers: list
+        :param queue_size: Records which may wait for the writer thread.
+        :type queue_size: int
+        :param batch_size: Most records written at once.
+        :type batch_size: int
+        """
+        super(BufferedLogHandler, self).__init__(queue.Queue(queue_size))
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._writer = threading.Thread(
+            target=self._write_records, name='BufferedLogHandler',
+            daemon=True)
+        self._writer.start()
+
+    def prepare(self, record):
+        """
+        Prepares a record for the writer thread. Only the message is
+        merged with its arguments, which may change after logging, and the
+        traceback is rendered. The record is formatted by the writer.
+
+        :param record: The record to prepare.
+        :type record: logging.LogRecord
+        :returns: A copy of the record to queue.
+        :rtype: logging.LogRecord
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.exception_formatter.formatException(
+                    record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        """
+        Queues a record without waiting.
+
+        :param record: The record to queue.
+        :type record: logging.LogRecord
+        """
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """
+        Writes the queued records and stops the writer thread.
+        """
+        if self._writer.is_alive():
+            # Waits for room, so no queued record is lost
+            self.queue.put(None)
+            self._writer.join()
+        super(BufferedLogHandler, self).close()
+
+    def _write_records(self):
+        """
+        Writes queued records in batches until None is queued.
+        """
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [record for record in batch if record is not None]
+            for handler in self.handlers:
+                self.write_batch(handler, batch)
+
+    def write_batch(self, handler, batch):
+        """
+        Writes a batch of records with a handler. Stream handlers get a
+        single write and flush per batch.
+
+        :param handler: The handler to write with.
+        :type handler: logging.Handler
+        :param batch: The records to write.
+        :type batch: list
+        """
+        batch = [record for record in batch
+                 if record.levelno >= handler.level and handler.filter(record)]
+        if not batch:
+            return
+        if not isinstance(handler, logging.StreamHandler):
+            for record in batch:
+                handler.handle(record)
+            return
+
+        lines = []
+        for record in batch:
+            try:
+                lines.append(handler.format(record) + handler.terminator)
+            except Exception:
+                handler.handleError(record)
+        handler.acquire()
+        try:
+            handler.stream.write(''.join(lines))
+            handler.flush()
+        except Exception:
+            handler.handleError(batch[-1])
+        finally:
+            handler.release()
+
+
+def configure_logging(debug=False, queue_size=0):
+    """
+    Sends all log records to stdout, replacing handlers set up by an
+    earlier call.
+
+    :param debug: If debug records are logged.
+    :type debug: bool
+    :param queue_size: Records which may wait for the writer thread of a
+                       BufferedLogHandler. 0 writes records synchronously.
+    :type queue_size: int
+    :returns: The handler added to the root logger.
+    :rtype: logging.Handler
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    if queue_size > 0:
+        handler = BufferedLogHandler([handler], queue_size=queue_size)
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG if debug else logging.INFO)
+    return handler
@@ -0,0 +1,102 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Listening socket utilities.
+"""
+
+import os
+import socket
+import stat
+
+#: First file descriptor passed by systemd socket activation
+SD_LISTEN_FDS_START = 3
+
+
+def create_unix_socket(path, backlog):
+    """
+    Creates a listening Unix domain socket. A socket file left behind by
+    an earlier server is replaced.
+
+    :param path: Path of the socket file.
+    :type path: str
+    :param backlog: Size of the listen backlog.
+    :type backlog: int
+    :returns: The listening socket.
+    :rtype: socket.socket
+    """
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(path)
+        sock.listen(backlog)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def socket_from_fd(fd):
+    """
+    Creates a socket object for an inherited file descriptor, detecting
+    its address family.
+
+    :param fd: The file descriptor. It is owned by the socket afterwards.
+    :type fd: int
+    :returns: The socket.
+    :rtype: socket.socket
+    """
+    # The address is returned in the format of the real address family
+    probe = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        address = probe.getsockname()
+    finally:
+        probe.close()
+    if not isinstance(address, tuple):
+        family = socket.AF_UNIX
+    elif len(address) == 4:
+        family = socket.AF_INET6
+    else:
+        family = socket.AF_INET
+    return socket.socket(family, socket.SOCK_STREAM, fileno=fd)
+
+
+def get_systemd_sockets(environ=None):
+    """
+    Returns the listening sockets passed by systemd socket activation.
+    The activation variables are removed so child processes do not
+    consider the sockets theirs.
+
+    :param environ: The environment to read. Defaults to os.environ.
+    :type environ: dict or None
+    :returns: The passed sockets, in order.
+    :rtype: list
+    """
+    if environ is None:
+        environ = os.environ
+    try:
+        if int(environ.get('LISTEN_PID', 0)) != os.getpid():
+            return []
+        count = int(environ.get('LISTEN_FDS', 0))
+    except ValueError:
+        return []
+    finally:
+        for name in ('LISTEN_PID', 'LISTEN_FDS', 'LISTEN_FDNAMES'):
+            environ.pop(name, None)
+    return [socket_from_fd(fd) for fd in range(
+        SD_LISTEN_FDS_START, SD_LISTEN_FDS_START + count)]
@@ -0,0 +1,171 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+TLS utilities.
+"""
+
+import logging
+import ssl
+import threading
+import time
+
+
+def create_ssl_context(pem_file, clientverify_file=None,
+                       ciphers=None, ecdh_curve=None):
+    """
+    Creates a server side SSLContext allowing TLSv1.2 and newer.
+
+    Session resumption through the session cache and session tickets is
+    left enabled.
+
+    :param pem_file: Full path to the PEM file for TLS.
+    :type pem_file: str
+    :param clientverify_file: Full path to CA to verify client certs.
+    :type clientverify_file: str or None
+    :param ciphers: OpenSSL cipher list string.
+    :type ciphers: str or None
+    :param ecdh_curve: Name of the curve used for ECDH key exchange.
+    :type ecdh_curve: str or None
+    :returns: The new context.
+    :rtype: ssl.SSLContext
+    """
+    context = ssl.SSLContext(
+        getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23))
+    if hasattr(context, 'minimum_version'):
+        context.minimum_version = ssl.TLSVersion.TLSv1_2
+    else:  # pragma: no cover
+        context.options |= (
+            ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3 |
+            ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1)
+    context.load_cert_chain(pem_file)
+    if ciphers:
+        context.set_ciphers(ciphers)
+    if ecdh_curve:
+        context.set_ecdh_curve(ecdh_curve)
+    if clientverify_file:
+        context.verify_mode = ssl.CERT_REQUIRED
+        context.load_verify_locations(clientverify_file)
+    return context
+
+
+def get_common_name(cert):
+    """
+    Returns the first commonName in the subject of a certificate.
+
+    :param cert: A certificate as returned by SSLSocket.getpeercert().
+    :type cert: dict or None
+    :returns: The commonName or None.
+    :rtype: str or None
+    """
+    if cert:
+        for obj in cert.get('subject', ()):
+            for key, value in obj:
+                if key == 'commonName':
+                    return value
+    return None
+
+
+class TLSContext:
+    """
+    Holds the SSLContext shared by all connections and counts handshakes.
+
+    OpenSSL generates new session ticket keys for every SSLContext, so
+    ticket keys are rotated by replacing the context once it is older
+    than ticket_key_lifetime seconds.
+    """
+
+    #: Class level logger
+    logger = logging.getLogger('TLSContext')
+
+    def __init__(self, pem_file, clientverify_file=None, ciphers=None,
+                 ecdh_curve=None, ticket_key_lifetime=0):
+        """
+        Initializes a new TLSContext instance.
+
+        :param pem_file: Full path to the PEM file for TLS.
+        :type pem_file: str
+        :param clientverify_file: Full path to CA to verify client certs.
+        :type clientverify_file: str or None
+        :param ciphers: OpenSSL cipher list string.
+        :type ciphers: str or None
+        :param ecdh_curve: Name of the curve used for ECDH key exchange.
+        :type ecdh_curve: str or None
+        :param ticket_key_lifetime: Seconds before session ticket keys are
+                                    rotated. 0 never rotates them.
+        :type ticket_key_lifetime: float
+        """
+        self._context_kwargs = {
+            'pem_file': pem_file,
+            'clientverify_file': clientverify_file,
+            'ciphers': ciphers,
+            'ecdh_curve': ecdh_curve,
+        }
+        self.ticket_key_lifetime = ticket_key_lifetime
+        self._lock = threading.Lock()
+        self.handshakes = 0
+        self.resumed = 0
+        self._context = create_ssl_context(**self._context_kwargs)
+        self._created = time.monotonic()
+
+    @property
+    def context(self):
+        """
+        Get the current SSLContext, rotating it if it has expired.
+        """
+        if (self.ticket_key_lifetime > 0 and
+                time.monotonic() - self._created > self.ticket_key_lifetime):
+            with self._lock:
+                if (time.monotonic() - self._created >
+                        self.ticket_key_lifetime):
+                    self._context = create_ssl_context(
+                        **self._context_kwargs)
+                    self._created = time.monotonic()
+                    self.logger.info('Rotated session ticket keys.')
+        return self._context
+
+    def wrap_socket(self, sock):
+        """
+        Wraps an accepted socket. The handshake is left to the thread
+        handling the connection.
+
+        :param sock: The accepted socket.
+        :type sock: socket.socket
+        :returns: The wrapped socket.
+        :rtype: ssl.SSLSocket
+        """
+        return self.context.wrap_socket(
+            sock, server_side=True, do_handshake_on_connect=False)
+
+    def record_handshake(self, ssl_object):
+        """
+        Counts a finished handshake. Resumed sessions are only counted
+        on Python 3.6 and newer, which tell if a session was reused.
+
+        :param ssl_object: The socket or object the handshake was done on.
+        :type ssl_object: ssl.SSLSocket or ssl.SSLObject
+        """
+        with self._lock:
+            self.handshakes += 1
+            if getattr(ssl_object, 'session_reused', False):
+                self.resumed += 1
+
+    def stats(self):
+        """
+        Returns the handshake counters.
+
+        :returns: Number of handshakes and of resumed sessions.
+        :rtype: dict
+        """
+        return {'handshakes': self.handshakes, 'resumed': self.resumed}
@@ -16,6 +16,9 @@
 WSGI utilities.
 """
 
+import asyncio
+import collections.abc
+
 
 class FakeStartResponse:
     """
@@ -57,3 +60,111 @@ class FakeStartResponse:
         """
         return 'call_count={}, code={}, headers={}'.format(
             self.call_count, self.code, self.headers)
+
+
+def get_async_app(app):
+    """
+    Finds the coroutine version of a WSGI application.
+
+    Applications with a call_async coroutine method, and bound methods
+    whose instance has a matching <method>_async coroutine method, have
+    one.
+
+    :param app: The WSGI application.
+    :type app: callable
+    :returns: The coroutine function or None.
+    :rtype: callable or None
+    """
+    native = getattr(app, 'call_async', None)
+    if native is None:
+        owner = getattr(app, '__self__', None)
+        if owner is not None:
+            native = getattr(owner, app.__name__ + '_async', None)
+    return native
+
+
+async def call_app_async(app, environ, start_response):
+    """
+    Calls a WSGI application from a coroutine.
+
+    Applications with a coroutine version, see get_async_app, are awaited
+    directly. Anything else is run in the event loop's executor.
+
+    :param app: The WSGI application to call.
+    :type app: callable
+    :param environ: WSGI environment dictionary.
+    :type environ: dict
+    :param start_response: WSGI start_response callable.
+    :type start_response: callable
+    :returns: The body of the HTTP response.
+    :rtype: Mixed
+    """
+    native = get_async_app(app)
+    if native is not None:
+        return await native(environ, start_response)
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, app, environ, start_response)
+
+
+class ClosingIterator:
+    """
+    Iterates a response body and calls callbacks once it is closed.
+    """
+
+    def __init__(self, iterable, *callbacks):
+        """
+        Initializes a new ClosingIterator instance.
+
+        :param iterable: The response body.
+        :type iterable: iterable
+        :param callbacks: Callables taking no arguments.
+        :type callbacks: tuple
+        """
+        self._iterator = iter(iterable)
+        self._close = getattr(iterable, 'close', None)
+        self._callbacks = list(callbacks)
+
+    def __iter__(self):
+        """
+        Returns the instance as it is its own iterator.
+        """
+        return self
+
+    def __next__(self):
+        """
+        Returns the next part of the response body.
+        """
+        return next(self._iterator)
+
+    def close(self):
+        """
+        Closes the wrapped body and then calls the callbacks, only once.
+        """
+        close, self._close = self._close, None
+        callbacks, self._callbacks = self._callbacks, []
+        try:
+            if close is not None:
+                close()
+        finally:
+            for callback in callbacks:
+                callback()
+
+
+def close_when_done(result, callback):
+    """
+    Calls callback once a response body is done with. Bodies which are
+    iterators are produced while the server sends them, so for those it
+    is called when the server closes the body. For others it is called
+    right away.
+
+    :param result: The response body.
+    :type result: iterable
+    :param callback: Callable taking no arguments.
+    :type callback: callable
+    :returns: The response body to pass on.
+    :rtype: iterable
+    """
+    if isinstance(result, collections.abc.Iterator):
+        return ClosingIterator(result, callback)
+    callback()
+    return result
@@ -14,7 +14,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import socket
 
+from http.client import HTTPConnection
 from unittest import TestCase, mock
 
 from commissaire_http.handlers import create_jsonrpc_response
@@ -68,6 +70,29 @@ def expected_error(message_id, code):
     expected['error'] = mock.ANY
     return expected
 
+
+class UnixHTTPConnection(HTTPConnection):
+    """
+    HTTPConnection to a server listening on a Unix domain socket.
+    """
+
+    def __init__(self, path):
+        """
+        Initializes a new UnixHTTPConnection instance.
+
+        :param path: Path of the socket file.
+        :type path: str
+        """
+        super(UnixHTTPConnection, self).__init__('localhost')
+        self.path = path
+
+    def connect(self):
+        """
+        Connects to the socket file.
+        """
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
 class TestCase(TestCase):
     """
     Parent class for all unittests.
@@ -0,0 +1,155 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Test for commissaire_http.admission
+"""
+
+import asyncio
+
+from . import TestCase, mock
+
+from commissaire_http.admission import (
+    AdmissionController, AIMDLimit, FixedLimit)
+
+
+def dummy_wsgi_app(environ, start_response):
+    start_response('200 OK', [('content-type', 'text/plain')])
+    return [bytes('hi', 'utf8')]
+
+
+class TestAdmissionController(TestCase):
+    """
+    Test for the AdmissionController class.
+    """
+
+    def setUp(self):
+        """
+        Creates a new instance to test with per test.
+        """
+        self.admission = AdmissionController(dummy_wsgi_app, FixedLimit(1))
+
+    def test_admits_under_limit(self):
+        """
+        Verify requests under the limit are passed to the app.
+        """
+        start_response = mock.MagicMock()
+        self.assertEquals(
+            [b'hi'], self.admission({}, start_response))
+        start_response.assert_called_once_with('200 OK', mock.ANY)
+        self.assertEquals(0, self.admission.in_flight)
+
+    def test_rejects_over_limit(self):
+        """
+        Verify requests over the limit are answered with a 503.
+        """
+        self.admission.in_flight = 1
+        start_response = mock.MagicMock()
+        self.assertEquals(
+            [b'Service Unavailable'], self.admission({}, start_response))
+        start_response.assert_called_once_with(
+            '503 Service Unavailable', [
+                ('content-type', 'text/html'), ('Retry-After', '1')])
+        self.assertEquals(1, self.admission.rejected)
+        self.assertEquals(1, self.admission.in_flight)
+
+    def test_exempt_paths(self):
+        """
+        Verify exempt paths pass while the limit is reached and are not
+        counted.
+        """
+        admission = AdmissionController(
+            dummy_wsgi_app, FixedLimit(1), exempt_paths=['/healthz'])
+        admission.in_flight = 1
+        start_response = mock.MagicMock()
+        self.assertEquals(
+            [b'hi'], admission({'PATH_INFO': '/healthz'}, start_response))
+        start_response.assert_called_once_with('200 OK', mock.ANY)
+        self.assertEquals(1, admission.in_flight)
+        self.assertEquals(0, admission.rejected)
+
+    def test_in_flight_until_streamed_body_closed(self):
+        """
+        Verify a streamed body is in-flight until it is closed.
+        """
+        admission = AdmissionController(
+            lambda environ, start_response: iter([b'hi']), FixedLimit(1))
+        body = admission({}, mock.MagicMock())
+        self.assertEquals(1, admission.in_flight)
+        self.assertEquals([b'hi'], list(body))
+        body.close()
+        self.assertEquals(0, admission.in_flight)
+
+    def test_in_flight_released_on_error(self):
+        """
+        Verify a failing app does not leak in-flight requests.
+        """
+        admission = AdmissionController(
+            mock.MagicMock(side_effect=Exception), FixedLimit(1))
+        self.assertRaises(Exception, admission, {}, mock.MagicMock())
+        self.assertEquals(0, admission.in_flight)
+
+    def test_call_async(self):
+        """
+        Verify call_async honors the limit.
+        """
+        loop = asyncio.new_event_loop()
+        start_response = mock.MagicMock()
+        self.assertEquals([b'hi'], loop.run_until_complete(
+            self.admission.call_async({}, start_response)))
+        self.admission.in_flight = 1
+        self.assertEquals([b'Service Unavailable'], loop.run_until_complete(
+            self.admission.call_async({}, start_response)))
+        loop.close()
+
+
+class TestAIMDLimit(TestCase):
+    """
+    Test for the AIMDLimit class.
+    """
+
+    def test_grows_while_used(self):
+        """
+        Verify the limit grows while latency is normal and it is in use.
+        """
+        limit = AIMDLimit(limit=10, max_limit=11)
+        for _ in range(100):
+            limit.update(0.01, 10)
+        self.assertEquals(11, limit.limit)
+
+    def test_does_not_grow_while_unused(self):
+        """
+        Verify the limit does not grow when few requests are in-flight.
+        """
+        limit = AIMDLimit(limit=10)
+        for _ in range(100):
+            limit.update(0.01, 1)
+        self.assertEquals(10, limit.limit)
+
+    def test_shrinks_on_latency(self):
+        """
+        Verify the limit shrinks when latency rises but not below min_limit.
+        """
+        limit = AIMDLimit(limit=10, min_limit=5)
+        limit.update(0.01, 1)
+        limit.update(1.0, 10)
+        self.assertEquals(9, limit.limit)
+        # Only once per round trip
+        limit.update(1.0, 10)
+        self.assertEquals(9, limit.limit)
+        limit._last_backoff = 0
+        for _ in range(10):
+            limit._last_backoff = 0
+            limit.update(1.0, 10)
+        self.assertEquals(5, limit.limit)
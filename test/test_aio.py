@@ -0,0 +1,243 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Test for commissaire_http.aio
+"""
+
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from http.client import HTTPConnection
+
+from . import TestCase, UnixHTTPConnection, mock
+
+from commissaire_http.aio import AsyncCommissaireHttpServer
+from commissaire_http.authentication import (
+    AuthenticationManager, Authenticator)
+from commissaire_http.dispatcher import Dispatcher
+from commissaire_http.router import Router
+from commissaire_http.util.sockets import create_unix_socket
+
+
+#: Threads stream_wsgi_app produced its body in
+STREAM_THREADS = []
+
+
+def stream_body():
+    for part in ('h', 'i'):
+        STREAM_THREADS.append(threading.current_thread())
+        yield bytes(part, 'utf8')
+
+
+def stream_wsgi_app(environ, start_response):
+    start_response('200 OK', [('content-type', 'text/plain')])
+    return stream_body()
+
+
+class TestAsyncCommissaireHttpServer(TestCase):
+    """
+    Test for the AsyncCommissaireHttpServer class.
+    """
+
+    def setUp(self):
+        """
+        Starts a server on an ephemeral port for each test.
+        """
+        router = Router()
+        router.connect(
+            '/hello/',
+            controller='commissaire_http.handlers.hello_world',
+            conditions={'method': 'GET'})
+        router.connect(
+            '/hello_async/',
+            controller='commissaire_http.handlers.hello_world_async',
+            conditions={'method': 'GET'})
+        router.connect(
+            '/world/',
+            controller='commissaire_http.handlers.create_world',
+            conditions={'method': 'PUT'})
+        router.connect(
+            '/stream/',
+            controller=stream_wsgi_app,
+            conditions={'method': 'GET'})
+        self.dispatcher = Dispatcher(
+            router, handler_packages=['commissaire_http.handlers'])
+        self.dispatcher._bus = mock.MagicMock('Bus')
+        self.server = AsyncCommissaireHttpServer(
+            '127.0.0.1', 0, self.dispatcher, max_threads=2,
+            max_body_size=1024, header_timeout=0.3, body_timeout=0.3)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.conn = HTTPConnection('127.0.0.1', self.server.port)
+
+    def tearDown(self):
+        """
+        Stops the server after each test.
+        """
+        self.conn.close()
+        self.server.shutdown()
+        self.thread.join()
+        self.server.socket.close()
+
+    def request(self, method, path, body=None):
+        """
+        Sends a request on the shared connection.
+        """
+        self.conn.request(method, path, body=body)
+        response = self.conn.getresponse()
+        return response, response.read()
+
+    def test_sync_and_async_handlers(self):
+        """
+        Verify sync and coroutine handlers answer on one connection.
+        """
+        response, body = self.request('GET', '/hello/?name=bob')
+        self.assertEquals(200, response.status)
+        self.assertEquals({'Hello': 'bob'}, json.loads(body.decode()))
+        response, body = self.request('GET', '/hello_async/')
+        self.assertEquals(200, response.status)
+        self.assertEquals({'Hello': 'there'}, json.loads(body.decode()))
+
+    def test_request_body(self):
+        """
+        Verify request bodies are passed to handlers.
+        """
+        response, body = self.request('PUT', '/world/', b'{"name": "world"}')
+        self.assertEquals(201, response.status)
+        self.assertEquals('world', json.loads(body.decode())['name'])
+
+    def test_chunked(self):
+        """
+        Verify streamed bodies are chunked on a kept connection.
+        """
+        response, body = self.request('GET', '/stream/')
+        self.assertEquals('chunked', response.getheader('Transfer-Encoding'))
+        self.assertEquals(b'hi', body)
+        # The body is produced off of the event loop
+        self.assertNotIn(self.thread, STREAM_THREADS)
+        response, body = self.request('GET', '/hello/')
+        self.assertEquals(200, response.status)
+
+    def test_stop(self):
+        """
+        Verify stop closes persistent connections and ends serve_forever.
+        """
+        self.request('GET', '/hello/')
+        self.server.stop()
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+
+    def test_not_found(self):
+        """
+        Verify unrouted paths return 404.
+        """
+        response, body = self.request('GET', '/idonotexist/')
+        self.assertEquals(404, response.status)
+
+    def test_authentication(self):
+        """
+        Verify an AuthenticationManager wrapping dispatch is honored.
+        """
+        self.dispatcher.dispatch = AuthenticationManager(
+            self.dispatcher.dispatch, authenticators=[Authenticator(None)])
+        response, body = self.request('GET', '/hello/')
+        self.assertEquals(403, response.status)
+
+    def test_listen_socket(self):
+        """
+        Verify requests are served on a passed Unix domain socket.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'commissaire.sock')
+            server = AsyncCommissaireHttpServer(
+                None, None, self.dispatcher,
+                listen_socket=create_unix_socket(path, 5))
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            conn = UnixHTTPConnection(path)
+            conn.request('GET', '/hello/?name=bob')
+            response = conn.getresponse()
+            self.assertEquals(200, response.status)
+            self.assertEquals(
+                {'Hello': 'bob'}, json.loads(response.read().decode()))
+            conn.close()
+            server.stop()
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+            server.socket.close()
+
+    def raw_request(self, data):
+        """
+        Sends raw data on a new connection and reads until it is closed.
+        """
+        client = socket.create_connection(
+            ('127.0.0.1', self.server.port), timeout=5)
+        try:
+            client.sendall(data)
+            response = b''
+            while True:
+                chunk = client.recv(4096)
+                if not chunk:
+                    return response
+                response += chunk
+        finally:
+            client.close()
+
+    def test_body_too_large(self):
+        """
+        Verify bodies over the limit are answered with a 413 before the
+        body is sent.
+        """
+        response = self.raw_request(
+            b'PUT /world/ HTTP/1.1\r\nContent-Length: 1000000\r\n\r\n')
+        self.assertTrue(response.startswith(b'HTTP/1.1 413 '))
+
+    def test_transfer_encoding(self):
+        """
+        Verify bodies sent with a Transfer-Encoding are refused and the
+        connection closed.
+        """
+        body = b'5\r\nhello\r\n0\r\n\r\n'
+        response = self.raw_request(
+            b'PUT /world/ HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n' +
+            body)
+        self.assertTrue(response.startswith(b'HTTP/1.1 501 '))
+        self.assertEquals(1, response.count(b'HTTP/1.1'))
+        response = self.raw_request(
+            b'PUT /world/ HTTP/1.1\r\nContent-Length: 3\r\n'
+            b'Transfer-Encoding: chunked\r\n\r\n' + body)
+        self.assertTrue(response.startswith(b'HTTP/1.1 400 '))
+        self.assertEquals(1, response.count(b'HTTP/1.1'))
+
+    def test_header_deadline(self):
+        """
+        Verify connections which do not send the headers in time are closed.
+        """
+        started = time.monotonic()
+        self.assertEquals(b'', self.raw_request(b'GET /hello/ HTTP/1.1\r\n'))
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_body_deadline(self):
+        """
+        Verify connections which do not send the body in time are closed.
+        """
+        started = time.monotonic()
+        self.assertEquals(b'', self.raw_request(
+            b'PUT /world/ HTTP/1.1\r\nContent-Length: 10\r\n\r\n{'))
+        self.assertLess(time.monotonic() - started, 2)
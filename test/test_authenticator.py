@@ -80,3 +80,39 @@ class Test_Authenticator(TestCase):
             DUMMY_WSGI_BODY,
             self.authenticator(create_environ(), start_response))
         start_response.assert_called_once_with(*START_RESPONSE_ARGS)
+
+
+class Test_LazyAuthenticator(TestCase):
+    """
+    Tests for the LazyAuthenticator class.
+    """
+
+    def test_lazy_authenticator_imports_on_use(self):
+        """
+        Verify LazyAuthenticator creates the plugin when first used.
+        """
+        plugin_class = mock.MagicMock()
+        plugin_class().authenticate.return_value = True
+        plugin_class.reset_mock()
+        with mock.patch('commissaire_http.authentication.import_plugin',
+                        return_value=plugin_class) as _import_plugin:
+            authenticator = authentication.LazyAuthenticator(
+                'httpbasicauth', filepath='conf/users.json')
+            self.assertFalse(_import_plugin.called)
+            for _ in range(2):
+                self.assertTrue(authenticator.authenticate(
+                    create_environ(), FakeStartResponse()))
+            _import_plugin.assert_called_once_with(
+                'httpbasicauth', 'commissaire_http.authentication',
+                authentication.Authenticator)
+            plugin_class.assert_called_once_with(
+                None, filepath='conf/users.json')
+
+    def test_lazy_authenticator_with_missing_plugin(self):
+        """
+        Verify LazyAuthenticator raises when the plugin doesn't exist.
+        """
+        self.assertRaises(
+            authentication.ConfigurationError,
+            authentication.LazyAuthenticator,
+            'commissaire_http.doesnotexist')
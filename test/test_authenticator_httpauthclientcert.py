@@ -73,3 +73,18 @@ class TestHTTPClientCertAuth(TestCase):
         # With no cn any is valid
         auth = httpauthclientcert.HTTPClientCertAuth(None)
         self.assertTrue(auth.authenticate(environ, mock.MagicMock()))
+
+    def test_common_name_from_server(self):
+        """
+        Verify authenticate uses SSL_CLIENT_S_DN_CN when the server sets it
+        """
+        environ = create_environ()
+        environ['SSL_CLIENT_VERIFY'] = self.cert
+        environ['SSL_CLIENT_S_DN_CN'] = 'system:master-proxy'
+        for cn in (None, 'system:master-proxy'):
+            auth = httpauthclientcert.HTTPClientCertAuth(None, cn=cn)
+            self.assertTrue(auth.authenticate(environ, mock.MagicMock()))
+            self.assertEquals('system:master-proxy', environ['REMOTE_USER'])
+
+        auth = httpauthclientcert.HTTPClientCertAuth(None, cn='other-cn')
+        self.assertFalse(auth.authenticate(environ, mock.MagicMock()))
@@ -16,10 +16,19 @@
 Test for commissaire_http.bus
 """
 
+import asyncio
+import time
+
 from unittest import mock
 
+from commissaire.bus import RemoteProcedureCallError
+
 from . import TestCase
-from commissaire_http.bus import Bus
+from commissaire_http.bus import Bus, REQUEST_DURATION, REQUEST_ERRORS
+from commissaire_http.circuitbreaker import (
+    CLOSED, OPEN, CircuitBreakers, CircuitOpenError)
+from commissaire_http.deadline import (
+    BoundDeadline, DeadlineExceededError, get_deadline)
 
 EXCHANGE = 'exchange'
 CONNECTION_URL = 'redis://127.0.0.1:6379//'
@@ -70,3 +79,148 @@ class TestBus(TestCase):
         # We should have a new producer
         _producer.assert_called_once_with(
             self.bus_instance._channel, self.bus_instance._exchange)
+
+    def test_request_records_duration(self):
+        """
+        Verify Bus.request records the duration by routing key.
+        """
+        key = ('test.duration',)
+        with mock.patch('commissaire.bus.BusMixin.request') as _request:
+            _request.return_value = {'result': 'ok'}
+            self.assertEquals(
+                {'result': 'ok'},
+                self.bus_instance.request('test.duration', 'get'))
+            _request.assert_called_once_with('test.duration', 'get')
+        self.assertEquals(1, sum(REQUEST_DURATION.values()[key][:-1]))
+        self.assertNotIn(key, REQUEST_ERRORS.values())
+
+    def test_request_records_errors(self):
+        """
+        Verify Bus.request counts requests which raise.
+        """
+        key = ('test.errors',)
+        with mock.patch('commissaire.bus.BusMixin.request') as _request:
+            _request.side_effect = Exception
+            self.assertRaises(
+                Exception, self.bus_instance.request, 'test.errors')
+        self.assertEquals(1, REQUEST_ERRORS.values()[key])
+        self.assertEquals(1, sum(REQUEST_DURATION.values()[key][:-1]))
+
+    @mock.patch('commissaire_http.bus.BREAKERS', new_callable=CircuitBreakers)
+    def test_request_circuit_breaker(self, _breakers):
+        """
+        Verify Bus.request opens the breaker of a routing key which can not
+        be reached and then fails without sending.
+        """
+        _breakers.configure(min_requests=2)
+        with mock.patch('commissaire.bus.BusMixin.request') as _request:
+            # Errors of the service are answers
+            _request.side_effect = RemoteProcedureCallError
+            for _ in range(2):
+                self.assertRaises(
+                    RemoteProcedureCallError,
+                    self.bus_instance.request, 'test.breaker')
+            self.assertEquals(CLOSED, _breakers.get('test.breaker').state)
+
+            _request.side_effect = TimeoutError
+            for _ in range(2):
+                self.assertRaises(
+                    TimeoutError, self.bus_instance.request, 'test.breaker')
+            self.assertEquals(OPEN, _breakers.get('test.breaker').state)
+            self.assertEquals(4, _request.call_count)
+
+            self.assertRaises(
+                CircuitOpenError, self.bus_instance.request, 'test.breaker')
+            self.assertEquals(4, _request.call_count)
+            # Other routing keys are still sent
+            _request.side_effect = None
+            self.bus_instance.request('test.other')
+            self.assertEquals(5, _request.call_count)
+
+    def test_request_deadline(self):
+        """
+        Verify Bus.request is not sent once the deadline passed and drops
+        responses arriving after it.
+        """
+        with mock.patch('commissaire.bus.BusMixin.request') as _request:
+            with BoundDeadline(time.monotonic() - 1):
+                self.assertRaises(
+                    DeadlineExceededError,
+                    self.bus_instance.request, 'test.deadline')
+            self.assertFalse(_request.called)
+
+            with BoundDeadline(time.monotonic() + 0.05):
+                _request.side_effect = lambda *a, **k: time.sleep(0.1)
+                self.assertRaises(
+                    DeadlineExceededError,
+                    self.bus_instance.request, 'test.deadline')
+            self.assertEquals(1, _request.call_count)
+
+            with BoundDeadline(time.monotonic() + 10):
+                _request.side_effect = None
+                _request.return_value = {'result': 'ok'}
+                self.assertEquals(
+                    {'result': 'ok'},
+                    self.bus_instance.request('test.deadline'))
+
+    def test_request_async_deadline(self):
+        """
+        Verify Bus.request_async carries the deadline into the executor.
+        """
+        expected = time.monotonic() + 100
+
+        async def handler():
+            with BoundDeadline(expected):
+                return await self.bus_instance.request_async('test.async')
+
+        with mock.patch('commissaire.bus.BusMixin.request') as _request:
+            _request.side_effect = lambda *a, **k: get_deadline()
+            loop = asyncio.new_event_loop()
+            try:
+                asyncio.set_event_loop(loop)
+                self.assertEquals(expected, loop.run_until_complete(handler()))
+            finally:
+                asyncio.set_event_loop(None)
+                loop.close()
+
+    def test_connected(self):
+        """
+        Verify Bus.connected reports the connection state.
+        """
+        self.assertFalse(self.bus_instance.connected)
+        self.bus_instance.connection = mock.MagicMock(connected=True)
+        self.assertTrue(self.bus_instance.connected)
+
+    @mock.patch('commissaire_http.bus.Exchange')
+    def test_ping(self, _exchange):
+        """
+        Verify Bus.ping checks the exchange on its own connection.
+        """
+        self.bus_instance.connection = mock.MagicMock()
+        self.bus_instance.ping(1)
+        self.bus_instance.connection.clone.assert_called_once_with(
+            connect_timeout=1)
+        ping_connection = self.bus_instance.connection.clone()
+        ping_connection.ensure_connection.assert_called_once_with(
+            max_retries=1)
+        _exchange().bind.assert_called_once_with(
+            ping_connection.default_channel)
+        _exchange().bind().declare.assert_called_once_with(passive=True)
+
+    @mock.patch('commissaire_http.bus.Exchange')
+    def test_ping_failure(self, _exchange):
+        """
+        Verify Bus.ping raises and reconnects on the next ping on failure.
+        """
+        self.bus_instance.connection = mock.MagicMock()
+        ping_connection = self.bus_instance.connection.clone()
+        ping_connection.ensure_connection.side_effect = ConnectionError
+        self.assertRaises(ConnectionError, self.bus_instance.ping)
+        ping_connection.release.assert_called_once_with()
+        self.assertIsNone(self.bus_instance._ping_connection)
+
+    def test_ping_not_connected(self):
+        """
+        Verify Bus.ping raises before connecting.
+        """
+        self.assertRaises(ConnectionError, self.bus_instance.ping)
@@ -0,0 +1,166 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Test for commissaire_http.circuitbreaker
+"""
+
+from . import TestCase, mock
+
+from commissaire_http.circuitbreaker import (
+    CLOSED, HALF_OPEN, OPEN, OPENED, REJECTED, CircuitBreaker,
+    CircuitBreakers, CircuitOpenError)
+
+
+class TestCircuitBreaker(TestCase):
+    """
+    Test for the CircuitBreaker class.
+    """
+
+    def setUp(self):
+        """
+        Creates a new instance to test with per test.
+        """
+        self.now = 1000.0
+        patcher = mock.patch('time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(
+            'test.breaker', failure_ratio=0.5, min_requests=4, window=10.0,
+            reset_timeout=5.0)
+
+    def send(self, failed):
+        """
+        Records a request which was let through.
+        """
+        self.breaker.before()
+        self.breaker.record(failed)
+
+    def test_opens_on_failure_ratio(self):
+        """
+        Verify the breaker opens once the failure ratio is reached with
+        enough requests.
+        """
+        opened = OPENED.values().get(('test.breaker',), 0)
+        for failed in (True, True, True):
+            self.send(failed)
+        # Not enough requests yet
+        self.assertEquals(CLOSED, self.breaker.state)
+        self.send(False)
+        self.assertEquals(CLOSED, self.breaker.state)
+        self.send(True)
+        self.assertEquals(OPEN, self.breaker.state)
+        self.assertEquals(
+            opened + 1, OPENED.values()[('test.breaker',)])
+
+    def test_stays_closed_below_failure_ratio(self):
+        """
+        Verify the breaker stays closed while most requests succeed.
+        """
+        for _ in range(10):
+            self.send(False)
+            self.send(False)
+            self.send(True)
+        self.assertEquals(CLOSED, self.breaker.state)
+
+    def test_window(self):
+        """
+        Verify failures older than the window are forgotten.
+        """
+        for _ in range(3):
+            self.send(True)
+        self.now += 10.0
+        self.send(True)
+        self.assertEquals(CLOSED, self.breaker.state)
+
+    def test_open_fails_fast(self):
+        """
+        Verify an open breaker raises until the reset timeout passed.
+        """
+        rejected = REJECTED.values().get(('test.breaker',), 0)
+        for _ in range(4):
+            self.send(True)
+        self.now += 2.0
+        try:
+            self.breaker.before()
+            self.fail('CircuitOpenError was not raised')
+        except CircuitOpenError as error:
+            self.assertEquals('test.breaker', error.key)
+            self.assertEquals(3.0, error.retry_after)
+        self.assertEquals(
+            rejected + 1, REJECTED.values()[('test.breaker',)])
+
+    def test_half_open_probe_success(self):
+        """
+        Verify a single probe is let through after the reset timeout and
+        closes the breaker when it succeeds.
+        """
+        for _ in range(4):
+            self.send(True)
+        self.now += 5.0
+        self.breaker.before()
+        self.assertEquals(HALF_OPEN, self.breaker.state)
+        self.assertRaises(CircuitOpenError, self.breaker.before)
+        self.breaker.record(False)
+        self.assertEquals(CLOSED, self.breaker.state)
+        self.send(True)
+        self.assertEquals(CLOSED, self.breaker.state)
+
+    def test_half_open_probe_failure(self):
+        """
+        Verify a failed probe opens the breaker again.
+        """
+        for _ in range(4):
+            self.send(True)
+        self.now += 5.0
+        self.send(True)
+        self.assertEquals(OPEN, self.breaker.state)
+        self.assertRaises(CircuitOpenError, self.breaker.before)
+
+
+class TestCircuitBreakers(TestCase):
+    """
+    Test for the CircuitBreakers class.
+    """
+
+    def test_get(self):
+        """
+        Verify a breaker is created per routing key with the settings.
+        """
+        breakers = CircuitBreakers(min_requests=3)
+        breaker = breakers.get('storage.get')
+        self.assertIs(breaker, breakers.get('storage.get'))
+        self.assertIsNot(breaker, breakers.get('storage.list'))
+        self.assertEquals(3, breaker.min_requests)
+        self.assertTrue(breakers.enabled)
+
+    def test_configure(self):
+        """
+        Verify configure resets the breakers and can disable them.
+        """
+        breakers = CircuitBreakers()
+        breaker = breakers.get('storage.get')
+        breakers.configure(failure_ratio=0)
+        self.assertFalse(breakers.enabled)
+        self.assertIsNot(breaker, breakers.get('storage.get'))
+
+    def test_states(self):
+        """
+        Verify states maps routing keys to the value of their state.
+        """
+        breakers = CircuitBreakers()
+        breakers.get('storage.get')
+        breakers.get('storage.list').state = OPEN
+        self.assertEquals(
+            {('storage.get',): 0, ('storage.list',): 2}, breakers.states())
@@ -0,0 +1,236 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Test for commissaire_http.compression
+"""
+
+import asyncio
+import gzip
+import threading
+import zlib
+
+from . import TestCase, mock
+
+from commissaire_http.compression import (
+    CompressionMiddleware, parse_accept_encoding)
+
+BODY = b'{"hosts": [' + b'"192.168.1.1", ' * 200 + b'"192.168.1.2"]}'
+
+
+def json_wsgi_app(environ, start_response):
+    start_response('200 OK', [
+        ('content-type', 'application/json'),
+        ('content-length', str(len(BODY)))])
+    return [BODY]
+
+
+class TestParseAcceptEncoding(TestCase):
+    """
+    Test for the parse_accept_encoding function.
+    """
+
+    def test_parse_accept_encoding(self):
+        """
+        Verify parse_accept_encoding reads codings and qualities.
+        """
+        self.assertEquals(
+            {'gzip': 1.0, 'deflate': 0.5, 'br': 0.0},
+            parse_accept_encoding('GZIP, deflate;q=0.5, br;q=bad'))
+        self.assertEquals({}, parse_accept_encoding(''))
+
+
+class TestCompressionMiddleware(TestCase):
+    """
+    Test for the CompressionMiddleware class.
+    """
+
+    def setUp(self):
+        """
+        Creates a new instance to test with per test.
+        """
+        self.middleware = CompressionMiddleware(json_wsgi_app, min_size=100)
+
+    def call(self, accept_encoding=None, middleware=None):
+        """
+        Calls the middleware and returns the body and headers.
+        """
+        environ = {}
+        if accept_encoding is not None:
+            environ['HTTP_ACCEPT_ENCODING'] = accept_encoding
+        start_response = mock.MagicMock()
+        body = b''.join((middleware or self.middleware)(
+            environ, start_response))
+        code, headers = start_response.call_args[0]
+        self.assertEquals('200 OK', code)
+        return body, dict(headers)
+
+    def test_gzip(self):
+        """
+        Verify gzip is preferred and the headers describe the new body.
+        """
+        body, headers = self.call('deflate, gzip')
+        self.assertEquals(BODY, gzip.decompress(body))
+        self.assertEquals('gzip', headers['Content-Encoding'])
+        self.assertEquals(str(len(body)), headers['Content-Length'])
+        self.assertNotIn('content-length', headers)
+        self.assertEquals('Accept-Encoding', headers['Vary'])
+
+    def test_deflate(self):
+        """
+        Verify deflate is used when preferred by the client.
+        """
+        body, headers = self.call('gzip;q=0.5, deflate')
+        self.assertEquals(BODY, zlib.decompress(body))
+        self.assertEquals('deflate', headers['Content-Encoding'])
+
+    def test_not_accepted(self):
+        """
+        Verify bodies are not compressed unless the client accepts it.
+        """
+        for accept_encoding in (None, 'br', 'gzip;q=0'):
+            body, headers = self.call(accept_encoding)
+            self.assertEquals(BODY, body)
+            self.assertNotIn('Content-Encoding', headers)
+            self.assertEquals('Accept-Encoding', headers['Vary'])
+
+    def test_small_body(self):
+        """
+        Verify bodies under min_size are not compressed.
+        """
+        middleware = CompressionMiddleware(json_wsgi_app, min_size=10000)
+        body, headers = self.call('gzip', middleware)
+        self.assertEquals(BODY, body)
+        self.assertNotIn('Content-Encoding', headers)
+
+    def test_other_content_type(self):
+        """
+        Verify bodies of other content types are not compressed.
+        """
+        def app(environ, start_response):
+            start_response('200 OK', [('content-type', 'image/png')])
+            return [BODY]
+
+        body, headers = self.call('gzip', CompressionMiddleware(app, 100))
+        self.assertEquals(BODY, body)
+        self.assertNotIn('Vary', headers)
+
+    def test_cache(self):
+        """
+        Verify identical bodies are compressed once when caching.
+        """
+        middleware = CompressionMiddleware(
+            json_wsgi_app, min_size=100, cache_size=1)
+        with mock.patch.object(
+                middleware, '_compress', return_value=b'x') as _compress:
+            for _ in range(3):
+                body, headers = self.call('gzip', middleware)
+                self.assertEquals(b'x', body)
+            self.call('deflate', middleware)
+        self.assertEquals(2, _compress.call_count)
+        self.assertEquals(1, len(middleware._cache))
+
+    def test_stream(self):
+        """
+        Verify streamed bodies are compressed as they are iterated.
+        """
+        def app(environ, start_response):
+            start_response('200 OK', [('content-type', 'application/json')])
+            return (BODY[i:i + 100] for i in range(0, len(BODY), 100))
+
+        body, headers = self.call('gzip', CompressionMiddleware(app))
+        self.assertEquals(BODY, gzip.decompress(body))
+        self.assertEquals('gzip', headers['Content-Encoding'])
+        self.assertNotIn('Content-Length', headers)
+
+    def test_short_stream(self):
+        """
+        Verify short streamed bodies are read ahead, closed and then
+        cached, or sent as is below min_size.
+        """
+        closed = []
+
+        def stream():
+            try:
+                yield BODY[:100]
+                yield BODY[100:]
+            finally:
+                closed.append(True)
+
+        def app(environ, start_response):
+            start_response('200 OK', [('content-type', 'application/json')])
+            return stream()
+
+        middleware = CompressionMiddleware(app, min_size=100, cache_size=1)
+        for _ in range(2):
+            result = middleware(
+                {'HTTP_ACCEPT_ENCODING': 'gzip'}, mock.MagicMock())
+            self.assertIsInstance(result, list)
+            self.assertEquals(BODY, gzip.decompress(b''.join(result)))
+        self.assertEquals([True, True], closed)
+        self.assertEquals(1, len(middleware._cache))
+
+        body, headers = self.call(
+            'gzip', CompressionMiddleware(app, min_size=10000))
+        self.assertEquals(BODY, body)
+        self.assertNotIn('Content-Encoding', headers)
+
+    def test_stream_closed(self):
+        """
+        Verify streamed bodies are closed even if never iterated.
+        """
+        body = mock.MagicMock()
+        body.__iter__.return_value = iter([BODY])
+
+        def app(environ, start_response):
+            start_response('200 OK', [('content-type', 'application/json')])
+            return body
+
+        result = CompressionMiddleware(app)(
+            {'HTTP_ACCEPT_ENCODING': 'gzip'}, mock.MagicMock())
+        result.close()
+        body.close.assert_called_once_with()
+
+    def test_call_async(self):
+        """
+        Verify call_async compresses the response.
+        """
+        loop = asyncio.new_event_loop()
+        start_response = mock.MagicMock()
+        body = loop.run_until_complete(self.middleware.call_async(
+            {'HTTP_ACCEPT_ENCODING': 'gzip'}, start_response))
+        loop.close()
+        self.assertEquals(BODY, gzip.decompress(b''.join(body)))
+
+    def test_call_async_stream(self):
+        """
+        Verify call_async reads streamed bodies ahead off the event loop.
+        """
+        threads = []
+
+        def stream():
+            threads.append(threading.current_thread())
+            yield BODY
+
+        def app(environ, start_response):
+            start_response('200 OK', [('content-type', 'application/json')])
+            return stream()
+
+        loop = asyncio.new_event_loop()
+        body = loop.run_until_complete(CompressionMiddleware(
+            app, min_size=100, cache_size=1).call_async(
+                {'HTTP_ACCEPT_ENCODING': 'gzip'}, mock.MagicMock()))
+        loop.close()
+        self.assertEquals(BODY, gzip.decompress(b''.join(body)))
+        self.assertIsNot(threading.main_thread(), threads[0])
@@ -0,0 +1,188 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Test for commissaire_http.deadline
+"""
+
+import asyncio
+import threading
+import time
+
+from . import TestCase, mock
+
+from commissaire_http import deadline
+
+
+class TestBoundDeadline(TestCase):
+    """
+    Test for the BoundDeadline class and the functions using it.
+    """
+
+    def test_bound_deadline(self):
+        """
+        Verify BoundDeadline binds the thread and restores the previous
+        deadline.
+        """
+        self.assertIsNone(deadline.get_deadline())
+        self.assertIsNone(deadline.check())
+        with deadline.BoundDeadline(100.0):
+            self.assertEquals(100.0, deadline.get_deadline())
+            with deadline.BoundDeadline(50.0):
+                self.assertEquals(50.0, deadline.get_deadline())
+            self.assertEquals(100.0, deadline.get_deadline())
+        self.assertIsNone(deadline.get_deadline())
+
+    def test_bound_deadline_per_thread(self):
+        """
+        Verify other threads are not bound to the deadline.
+        """
+        seen = []
+        with deadline.BoundDeadline(100.0):
+            thread = threading.Thread(
+                target=lambda: seen.append(deadline.get_deadline()))
+            thread.start()
+            thread.join()
+            seen.append(deadline.call_bound(20.0, deadline.get_deadline))
+        self.assertEquals([None, 20.0], seen)
+
+    def test_bound_deadline_per_task(self):
+        """
+        Verify tasks running at once are bound to their own deadline.
+        """
+        async def handler(value):
+            with deadline.BoundDeadline(value):
+                await asyncio.sleep(0.01)
+                return deadline.get_deadline()
+
+        async def handlers():
+            return await asyncio.gather(handler(1.0), handler(2.0))
+
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEquals([1.0, 2.0], loop.run_until_complete(handlers()))
+        finally:
+            loop.close()
+        self.assertIsNone(deadline.get_deadline())
+
+    def test_check(self):
+        """
+        Verify check returns the time left and raises once it passed.
+        """
+        with deadline.BoundDeadline(time.monotonic() + 10):
+            self.assertTrue(9 < deadline.check() <= 10)
+        with deadline.BoundDeadline(time.monotonic() - 1):
+            self.assertRaises(
+                deadline.DeadlineExceededError, deadline.check, 'storage.get')
+
+
+class TestBoundIterator(TestCase):
+    """
+    Test for the BoundIterator class.
+    """
+
+    def test_bound_iterator(self):
+        """
+        Verify each part of the body is produced bound to the deadline.
+        """
+        def body():
+            yield deadline.get_deadline()
+            yield deadline.get_deadline()
+
+        iterator = deadline.BoundIterator(100.0, body())
+        self.assertEquals(100.0, next(iterator))
+        self.assertIsNone(deadline.get_deadline())
+        self.assertEquals([100.0], list(iterator))
+        iterator.close()
+
+
+class TestDeadlineMiddleware(TestCase):
+    """
+    Test for the DeadlineMiddleware class.
+    """
+
+    def setUp(self):
+        """
+        Creates a new instance to test with per test.
+        """
+        self.app = mock.MagicMock(return_value=[b'ok'])
+        self.middleware = deadline.DeadlineMiddleware(self.app, 10)
+        self.start_response = mock.MagicMock()
+
+    def call(self, header=None):
+        """
+        Calls the middleware returning the deadline set.
+        """
+        environ = {}
+        if header is not None:
+            environ[deadline.HEADER_KEY] = header
+        with mock.patch('time.monotonic', return_value=100.0):
+            self.assertEquals(
+                [b'ok'], self.middleware(environ, self.start_response))
+        return environ.get(deadline.ENVIRON_KEY)
+
+    def test_timeout(self):
+        """
+        Verify the configured timeout sets the deadline.
+        """
+        self.assertEquals(110.0, self.call())
+
+    def test_header(self):
+        """
+        Verify X-Request-Timeout only makes the deadline earlier.
+        """
+        self.assertEquals(102.5, self.call('2.5'))
+        self.assertEquals(110.0, self.call('30'))
+        self.middleware.timeout = 0
+        self.assertEquals(130.0, self.call('30'))
+        self.assertIsNone(self.call())
+
+    def test_invalid_header(self):
+        """
+        Verify invalid X-Request-Timeout headers are answered with a 400.
+        """
+        for header in ('soon', '0', '-1', 'nan', 'inf'):
+            environ = {deadline.HEADER_KEY: header}
+            self.middleware(environ, self.start_response)
+            self.start_response.assert_called_once_with(
+                '400 Bad Request', mock.ANY)
+            self.start_response.reset_mock()
+        self.assertFalse(self.app.called)
+
+    def test_exempt_paths(self):
+        """
+        Verify exempt paths get no deadline and invalid headers pass.
+        """
+        self.middleware.exempt_paths = frozenset(['/healthz'])
+        environ = {'PATH_INFO': '/healthz', deadline.HEADER_KEY: 'soon'}
+        self.assertEquals(
+            [b'ok'], self.middleware(environ, self.start_response))
+        self.assertNotIn(deadline.ENVIRON_KEY, environ)
+
+    def test_call_async(self):
+        """
+        Verify the coroutine version sets the deadline.
+        """
+        def app(environ, start_response):
+            return [b'ok']
+
+        self.middleware._app = app
+        environ = {deadline.HEADER_KEY: '1'}
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEquals([b'ok'], loop.run_until_complete(
+                self.middleware.call_async(environ, self.start_response)))
+        finally:
+            loop.close()
+        self.assertIn(deadline.ENVIRON_KEY, environ)
@@ -17,6 +17,10 @@ Test for commissaire_http.dispatcher
 """
 
 import json
+import os
+import shutil
+import sys
+import tempfile
 
 from io import BytesIO
 
@@ -25,7 +29,10 @@ from . import TestCase, mock
 import commissaire_http.handlers
 
 from commissaire_http.bus import Bus
-from commissaire_http.dispatcher import Dispatcher
+from commissaire_http.circuitbreaker import CircuitOpenError
+from commissaire_http.deadline import DeadlineExceededError
+from commissaire_http.dispatcher import (
+    Dispatcher, DispatcherError, IN_FLIGHT, REQUEST_DURATION, REQUESTS)
 from commissaire_http.router import Router
 
 
@@ -144,3 +151,350 @@ class TestDispatcher(TestCase):
         result = self.dispatcher_instance.dispatch(environ, start_response)
         start_response.assert_called_once_with('404 Not Found', mock.ANY)
         self.assertEquals('Not Found', result[0].decode())
+
+    def test_dispatcher_dispatch_records_metrics(self):
+        """
+        Verify the Dispatcher.dispatch records request metrics.
+        """
+        match = {'controller': commissaire_http.handlers.hello_world}
+        environ = {
+            'PATH_INFO': '/hello/',
+            'REQUEST_METHOD': 'GET',
+
+            # RoutesMiddleware inserts this.
+            'wsgiorg.routing_args': ((), match),
+            'routes.route': mock.MagicMock(minkeys=[])
+        }
+        name = 'commissaire_http.handlers.hello_world'
+        requests = REQUESTS.values().get((name, 'GET', '200'), 0)
+        observed = sum(REQUEST_DURATION.values().get((name,), [0])[:-1])
+        self.dispatcher_instance.dispatch(environ, mock.MagicMock())
+        self.assertEquals(
+            requests + 1, REQUESTS.values()[(name, 'GET', '200')])
+        self.assertEquals(
+            observed + 1, sum(REQUEST_DURATION.values()[(name,)][:-1]))
+        self.assertEquals(0, IN_FLIGHT.values()[()])
+
+    def test_dispatcher_dispatch_records_streamed_metrics(self):
+        """
+        Verify the Dispatcher.dispatch records streamed bodies once they
+        are closed.
+        """
+        def handler(environ, start_response):
+            start_response('200 OK', [])
+            return iter([b'[]'])
+
+        environ = {
+            'PATH_INFO': '/hello/',
+            'REQUEST_METHOD': 'GET',
+
+            # RoutesMiddleware inserts this.
+            'wsgiorg.routing_args': ((), {'controller': handler}),
+            'routes.route': mock.MagicMock(minkeys=[])
+        }
+        in_flight = IN_FLIGHT.values().get((), 0)
+        body = self.dispatcher_instance.dispatch(environ, mock.MagicMock())
+        self.assertEquals(in_flight + 1, IN_FLIGHT.values()[()])
+        self.assertEquals([b'[]'], list(body))
+        body.close()
+        self.assertEquals(in_flight, IN_FLIGHT.values()[()])
+
+    def test_dispatcher_dispatch_circuit_open(self):
+        """
+        Verify the Dispatcher.dispatch answers with a 503 when a circuit
+        breaker is open.
+        """
+        handler = mock.MagicMock(
+            side_effect=CircuitOpenError('storage.get', 2.5))
+        environ = {
+            'PATH_INFO': '/hello/',
+            'REQUEST_METHOD': 'GET',
+
+            # RoutesMiddleware inserts this.
+            'wsgiorg.routing_args': ((), {'controller': handler}),
+            'routes.route': mock.MagicMock(minkeys=[])
+        }
+        start_response = mock.MagicMock()
+        result = self.dispatcher_instance.dispatch(environ, start_response)
+        start_response.assert_called_once_with(
+            '503 Service Unavailable', [
+                ('content-type', 'text/html'), ('Retry-After', '3')])
+        self.assertEquals('Service Unavailable', result[0].decode())
+
+    def test_dispatcher_dispatch_deadline_exceeded(self):
+        """
+        Verify the Dispatcher.dispatch answers with a 504 when the deadline
+        of the request passed.
+        """
+        handler = mock.MagicMock(side_effect=DeadlineExceededError('late'))
+        environ = {
+            'PATH_INFO': '/hello/',
+            'REQUEST_METHOD': 'GET',
+
+            # RoutesMiddleware inserts this.
+            'wsgiorg.routing_args': ((), {'controller': handler}),
+            'routes.route': mock.MagicMock(minkeys=[])
+        }
+        start_response = mock.MagicMock()
+        result = self.dispatcher_instance.dispatch(environ, start_response)
+        start_response.assert_called_once_with(
+            '504 Gateway Timeout', mock.ANY)
+        self.assertEquals('Gateway Timeout', result[0].decode())
+
+    def test_dispatcher_lazy(self):
+        """
+        Verify a lazy Dispatcher loads handlers when first requested.
+        """
+        dispatcher = Dispatcher(
+            self.router_instance,
+            handler_packages=['commissaire_http.handlers'], lazy=True)
+        self.assertEquals({}, dispatcher._handler_map)
+        environ = {'wsgiorg.routing_args': ((), {})}
+        for path in ('commissaire_http.handlers.hello_world',
+                     'commissaire_http.handlers.ClassHandlerExample.hello'):
+            handler = dispatcher._get_handler(environ, path)
+            self.assertTrue(callable(handler))
+            self.assertIs(handler, dispatcher._handler_map[path])
+        self.assertIsNone(dispatcher._get_handler(
+            environ, 'commissaire_http.handlers.doesnotexist'))
+
+    def routed_environ(self, router, path, method='GET'):
+        """
+        Creates a WSGI environment routed like RoutesMiddleware does.
+        """
+        environ = {'PATH_INFO': path, 'REQUEST_METHOD': method}
+        match, route = router.routematch(environ=environ)
+        environ['wsgiorg.routing_args'] = ((), match)
+        environ['routes.route'] = route
+        return environ
+
+    def test_dispatcher_compile_routes(self):
+        """
+        Verify routes are compiled to the handlers they call.
+        """
+        environ = self.routed_environ(self.router_instance, '/hello/')
+        entry = self.dispatcher_instance._table[environ['routes.route']]
+        self.assertIs(
+            self.dispatcher_instance._handler_map[
+                'commissaire_http.handlers.hello_world'],
+            entry.handler)
+        with mock.patch.object(
+                self.dispatcher_instance, '_get_handler') as _get_handler:
+            start_response = mock.MagicMock()
+            result = self.dispatcher_instance.dispatch(
+                environ, start_response)
+            start_response.assert_called_once_with('200 OK', mock.ANY)
+            self.assertEquals('{"Hello": "there"}', result[0].decode())
+            self.assertFalse(_get_handler.called)
+
+    def test_dispatcher_compile_routes_unresolved(self):
+        """
+        Verify controllers which can not be resolved raise at start up.
+        """
+        self.router_instance.connect(
+            '/missing/',
+            controller='commissaire_http.handlers.doesnotexist',
+            conditions={'method': 'GET'})
+        self.router_instance.connect(
+            '/missing_module/',
+            controller='commissaire_http.doesnotexist.handler',
+            conditions={'method': 'GET'})
+        self.assertRaises(
+            DispatcherError, Dispatcher, self.router_instance,
+            handler_packages=['commissaire_http.handlers'])
+        try:
+            Dispatcher(self.router_instance, handler_packages=[], lazy=True)
+            self.fail('DispatcherError was not raised')
+        except DispatcherError as error:
+            self.assertIn('commissaire_http.doesnotexist.handler', str(error))
+            self.assertIn(
+                'commissaire_http.handlers.doesnotexist', str(error))
+
+    def test_dispatcher_compile_routes_lazy(self):
+        """
+        Verify a lazy Dispatcher keeps handlers in the table once loaded.
+        """
+        dispatcher = Dispatcher(
+            self.router_instance,
+            handler_packages=['commissaire_http.handlers'], lazy=True)
+        dispatcher._bus = mock.MagicMock('Bus')
+        environ = self.routed_environ(self.router_instance, '/hello/')
+        entry = dispatcher._table[environ['routes.route']]
+        self.assertIsNone(entry.handler)
+        dispatcher.dispatch(environ, mock.MagicMock())
+        self.assertIs(
+            dispatcher._handler_map['commissaire_http.handlers.hello_world'],
+            entry.handler)
+
+    def test_dispatcher_load_handlers(self):
+        """
+        Verify load_handlers loads the handlers of a lazy Dispatcher now.
+        """
+        dispatcher = Dispatcher(
+            self.router_instance,
+            handler_packages=['commissaire_http.handlers'], lazy=True)
+        dispatcher.load_handlers()
+        environ = self.routed_environ(self.router_instance, '/hello/')
+        self.assertIs(
+            dispatcher._handler_map['commissaire_http.handlers.hello_world'],
+            dispatcher._table[environ['routes.route']].handler)
+
+        self.router_instance.connect(
+            '/missing/',
+            controller='commissaire_http.handlers.doesnotexist',
+            conditions={'method': 'GET'})
+        # Handlers which pass the check but do not load
+        with mock.patch(
+                'commissaire_http.dispatcher._handler_exists',
+                return_value=True):
+            dispatcher.compile_routes()
+        self.assertRaises(DispatcherError, dispatcher.load_handlers)
+
+    def test_dispatcher_route_middleware(self):
+        """
+        Verify middleware given to a route wraps its handler in order.
+        """
+        calls = []
+
+        def middleware(name):
+            def wrap(app):
+                def wrapped(environ, start_response):
+                    calls.append(name)
+                    return app(environ, start_response)
+                return wrapped
+            return wrap
+
+        self.router_instance.connect(
+            '/wrapped/',
+            controller='commissaire_http.handlers.hello_world',
+            conditions={'method': 'GET'},
+            middleware=(middleware('outer'), middleware('inner')))
+        self.dispatcher_instance.compile_routes()
+        environ = self.routed_environ(self.router_instance, '/wrapped/')
+        start_response = mock.MagicMock()
+        result = self.dispatcher_instance.dispatch(environ, start_response)
+        start_response.assert_called_once_with('200 OK', mock.ANY)
+        self.assertEquals('{"Hello": "there"}', result[0].decode())
+        self.assertEquals(['outer', 'inner'], calls)
+        self.assertNotIn('middleware', environ['wsgiorg.routing_args'][1])
+
+
+class TestDispatcherHotReload(TestCase):
+    """
+    Tests for Dispatcher.hot_reload.
+    """
+
+    handler_source = (
+        'def hello(environ, start_response):\n'
+        '    start_response("200 OK", [])\n'
+        '    return [b"{}"]\n')
+
+    def setUp(self):
+        """
+        Creates a handler package to reload per test.
+        """
+        self.path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.path, 'reloadable'))
+        self.write('__init__.py', '')
+        self.write('hello.py', self.handler_source.format('one'))
+        sys.path.insert(0, self.path)
+        self.router = Router()
+        self.router.connect(
+            '/hello/', controller='reloadable.hello.hello',
+            conditions={'method': 'GET'})
+
+    def tearDown(self):
+        """
+        Removes the handler package.
+        """
+        sys.path.remove(self.path)
+        for name in ('reloadable', 'reloadable.hello'):
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.path)
+
+    def write(self, name, source):
+        """
+        Writes a module of the handler package.
+        """
+        with open(os.path.join(self.path, 'reloadable', name), 'w') as f:
+            f.write(source)
+
+    def dispatch(self, dispatcher):
+        """
+        Dispatches a request to /hello/ returning the body.
+        """
+        environ = {'PATH_INFO': '/hello/', 'REQUEST_METHOD': 'GET'}
+        match, route = self.router.routematch(environ=environ)
+        environ['wsgiorg.routing_args'] = ((), match)
+        environ['routes.route'] = route
+        return b''.join(dispatcher.dispatch(environ, mock.MagicMock()))
+
+    def test_hot_reload(self):
+        """
+        Verify hot_reload swaps in reimported handlers and leaves the
+        entries of requests already routed alone.
+        """
+        for lazy in (False, True):
+            sys.modules.pop('reloadable.hello', None)
+            self.write('hello.py', self.handler_source.format('one'))
+            dispatcher = Dispatcher(
+                self.router, handler_packages=['reloadable'], lazy=lazy)
+            dispatcher._bus = mock.MagicMock('Bus')
+            self.assertEquals(b'one', self.dispatch(dispatcher))
+            old_entry = list(dispatcher._table.values())[0]
+
+            self.write('hello.py', self.handler_source.format('three'))
+            dispatcher.hot_reload()
+            self.assertEquals(b'three', self.dispatch(dispatcher))
+            self.assertIsNot(old_entry, list(dispatcher._table.values())[0])
+            self.assertEquals(
+                [b'one'], old_entry.handler({}, mock.MagicMock()))
+
+    def test_lazy_with_misspelled_handler(self):
+        """
+        Verify a lazy dispatcher refuses a handler missing from a module
+        which exists, without importing the module.
+        """
+        self.router.connect(
+            '/typo/', controller='reloadable.hello.helo',
+            conditions={'method': 'GET'})
+        try:
+            Dispatcher(self.router, handler_packages=['reloadable'], lazy=True)
+            self.fail('DispatcherError was not raised')
+        except DispatcherError as error:
+            self.assertIn('reloadable.hello.helo', str(error))
+            self.assertNotIn('reloadable.hello.hello,', str(error))
+        self.assertNotIn('reloadable.hello', sys.modules)
+
+    def test_hot_reload_lazy_with_missing_handler(self):
+        """
+        Verify a lazy dispatcher refuses a reload which loses a handler it
+        had loaded.
+        """
+        dispatcher = Dispatcher(
+            self.router, handler_packages=['reloadable'], lazy=True)
+        dispatcher.load_handlers()
+        table = dispatcher._table
+        self.write('hello.py', 'def goodbye():\n    pass\n')
+        self.assertRaises(DispatcherError, dispatcher.hot_reload)
+        self.assertIs(table, dispatcher._table)
+
+    def test_hot_reload_with_error(self):
+        """
+        Verify hot_reload keeps the handlers in use when reimporting fails.
+        """
+        dispatcher = Dispatcher(self.router, handler_packages=['reloadable'])
+        dispatcher._bus = mock.MagicMock('Bus')
+        table = dispatcher._table
+        module = sys.modules['reloadable.hello']
+        self.write('hello.py', 'def hello(:\n')
+        self.assertRaises(SyntaxError, dispatcher.hot_reload)
+        self.assertIs(table, dispatcher._table)
+        self.assertIs(module, sys.modules['reloadable.hello'])
+        self.assertIs(module, sys.modules['reloadable'].hello)
+        self.assertEquals(b'one', self.dispatch(dispatcher))
+
+        self.write('hello.py', 'def goodbye():\n    pass\n')
+        self.assertRaises(DispatcherError, dispatcher.hot_reload)
+        self.assertIs(table, dispatcher._table)
+        self.assertEquals(b'one', self.dispatch(dispatcher))
@@ -16,8 +16,13 @@
 Test for commissaire_http.handlers module.
 """
 
+import json
+
 from . import TestCase
 from commissaire_http import handlers
+from commissaire_http.circuitbreaker import CircuitOpenError
+from commissaire_http.constants import JSONRPC_ERRORS
+from commissaire_http.deadline import DeadlineExceededError
 
 UID = '123'
 
@@ -72,3 +77,45 @@ class Test_create_jsonrpc_error(TestCase):
         self.assertEquals(1, result['error']['code'])
         self.assertEquals('test', result['error']['message'])
         self.assertEquals(str(Exception), result['error']['data']['exception'])
+
+    def test_create_jsonrpc_error_circuit_open(self):
+        """
+        Ensure create_jsonrpc_error reports open circuit breakers as
+        SERVICE_UNAVAILABLE.
+        """
+        result = handlers.create_jsonrpc_error(
+            {'id': UID}, CircuitOpenError('storage.get', 1.0), 1)
+        self.assertEquals(
+            JSONRPC_ERRORS['SERVICE_UNAVAILABLE'], result['error']['code'])
+
+    def test_create_jsonrpc_error_deadline_exceeded(self):
+        """
+        Ensure create_jsonrpc_error reports passed deadlines as
+        GATEWAY_TIMEOUT.
+        """
+        result = handlers.create_jsonrpc_error(
+            {'id': UID}, DeadlineExceededError('late'), 1)
+        self.assertEquals(
+            JSONRPC_ERRORS['GATEWAY_TIMEOUT'], result['error']['code'])
+
+
+class Test_stream_json_list(TestCase):
+    """
+    Test for the stream_json_list helper function.
+    """
+
+    def test_stream_json_list(self):
+        """
+        Verify stream_json_list encodes like json.dumps in chunks.
+        """
+        items = [{'name': str(i)} for i in range(10)]
+        chunks = list(handlers.stream_json_list(iter(items), chunk_size=40))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEquals(
+            bytes(json.dumps(items), 'utf8'), b''.join(chunks))
+
+    def test_stream_json_list_empty(self):
+        """
+        Verify stream_json_list encodes an empty list.
+        """
+        self.assertEquals([b'[]'], list(handlers.stream_json_list([])))
@@ -80,9 +80,11 @@ class Test_clusters(TestCase):
         """
         bus = mock.MagicMock()
         bus.storage.list.return_value = Clusters.new(clusters=[CLUSTER])
+        result = clusters.list_clusters.handler(NO_PARAMS_REQUEST, bus)
+        # Listed items are streamed
+        result['result'] = list(result['result'])
         self.assertEquals(
-            create_jsonrpc_response(ID, [CLUSTER.name]),
-            clusters.list_clusters.handler(NO_PARAMS_REQUEST, bus))
+            create_jsonrpc_response(ID, [CLUSTER.name]), result)
 
     def test_get_cluster(self):
         """
@@ -75,9 +75,11 @@ class Test_hosts(TestCase):
         """
         bus = mock.MagicMock()
         bus.storage.list.return_value = Hosts.new(hosts=[HOST])
+        result = hosts.list_hosts.handler(NO_PARAMS_REQUEST, bus)
+        # Listed items are streamed
+        result['result'] = list(result['result'])
         self.assertEquals(
-            create_jsonrpc_response(ID, [HOST.to_dict_safe()]),
-            hosts.list_hosts.handler(NO_PARAMS_REQUEST, bus))
+            create_jsonrpc_response(ID, [HOST.to_dict_safe()]), result)
 
     def test_get_host(self):
         """
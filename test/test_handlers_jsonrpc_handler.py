@@ -19,7 +19,8 @@ Test for commissaire_http.handlers.JSONRPC_Handler.
 from . import TestCase, mock
 
 from commissaire import constants as C
-from commissaire_http.handlers import JSONRPC_Handler
+from commissaire_http.deadline import ENVIRON_KEY, get_deadline
+from commissaire_http.handlers import AsyncJSONRPC_Handler, JSONRPC_Handler
 
 
 class Test_JSONRPC_Handler(TestCase):
@@ -99,6 +100,50 @@ class Test_JSONRPC_Handler(TestCase):
             body = self.jsonrpc_handler(self.environ, self.start_response)
             self.start_response.assert_called_once_with('409 Conflict', mock.ANY)
 
+    def test_error_service_unavailable(self):
+        """
+        Verify 'SERVICE_UNAVAILABLE' error code triggers a 503 status.
+        """
+        with mock.patch('commissaire_http.handlers.get_params') as get_params:
+            get_params.return_value = {}
+            self.json_error['error']['code'] = C.JSONRPC_ERRORS[
+                'SERVICE_UNAVAILABLE']
+            self.jsonrpc_handler.handler.return_value = self.json_error
+            body = self.jsonrpc_handler(self.environ, self.start_response)
+            self.start_response.assert_called_once_with(
+                '503 Service Unavailable', mock.ANY)
+
+    def test_error_gateway_timeout(self):
+        """
+        Verify 'GATEWAY_TIMEOUT' error code triggers a 504 status.
+        """
+        with mock.patch('commissaire_http.handlers.get_params') as get_params:
+            get_params.return_value = {}
+            self.json_error['error']['code'] = C.JSONRPC_ERRORS[
+                'GATEWAY_TIMEOUT']
+            self.jsonrpc_handler.handler.return_value = self.json_error
+            body = self.jsonrpc_handler(self.environ, self.start_response)
+            self.start_response.assert_called_once_with(
+                '504 Gateway Timeout', mock.ANY)
+
+    def test_handler_bound_to_deadline(self):
+        """
+        Verify the handler runs bound to the deadline of the request.
+        """
+        seen = []
+
+        def handler(message, bus):
+            seen.append(get_deadline())
+            return self.json_result
+
+        self.jsonrpc_handler.handler.side_effect = handler
+        self.environ[ENVIRON_KEY] = 100.0
+        with mock.patch('commissaire_http.handlers.get_params') as get_params:
+            get_params.return_value = {}
+            self.jsonrpc_handler(self.environ, self.start_response)
+        self.assertEquals([100.0], seen)
+        self.assertIsNone(get_deadline())
+
     def test_error_other(self):
         """
         Verify other error codes raise an Exception.
@@ -133,6 +178,19 @@ class Test_JSONRPC_Handler(TestCase):
             body = self.jsonrpc_handler(self.environ, self.start_response)
             self.start_response.assert_called_once_with('200 OK', mock.ANY)
 
+    def test_get_streamed_ok(self):
+        """
+        Verify an iterator result is streamed as a JSON list.
+        """
+        with mock.patch('commissaire_http.handlers.get_params') as get_params:
+            get_params.return_value = {}
+            self.json_result['result'] = iter([{'a': 1}, 'b'])
+            self.jsonrpc_handler.handler.return_value = self.json_result
+            body = self.jsonrpc_handler(self.environ, self.start_response)
+            self.start_response.assert_called_once_with(
+                '200 OK', [('content-type', 'application/json')])
+            self.assertEquals(b'[{"a": 1}, "b"]', b''.join(body))
+
     def test_post_ok(self):
         """
         Verify a successful POST request triggers a 200 status.
@@ -177,3 +235,29 @@ class Test_JSONRPC_Handler(TestCase):
             self.assertRaises(
                 Exception, self.jsonrpc_handler,
                 self.environ, self.start_response)
+
+
+class Test_AsyncJSONRPC_Handler(TestCase):
+    """
+    Test for the AsyncJSONRPC_Handler decorator class.
+    """
+
+    def test_sync_call(self):
+        """
+        Verify a coroutine handler can be called by the threaded server.
+        """
+        async def handler(message, bus):
+            return {'jsonrpc': '2.0', 'id': message['id'], 'result': {}}
+
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'commissaire.bus': mock.MagicMock(),
+
+            # RoutesMiddleware inserts this.
+            'wsgiorg.routing_args': ((), {}),
+            'routes.route': mock.MagicMock(minkeys=[])
+        }
+        start_response = mock.MagicMock()
+        body = AsyncJSONRPC_Handler(handler)(environ, start_response)
+        start_response.assert_called_once_with('200 OK', mock.ANY)
+        self.assertEquals([b'{}'], body)
@@ -55,9 +55,23 @@ class Test_networks(TestCase):
         """
         bus = mock.MagicMock()
         bus.storage.list.return_value = Networks.new(networks=[NETWORK])
+        result = networks.list_networks.handler(NO_PARAMS_REQUEST, bus)
+        # Listed items are streamed
+        result['result'] = list(result['result'])
+        self.assertEquals(create_jsonrpc_response(ID, ['test']), result)
+
+    def test_list_networks_error(self):
+        """
+        Verify list_networks answers errors reading the networks with a
+        JSON-RPC error.
+        """
+        network = mock.MagicMock()
+        type(network).name = mock.PropertyMock(side_effect=Exception)
+        bus = mock.MagicMock()
+        bus.storage.list.return_value = mock.MagicMock(networks=[network])
+        result = networks.list_networks.handler(NO_PARAMS_REQUEST, bus)
         self.assertEquals(
-            create_jsonrpc_response(ID, ['test']),
-            networks.list_networks.handler(NO_PARAMS_REQUEST, bus))
+            JSONRPC_ERRORS['INTERNAL_ERROR'], result['error']['code'])
 
     def test_get_network(self):
         """
@@ -0,0 +1,157 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Test for commissaire_http.health
+"""
+
+import json
+import time
+
+from . import TestCase, create_environ, mock
+
+from commissaire_http.handlers import health as health_handlers
+from commissaire_http.health import HealthCheck
+
+
+class TestHealthCheck(TestCase):
+    """
+    Test for the HealthCheck class.
+    """
+
+    def setUp(self):
+        """
+        Set up a HealthCheck of a mock bus for each test.
+        """
+        self.health = HealthCheck(interval=60)
+        self.health.bus = mock.MagicMock(connected=True)
+
+    def test_check(self):
+        """
+        Verify HealthCheck.check pings the bus and stores the result.
+        """
+        self.assertFalse(self.health.is_ready())
+        self.assertTrue(self.health.check())
+        self.health.bus.ping.assert_called_once_with(self.health.timeout)
+        self.assertTrue(self.health.is_ready())
+
+    def test_check_failure(self):
+        """
+        Verify HealthCheck.check stores the error of a failed ping.
+        """
+        self.health.bus.ping.side_effect = ConnectionError('refused')
+        self.assertFalse(self.health.check())
+        self.assertFalse(self.health.is_ready())
+        self.assertEquals('ConnectionError: refused', self.health.error)
+
+    def test_check_without_bus(self):
+        """
+        Verify HealthCheck.check fails without a bus.
+        """
+        self.health.bus = None
+        self.assertFalse(self.health.check())
+
+    def test_is_ready_stale(self):
+        """
+        Verify a readiness check which stopped running is not trusted.
+        """
+        self.health.check()
+        self.health.checked = time.monotonic() - 3600
+        self.assertFalse(self.health.is_ready())
+
+    def test_readiness(self):
+        """
+        Verify HealthCheck.readiness reports the last check.
+        """
+        self.health.check()
+        status, body = self.health.readiness()
+        self.assertEquals('200 OK', status)
+        body = json.loads(body.decode())
+        self.assertEquals('ready', body['status'])
+        self.assertEquals('connected', body['bus'])
+
+        self.health.bus.ping.side_effect = ConnectionError('refused')
+        self.health.bus.connected = False
+        self.health.check()
+        status, body = self.health.readiness()
+        self.assertEquals('503 Service Unavailable', status)
+        body = json.loads(body.decode())
+        self.assertEquals('not ready', body['status'])
+        self.assertEquals('disconnected', body['bus'])
+        self.assertEquals('ConnectionError: refused', body['error'])
+
+    def test_responses_are_cached(self):
+        """
+        Verify probe responses are cached for the interval.
+        """
+        self.health.check()
+        first = self.health.liveness()
+        self.health.bus.connected = False
+        self.assertIs(first, self.health.liveness())
+        # Until the interval passed
+        self.health.interval = 0
+        status, body = self.health.liveness()
+        self.assertEquals('200 OK', status)
+        self.assertEquals('disconnected', json.loads(body.decode())['bus'])
+
+    def test_start(self):
+        """
+        Verify HealthCheck.start checks in the background until stopped.
+        """
+        bus = mock.MagicMock()
+        self.health.interval = 0.01
+        self.health.start(bus)
+        try:
+            for _ in range(100):
+                if bus.ping.call_count >= 2:
+                    break
+                time.sleep(0.01)
+        finally:
+            self.health.stop()
+        self.assertGreaterEqual(bus.ping.call_count, 2)
+        self.assertIs(bus, self.health.bus)
+        self.assertTrue(self.health.is_ready())
+
+
+class TestHealthHandlers(TestCase):
+    """
+    Test for the health probe handlers.
+    """
+
+    def test_get_healthz(self):
+        """
+        Verify get_healthz responds with the liveness probe.
+        """
+        start_response = mock.MagicMock()
+        with mock.patch.object(
+                health_handlers._HEALTH, 'liveness',
+                return_value=('200 OK', b'{}')):
+            result = health_handlers.get_healthz(
+                create_environ('/healthz'), start_response)
+        self.assertEquals([b'{}'], result)
+        start_response.assert_called_once_with('200 OK', mock.ANY)
+
+    def test_get_readyz(self):
+        """
+        Verify get_readyz responds with the readiness probe.
+        """
+        start_response = mock.MagicMock()
+        with mock.patch.object(
+                health_handlers._HEALTH, 'readiness',
+                return_value=('503 Service Unavailable', b'{}')):
+            result = health_handlers.get_readyz(
+                create_environ('/readyz'), start_response)
+        self.assertEquals([b'{}'], result)
+        start_response.assert_called_once_with(
+            '503 Service Unavailable', mock.ANY)
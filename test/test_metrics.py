@@ -0,0 +1,205 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Test for commissaire_http.metrics
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from . import TestCase, create_environ, mock
+
+from commissaire_http.handlers import metrics as metrics_handlers
+from commissaire_http.metrics import (
+    Counter, Gauge, Histogram, MetricsRegistry, REGISTRY, shard_index)
+
+
+class TestCounter(TestCase):
+    """
+    Test for the Counter class.
+    """
+
+    def test_inc(self):
+        """
+        Verify Counter.inc adds to the value of the labels.
+        """
+        counter = Counter('test_total', 'Test.', ('code',))
+        counter.inc(('200',))
+        counter.inc(('200',), 2)
+        counter.inc(('404',))
+        self.assertEquals({('200',): 3, ('404',): 1}, counter.values())
+
+    def test_inc_from_threads(self):
+        """
+        Verify Counter.inc sums the shards of all threads.
+        """
+        counter = Counter('test_total', 'Test.')
+
+        def inc():
+            for _ in range(1000):
+                counter.inc()
+
+        threads = [threading.Thread(target=inc) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(8000, counter.values()[()])
+
+    def test_shard_index(self):
+        """
+        Verify shard_index is stable within a thread.
+        """
+        self.assertEquals(shard_index(), shard_index())
+
+
+class TestGauge(TestCase):
+    """
+    Test for the Gauge class.
+    """
+
+    def test_dec(self):
+        """
+        Verify Gauge.dec subtracts from the value.
+        """
+        gauge = Gauge('test', 'Test.')
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        self.assertEquals(1, gauge.values()[()])
+
+
+class TestHistogram(TestCase):
+    """
+    Test for the Histogram class.
+    """
+
+    def test_samples(self):
+        """
+        Verify Histogram.samples yields cumulative buckets, sum and count.
+        """
+        histogram = Histogram(
+            'test_seconds', 'Test.', ('route',), buckets=(0.1, 1.0))
+        histogram.observe(0.05, ('a',))
+        histogram.observe(0.5, ('a',))
+        histogram.observe(5, ('a',))
+        self.assertEquals([
+            ('test_seconds_bucket', '{route="a",le="0.1"}', 1),
+            ('test_seconds_bucket', '{route="a",le="1.0"}', 2),
+            ('test_seconds_bucket', '{route="a",le="+Inf"}', 3),
+            ('test_seconds_sum', '{route="a"}', 5.55),
+            ('test_seconds_count', '{route="a"}', 3),
+        ], list(histogram.samples()))
+
+
+class TestMetricsRegistry(TestCase):
+    """
+    Test for the MetricsRegistry class.
+    """
+
+    def test_render(self):
+        """
+        Verify MetricsRegistry.render uses the Prometheus text format.
+        """
+        registry = MetricsRegistry()
+        registry.counter('b_total', 'B.', ('path',)).inc(('/"x"',))
+        registry.callback('a', 'A.', lambda: 2)
+        self.assertEquals(
+            '# HELP a A.\n'
+            '# TYPE a gauge\n'
+            'a 2\n'
+            '# HELP b_total B.\n'
+            '# TYPE b_total counter\n'
+            'b_total{path="/\\"x\\""} 1\n',
+            registry.render())
+
+    def test_render_shared(self):
+        """
+        Verify MetricsRegistry.render sums the values of all processes.
+        """
+        registry = self.shared_registry()
+        registry.counter('b_total', 'B.', ('path',)).inc(('/',))
+        registry.histogram('c_seconds', 'C.', buckets=(1,)).observe(0.5)
+        registry.callback('a', 'A.', lambda: 2)
+        with open(os.path.join(registry.directory, '1.json'), 'w') as f:
+            json.dump({
+                'a': {'kind': 'callback', 'values': [[[], 3]]},
+                'b_total': {'kind': 'counter', 'values': [[['/'], 4]]},
+                'c_seconds': {
+                    'kind': 'histogram', 'values': [[[], [0, 1, 2.0]]]},
+            }, f)
+        self.assertEquals(
+            '# HELP a A.\n'
+            '# TYPE a gauge\n'
+            'a{{pid="1"}} 3\n'
+            'a{{pid="{}"}} 2\n'
+            '# HELP b_total B.\n'
+            '# TYPE b_total counter\n'
+            'b_total{{path="/"}} 5\n'
+            '# HELP c_seconds C.\n'
+            '# TYPE c_seconds histogram\n'
+            'c_seconds_bucket{{le="1"}} 1\n'
+            'c_seconds_bucket{{le="+Inf"}} 2\n'
+            'c_seconds_sum 2.5\n'
+            'c_seconds_count 2\n'.format(os.getpid()),
+            registry.render())
+
+    def test_retire(self):
+        """
+        Verify MetricsRegistry.retire keeps counters of exited processes.
+        """
+        registry = self.shared_registry()
+        registry.counter('b_total', 'B.').inc()
+        registry.gauge('g', 'G.').inc()
+        registry.write()
+        registry.retire(os.getpid())
+        registry.retire(os.getpid())
+        self.assertEquals(
+            ['.lock', 'retired.json'], sorted(os.listdir(registry.directory)))
+        # The retired count is added to the count of this process
+        rendered = registry.render()
+        self.assertIn('b_total 2\n', rendered)
+        self.assertIn('g 1\n', rendered)
+
+    def shared_registry(self):
+        """
+        Creates a registry shared through a temporary directory.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        registry = MetricsRegistry()
+        registry.share(directory)
+        return registry
+
+
+class TestMetricsHandlers(TestCase):
+    """
+    Test for the metrics handlers.
+    """
+
+    def test_get_metrics(self):
+        """
+        Verify get_metrics responds with the rendered registry.
+        """
+        start_response = mock.MagicMock()
+        result = metrics_handlers.get_metrics(
+            create_environ('/metrics'), start_response)
+        start_response.assert_called_once_with(
+            '200 OK', [('content-type', metrics_handlers.CONTENT_TYPE)])
+        self.assertEquals(REGISTRY.render(), result[0].decode())
+        self.assertIn('commissaire_http_threads ', result[0].decode())
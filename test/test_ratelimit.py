@@ -0,0 +1,190 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Test for commissaire_http.ratelimit
+"""
+
+import asyncio
+
+from . import TestCase, create_environ, mock
+
+from commissaire_http.ratelimit import (
+    RateLimiter, RateLimitRule, TokenBucket)
+
+
+def dummy_wsgi_app(environ, start_response):
+    start_response('200 OK', [('content-type', 'text/plain')])
+    return [bytes('hi', 'utf8')]
+
+
+class TestTokenBucket(TestCase):
+    """
+    Test for the TokenBucket class.
+    """
+
+    def test_take(self):
+        """
+        Verify tokens are taken up to burst and refill with rate.
+        """
+        bucket = TokenBucket(2, 2, 0)
+        self.assertEquals(0, bucket.take(0))
+        self.assertEquals(0, bucket.take(0))
+        self.assertEquals(0.5, bucket.take(0))
+        self.assertFalse(bucket.is_full(0.5))
+        self.assertEquals(0, bucket.take(0.5))
+        self.assertTrue(bucket.is_full(10))
+
+
+class TestRateLimitRule(TestCase):
+    """
+    Test for the RateLimitRule class.
+    """
+
+    def test_rule(self):
+        """
+        Verify rules parse string values and match path and method.
+        """
+        rule = RateLimitRule(
+            'user', '5', path='/api/v0/host/', method='put')
+        self.assertEquals(5.0, rule.rate)
+        self.assertEquals(5.0, rule.burst)
+        self.assertTrue(rule.matches(create_environ(
+            '/api/v0/host/', {'REQUEST_METHOD': 'PUT'})))
+        self.assertFalse(rule.matches(create_environ(
+            '/api/v0/host/', {'REQUEST_METHOD': 'GET'})))
+        self.assertFalse(rule.matches(create_environ(
+            '/api/v0/hosts', {'REQUEST_METHOD': 'PUT'})))
+
+    def test_unknown_key(self):
+        """
+        Verify unknown keys are rejected.
+        """
+        self.assertRaises(ValueError, RateLimitRule, 'nope', 1)
+
+    def test_invalid_rate_and_burst(self):
+        """
+        Verify rates of 0 or below and bursts below 1 are rejected.
+        """
+        for rate in (0, -1, '0', 'nan'):
+            self.assertRaises(ValueError, RateLimitRule, 'ip', rate)
+        for burst in (0, 0.5, -1):
+            self.assertRaises(
+                ValueError, RateLimitRule, 'ip', 1, burst=burst)
+        self.assertEquals(1.0, RateLimitRule('ip', 0.5).burst)
+
+    def test_identify(self):
+        """
+        Verify the identity of a request depends on the key.
+        """
+        environ = create_environ()
+        environ['REMOTE_ADDR'] = '10.0.0.1'
+        self.assertEquals(
+            '10.0.0.1', RateLimitRule('user', 1).identify(environ))
+        self.assertEquals('/', RateLimitRule('route', 1).identify(environ))
+        environ['REMOTE_USER'] = 'a'
+        self.assertEquals('a', RateLimitRule('user', 1).identify(environ))
+        self.assertEquals(
+            '10.0.0.1', RateLimitRule('ip', 1).identify(environ))
+
+
+class TestRateLimiter(TestCase):
+    """
+    Test for the RateLimiter class.
+    """
+
+    def setUp(self):
+        """
+        Creates a new instance to test with per test.
+        """
+        self.limiter = RateLimiter(
+            dummy_wsgi_app, [RateLimitRule('user', 1, burst=1)])
+
+    def environ(self, user):
+        """
+        Creates an environ for an authenticated user.
+        """
+        return create_environ(
+            headers={'REQUEST_METHOD': 'GET', 'REMOTE_USER': user})
+
+    def test_limits_per_user(self):
+        """
+        Verify each user has their own bucket and gets a 429 when empty.
+        """
+        start_response = mock.MagicMock()
+        self.assertEquals([b'hi'], self.limiter(
+            self.environ('a'), start_response))
+        self.assertEquals([b'hi'], self.limiter(
+            self.environ('b'), start_response))
+        self.assertEquals([b'Too Many Requests'], self.limiter(
+            self.environ('a'), start_response))
+        start_response.assert_called_with(
+            '429 Too Many Requests', [
+                ('content-type', 'text/html'), ('Retry-After', '1')])
+
+    def test_exempt_paths(self):
+        """
+        Verify exempt paths pass while the limit is reached.
+        """
+        limiter = RateLimiter(
+            dummy_wsgi_app, [RateLimitRule('ip', 1, burst=1)],
+            exempt_paths=['/healthz'])
+        environ = create_environ(
+            path='/healthz', headers={'REQUEST_METHOD': 'GET'})
+        self.assertEquals(0, limiter.check(environ))
+        for _ in range(3):
+            self.assertEquals(
+                [b'hi'], limiter(dict(environ), mock.MagicMock()))
+
+    def test_rejected_keeps_tokens(self):
+        """
+        Verify a request rejected by one rule takes no token of the others.
+        """
+        limiter = RateLimiter(dummy_wsgi_app, [
+            RateLimitRule('route', 5, burst=5),
+            RateLimitRule('user', 1, burst=1)])
+        self.assertEquals(0, limiter.check(self.environ('a')))
+        for _ in range(3):
+            self.assertTrue(limiter.check(self.environ('a')))
+        # Only the accepted request took a token of the route
+        self.assertEquals(0, limiter.check(self.environ('b')))
+        buckets = limiter._shards[
+            hash((0, '/')) % limiter.shards].buckets
+        self.assertEquals(3, int(buckets[(0, '/')].tokens))
+
+    def test_prune(self):
+        """
+        Verify unused buckets are dropped once a shard is full.
+        """
+        self.limiter.max_buckets = 1
+        self.limiter.shards = 1
+        self.limiter._shards = self.limiter._shards[:1]
+        for user in range(100):
+            self.limiter.check(self.environ(str(user)))
+        with mock.patch('time.monotonic', return_value=10 ** 9):
+            self.limiter.check(self.environ('new'))
+        self.assertEquals(1, sum(
+            len(shard.buckets) for shard in self.limiter._shards))
+
+    def test_call_async(self):
+        """
+        Verify call_async honors the limit.
+        """
+        loop = asyncio.new_event_loop()
+        start_response = mock.MagicMock()
+        self.assertEquals([b'hi'], loop.run_until_complete(
+            self.limiter.call_async(self.environ('a'), start_response)))
+        self.assertEquals([b'Too Many Requests'], loop.run_until_complete(
+            self.limiter.call_async(self.environ('a'), start_response)))
+        loop.close()
@@ -16,8 +16,14 @@
 Test for commissaire_http.router
 """
 
-from . import TestCase
-from commissaire_http.router import Router
+from . import TestCase, mock
+from routes import Mapper
+from routes.middleware import RoutesMiddleware
+
+from commissaire_http.constants import ROUTING_RX_PARAMS
+from commissaire_http.dispatcher import Dispatcher
+from commissaire_http.router import CACHE_HITS, CACHE_MISSES, Router
+from commissaire_http.server.routing import ROUTES, connect_routes
 
 class TestRouter(TestCase):
     """
@@ -45,3 +51,251 @@ class TestRouter(TestCase):
         Verify the Router returns None on unsuccessful match.
         """
         self.assertIsNone(self.router_instance.match('/idonotexist/'))
+
+
+class TestRouterTree(TestCase):
+    """
+    Test for matching routes through the route tree of the Router class.
+    """
+
+    def setUp(self):
+        """
+        Creates a new instance to test with per test.
+        """
+        self.router_instance = Router(optional_slash=True)
+        self.router_instance.connect(
+            '/api/v0/host/{address}/', controller='get_host',
+            requirements={'address': ROUTING_RX_PARAMS['address']},
+            conditions={'method': 'GET'})
+        self.router_instance.connect(
+            '/api/v0/host/{address}/', controller='delete_host',
+            requirements={'address': ROUTING_RX_PARAMS['address']},
+            conditions={'method': 'DELETE'})
+        self.router_instance.connect(
+            '/api/v0/cluster/{name}/hosts/', controller='add_hosts',
+            action='add', conditions={'method': 'PUT'})
+        self.router_instance.connect(
+            '/api/v0/cluster/{name}.json', controller='get_cluster_json',
+            conditions={'method': 'GET'})
+        self.router_instance.connect(
+            '/api/v0/cluster/{name}/', controller='get_cluster',
+            conditions={'method': 'GET'})
+        self.router_instance.create_regs()
+
+    def match(self, path, method='GET'):
+        """
+        Matches a path returning the result and route.
+        """
+        return self.router_instance.routematch(
+            path, environ={'REQUEST_METHOD': method})
+
+    def test_tree(self):
+        """
+        Verify only routes which can not be split into segments use
+        regular expressions.
+        """
+        root, regex_routes, _ = self.router_instance._tree
+        self.assertEquals(
+            ['get_cluster_json'],
+            [route.defaults['controller'] for _, route in regex_routes])
+        self.assertEquals(['api'], list(root.literals))
+
+    def test_match(self):
+        """
+        Verify the tree matches like the regular expressions of the routes.
+        """
+        for path, method in (
+                ('/api/v0/host/10.2.0.2/', 'GET'),
+                ('/api/v0/host/10.2.0.2', 'DELETE'),
+                ('/api/v0/host/10.2.0.2/', 'PUT'),
+                ('/api/v0/host/10.2.0.2//', 'GET'),
+                ('/api/v0/host/bad%20name/', 'GET'),
+                ('/api/v0/cluster/test/hosts', 'PUT'),
+                ('/api/v0/cluster/test.json', 'GET'),
+                ('/api/v0/cluster/test/', 'GET'),
+                ('/api/v0/cluster//', 'GET'),
+                ('/api/v1/cluster/test/', 'GET'),
+                ('api/v0/cluster/test/', 'GET')):
+            environ = {'REQUEST_METHOD': method}
+            expected = Mapper._match(self.router_instance, path, environ)
+            result = self.router_instance._match(path, environ)
+            self.assertEquals(expected[:2], result[:2], path)
+
+    def test_match_results(self):
+        """
+        Verify results hold parameters, the optional slash and defaults.
+        """
+        match, route = self.match('/api/v0/host/10.2.0.2/', 'DELETE')
+        self.assertEquals({
+            'controller': 'delete_host',
+            'address': '10.2.0.2',
+            '_': '/'}, match)
+        self.assertIs(self.router_instance.matchlist[1], route)
+        match, route = self.match('/api/v0/cluster/test/hosts', 'PUT')
+        self.assertEquals({
+            'controller': 'add_hosts',
+            'action': 'add',
+            'name': 'test',
+            '_': ''}, match)
+        self.assertIsNone(self.match('/api/v0/host/10.2.0.2/', 'PUT'))
+
+    def test_match_order(self):
+        """
+        Verify routes connected first win over routes connected later.
+        """
+        self.router_instance.connect(
+            '/api/v0/cluster/all/', controller='get_all',
+            conditions={'method': 'GET'})
+        self.router_instance.create_regs()
+        self.assertEquals(
+            'get_cluster', self.match('/api/v0/cluster/all/')[0]['controller'])
+
+    def test_routes_middleware(self):
+        """
+        Verify RoutesMiddleware sets the routing args from the tree.
+        """
+        app = mock.MagicMock(return_value=[b''])
+        environ = {
+            'PATH_INFO': '/api/v0/host/10.2.0.2/',
+            'REQUEST_METHOD': 'GET',
+            'SCRIPT_NAME': '',
+            'HTTP_HOST': 'localhost',
+            'wsgi.url_scheme': 'http',
+        }
+        RoutesMiddleware(app, self.router_instance)(
+            environ, mock.MagicMock())
+        self.assertEquals(
+            'get_host', environ['wsgiorg.routing_args'][1]['controller'])
+        self.assertIs(
+            self.router_instance.matchlist[0], environ['routes.route'])
+
+
+class TestRouterCache(TestCase):
+    """
+    Test for the route match cache of the Router class.
+    """
+
+    def setUp(self):
+        """
+        Creates a new instance to test with per test.
+        """
+        self.router_instance = Router(optional_slash=True, cache_size=2)
+        self.router_instance.connect(
+            '/api/v0/host/{address}/', controller='get_host',
+            conditions={'method': 'GET'})
+        self.router_instance.create_regs()
+        self.environ = {'REQUEST_METHOD': 'GET'}
+
+    def counts(self):
+        """
+        Returns the hit and miss counts.
+        """
+        return (
+            CACHE_HITS.values().get((), 0), CACHE_MISSES.values().get((), 0))
+
+    def test_cache(self):
+        """
+        Verify matches are cached by method and path.
+        """
+        hits, misses = self.counts()
+        match, route = self.router_instance.routematch(
+            '/api/v0/host/10.2.0.2/', environ=self.environ)
+        match['address'] = 'changed'
+        self.assertEquals((hits, misses + 1), self.counts())
+        cached, cached_route = self.router_instance.routematch(
+            '/api/v0/host/10.2.0.2/', environ=self.environ)
+        self.assertEquals((hits + 1, misses + 1), self.counts())
+        self.assertEquals('10.2.0.2', cached['address'])
+        self.assertIs(route, cached_route)
+        self.assertIsNone(self.router_instance.routematch(
+            '/api/v0/host/10.2.0.2/', environ={'REQUEST_METHOD': 'PUT'}))
+        self.assertEquals((hits + 1, misses + 2), self.counts())
+
+    def test_cache_size(self):
+        """
+        Verify the least recently used matches are dropped.
+        """
+        for address in ('a', 'b', 'a', 'c'):
+            self.router_instance.match(
+                '/api/v0/host/{}/'.format(address), environ=self.environ)
+        cache = self.router_instance._tree[2]
+        self.assertEquals(
+            [('GET', '/api/v0/host/a/'), ('GET', '/api/v0/host/c/')],
+            list(cache))
+        self.router_instance.configure_cache(0)
+        self.assertEquals(0, len(cache))
+        self.router_instance.match('/api/v0/host/a/', environ=self.environ)
+        self.assertEquals(0, len(cache))
+
+    def test_cache_misses_not_cached(self):
+        """
+        Verify paths matching no route and long paths do not push out
+        cached matches.
+        """
+        self.router_instance.match('/api/v0/host/a/', environ=self.environ)
+        for path in ('/nope/1', '/nope/2', '/nope/3'):
+            self.assertIsNone(
+                self.router_instance.match(path, environ=self.environ))
+        self.router_instance.match(
+            '/api/v0/host/{}/'.format('x' * 300), environ=self.environ)
+        self.assertEquals(
+            [('GET', '/api/v0/host/a/')], list(self.router_instance._tree[2]))
+        hits, misses = self.counts()
+        self.router_instance.match('/api/v0/host/a/', environ=self.environ)
+        self.assertEquals((hits + 1, misses), self.counts())
+
+    def test_cache_invalidated(self):
+        """
+        Verify changing the routes drops cached matches.
+        """
+        self.assertIsNone(self.router_instance.match(
+            '/api/v0/hosts/', environ=self.environ))
+        self.router_instance.connect(
+            '/api/v0/hosts/', controller='list_hosts',
+            conditions={'method': 'GET'})
+        self.router_instance.create_regs()
+        self.assertEquals('list_hosts', self.router_instance.match(
+            '/api/v0/hosts/', environ=self.environ)['controller'])
+
+    def test_cache_other_conditions(self):
+        """
+        Verify matches are not cached when routes have conditions besides
+        the method.
+        """
+        self.router_instance.connect(
+            '/api/v0/hosts/', controller='list_hosts',
+            conditions={'method': 'GET', 'function': lambda e, r: True})
+        self.router_instance.create_regs()
+        self.assertIsNone(self.router_instance._tree[2])
+        self.assertTrue(self.router_instance.match(
+            '/api/v0/hosts/', environ=self.environ))
+
+
+class TestConnectRoutes(TestCase):
+    """
+    Test for the connect_routes function.
+    """
+
+    def test_connect_routes(self):
+        """
+        Verify connect_routes connects controllers by path.
+        """
+        router = connect_routes(Router(optional_slash=True), ROUTES[:3])
+        match = router.match(
+            '/api/v0/host/10.2.0.2', environ={'REQUEST_METHOD': 'PUT'})
+        self.assertEquals(
+            'commissaire_http.handlers.hosts.create_host',
+            match['controller'])
+        self.assertEquals('10.2.0.2', match['address'])
+        self.assertIsNone(router.match(
+            '/api/v0/cluster/test/', environ={'REQUEST_METHOD': 'GET'}))
+
+    def test_connect_routes_controllers_resolve(self):
+        """
+        Verify every controller of ROUTES resolves to a handler.
+        """
+        router = connect_routes(Router(optional_slash=True))
+        dispatcher = Dispatcher(router, handler_packages=[])
+        self.assertEquals(len(ROUTES), len(dispatcher._table))
+        for entry in dispatcher._table.values():
+            self.assertTrue(callable(entry.handler))
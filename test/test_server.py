@@ -16,14 +16,23 @@
 Test for commissaire_http.server
 """
 
+import os
+
 from unittest import mock
 
 from . import TestCase
 
 from commissaire.util.config import ConfigurationError
 
-from commissaire_http.authentication import AuthenticationManager
+from commissaire_http.admission import (
+    AdmissionController, AIMDLimit, FixedLimit)
+from commissaire_http.authentication import (
+    AuthenticationManager, LazyAuthenticator)
+from commissaire_http.handlers import health as health_handlers
+from commissaire_http.ratelimit import RateLimiter
 from commissaire_http.server import cli
+from commissaire_http.deadline import DeadlineMiddleware
+from commissaire_http.timing import ServerTimingMiddleware, TimedStage
 from commissaire_http.dispatcher import Dispatcher
 
 
@@ -32,15 +41,262 @@ class TestServerCli(TestCase):
     Test for the server cli module.
     """
 
+    @mock.patch('commissaire_http.server.cli.HEALTH')
+    @mock.patch('commissaire_http.server.cli.configure_logging')
     @mock.patch('commissaire_http.server.cli.DISPATCHER')
     @mock.patch('commissaire_http.server.cli.CommissaireHttpServer')
-    def test_main(self, _server, _dispatcher):
+    def test_main(self, _server, _dispatcher, _configure_logging, _health):
         """
         Verify the server is started when main is executed.
         """
         cli.main()
         _server().serve_forever.assert_called_once_with()
 
+    @mock.patch('commissaire_http.server.cli.load_authenticators')
+    @mock.patch('commissaire_http.server.cli.HEALTH')
+    @mock.patch('commissaire_http.server.cli.configure_logging')
+    @mock.patch('commissaire_http.server.cli.DISPATCHER')
+    @mock.patch('commissaire_http.server.cli.CommissaireHttpServer')
+    def test_main_with_failing_plugin(self, _server, _dispatcher,
+                                      _configure_logging, _health, _load):
+        """
+        Verify main exits before serving when a plugin fails to load.
+        """
+        _load.side_effect = ConfigurationError('bad plugin configuration')
+        with mock.patch('sys.argv', ['']), \
+                mock.patch('argparse.ArgumentParser.error',
+                           side_effect=SystemExit) as _error, \
+                mock.patch('signal.signal') as _signal:
+            self.assertRaises(SystemExit, cli.main)
+        _load.assert_called_once_with(mock.ANY)
+        _error.assert_called_once_with(
+            'Could not load authentication plugins: '
+            'bad plugin configuration')
+        self.assertFalse(_server().serve_forever.called)
+        self.assertFalse(_signal.called)
+
+    @mock.patch('commissaire_http.server.cli.inject_authentication')
+    @mock.patch('commissaire_http.server.cli.HEALTH')
+    @mock.patch('commissaire_http.server.cli.configure_logging')
+    @mock.patch('commissaire_http.server.cli.DISPATCHER')
+    @mock.patch('commissaire_http.server.cli.CommissaireHttpServer')
+    def test_main_with_missing_plugin(self, _server, _dispatcher,
+                                      _configure_logging, _health, _inject):
+        """
+        Verify main reports a missing plugin as a usage error.
+        """
+        _inject.side_effect = ConfigurationError(
+            'Authentication plugin "missing" not found.')
+        with mock.patch('sys.argv', ['']), \
+                mock.patch('argparse.ArgumentParser.error',
+                           side_effect=SystemExit) as _error:
+            self.assertRaises(SystemExit, cli.main)
+        _error.assert_called_once_with(
+            'Could not load authentication plugins: '
+            'Authentication plugin "missing" not found.')
+        self.assertFalse(_server().serve_forever.called)
+
+    @mock.patch('commissaire_http.server.cli.REGISTRY')
+    @mock.patch('commissaire_http.server.cli.HEALTH')
+    @mock.patch('commissaire_http.server.cli.configure_logging')
+    @mock.patch('commissaire_http.server.cli.DISPATCHER')
+    @mock.patch('commissaire_http.server.cli.CommissaireHttpServer')
+    @mock.patch('commissaire_http.server.cli.WorkerSupervisor')
+    def test_main_with_workers(self, _supervisor, _server, _dispatcher,
+                               _configure_logging, _health, _registry):
+        """
+        Verify workers are supervised when main is executed with --workers.
+        """
+        with mock.patch('sys.argv', [
+                '', '--workers', '2', '--log-queue-size', '100']):
+            cli.main()
+        _supervisor.assert_called_once_with(
+            _server(), 2, worker_init=mock.ANY,
+            before_restart=_dispatcher.hot_reload,
+            after_exit=_registry.retire)
+        _supervisor().run.assert_called_once_with()
+        _dispatcher.load_handlers.assert_called_once_with()
+
+        # Metrics are shared through a directory removed on exit
+        directory = _registry.share.call_args[0][0]
+        self.assertFalse(os.path.exists(directory))
+        self.assertFalse(_server().serve_forever.called)
+        _configure_logging.assert_called_once_with(False, 100)
+
+        # Workers set up their own logging, bus connection and health check
+        self.assertFalse(_health.start.called)
+        _supervisor.call_args_list[0][1]['worker_init']()
+        self.assertEquals(2, _configure_logging.call_count)
+        _dispatcher.setup_bus.assert_called_once_with(
+            exchange_name=mock.ANY, connection_url=mock.ANY,
+            qkwargs=mock.ANY)
+        _health.start.assert_called_once_with(_dispatcher.bus)
+        _registry.write_periodically.assert_called_once_with()
+        _dispatcher.router.configure_cache.assert_called_once_with(4096)
+
+
+class TestInjectAdmissionControl(TestCase):
+    """
+    Tests for the cli.inject_admission_control function.
+    """
+
+    @mock.patch('commissaire_http.server.cli.DISPATCHER')
+    def test_inject_admission_control(self, _dispatcher):
+        """
+        Verify cli.inject_admission_control wraps dispatch with a limit.
+        """
+        dispatch = _dispatcher.dispatch
+        result = cli.inject_admission_control(10)
+        self.assertIsInstance(result.dispatch, AdmissionController)
+        self.assertIs(dispatch, result.dispatch._app)
+        self.assertIsInstance(result.dispatch.limit, FixedLimit)
+
+        result = cli.inject_admission_control(10, adaptive=True)
+        self.assertIsInstance(result.dispatch.limit, AIMDLimit)
+
+        result = cli.inject_admission_control(10, exempt_paths=['/healthz'])
+        self.assertEquals(
+            frozenset(['/healthz']), result.dispatch.exempt_paths)
+
+
+class TestInjectServerTiming(TestCase):
+    """
+    Tests for the cli.inject_stage_timing and cli.inject_server_timing
+    functions.
+    """
+
+    @mock.patch('commissaire_http.timing.enabled', False)
+    @mock.patch('commissaire_http.server.cli.DISPATCHER')
+    def test_inject_stage_timing(self, _dispatcher):
+        """
+        Verify cli.inject_stage_timing enables timing and times dispatch.
+        """
+        from commissaire_http import timing
+        dispatch = _dispatcher.dispatch
+        routematch = _dispatcher.router.routematch
+        result = cli.inject_stage_timing()
+        self.assertTrue(timing.enabled)
+        self.assertIsInstance(result.dispatch, TimedStage)
+        self.assertIs(dispatch, result.dispatch._app)
+        self.assertIsNot(routematch, result.router.routematch)
+
+    @mock.patch('commissaire_http.server.cli.DISPATCHER')
+    def test_inject_server_timing(self, _dispatcher):
+        """
+        Verify cli.inject_server_timing wraps dispatch.
+        """
+        dispatch = _dispatcher.dispatch
+        result = cli.inject_server_timing()
+        self.assertIsInstance(result.dispatch, ServerTimingMiddleware)
+        self.assertIs(dispatch, result.dispatch._app)
+
+    @mock.patch('commissaire_http.server.cli.DISPATCHER')
+    def test_inject_request_deadlines(self, _dispatcher):
+        """
+        Verify cli.inject_request_deadlines wraps dispatch.
+        """
+        dispatch = _dispatcher.dispatch
+        result = cli.inject_request_deadlines(5.0)
+        self.assertIsInstance(result.dispatch, DeadlineMiddleware)
+        self.assertIs(dispatch, result.dispatch._app)
+        self.assertEquals(5.0, result.dispatch.timeout)
+
+
+class TestProbesUnderLoad(TestCase):
+    """
+    Tests for probes served through the middleware injected by main.
+    """
+
+    @mock.patch('commissaire_http.server.cli.DISPATCHER')
+    def test_healthz_while_saturated(self, _dispatcher):
+        """
+        Verify /healthz is answered while admission and rate limits are
+        exhausted.
+        """
+        _dispatcher.dispatch = health_handlers.get_healthz
+        cli.inject_rate_limiting(
+            [{'key': 'ip', 'rate': '1'}], cli.UNAUTHENTICATED_PATHS)
+        limiter = _dispatcher.dispatch
+        cli.inject_admission_control(1, False, cli.UNAUTHENTICATED_PATHS)
+        admission = _dispatcher.dispatch
+        cli.inject_request_deadlines(5.0, cli.UNAUTHENTICATED_PATHS)
+
+        environ = {
+            'PATH_INFO': '/healthz', 'REQUEST_METHOD': 'GET',
+            'REMOTE_ADDR': '127.0.0.1'}
+        self.assertEquals(0, limiter.check(environ))
+        admission.in_flight = 1
+        for _ in range(3):
+            start_response = mock.MagicMock()
+            _dispatcher.dispatch(dict(environ), start_response)
+            start_response.assert_called_once_with('200 OK', mock.ANY)
+        self.assertEquals(0, admission.rejected)
+
+
+class TestLoadAuthenticators(TestCase):
+    """
+    Tests for the cli.load_authenticators function.
+    """
+
+    def test_load_authenticators(self):
+        """
+        Verify cli.load_authenticators loads lazy plugins.
+        """
+        lazy = mock.MagicMock(LazyAuthenticator)
+        manager = AuthenticationManager(
+            None, authenticators=[lazy, mock.MagicMock()])
+        cli.load_authenticators(manager)
+        lazy.load.assert_called_once_with()
+
+
+class TestReloadHandlers(TestCase):
+    """
+    Tests for the cli.reload_handlers function.
+    """
+
+    @mock.patch('commissaire_http.server.cli.DISPATCHER')
+    def test_reload_handlers(self, _dispatcher):
+        """
+        Verify cli.reload_handlers reloads the handlers in a thread.
+        """
+        cli.reload_handlers().join()
+        _dispatcher.hot_reload.assert_called_once_with()
+
+    @mock.patch('commissaire_http.server.cli.DISPATCHER')
+    def test_reload_handlers_with_error(self, _dispatcher):
+        """
+        Verify cli.reload_handlers logs errors of the reload.
+        """
+        _dispatcher.hot_reload.side_effect = SyntaxError('invalid syntax')
+        cli.reload_handlers().join()
+        self.assertEquals(1, _dispatcher.logger.error.call_count)
+
+
+class TestInjectRateLimiting(TestCase):
+    """
+    Tests for the cli.inject_rate_limiting function.
+    """
+
+    @mock.patch('commissaire_http.server.cli.DISPATCHER')
+    def test_inject_rate_limiting(self, _dispatcher):
+        """
+        Verify cli.inject_rate_limiting wraps dispatch with the rules.
+        """
+        result = cli.inject_rate_limiting([
+            {'key': 'user', 'rate': '5', 'path': '/api/v0/host/'}])
+        self.assertIsInstance(result.dispatch, RateLimiter)
+        self.assertEquals('/api/v0/host/', result.dispatch.rules[0].path)
+
+    @mock.patch('commissaire_http.server.cli.DISPATCHER')
+    def test_inject_rate_limiting_with_bad_config(self, _dispatcher):
+        """
+        Verify cli.inject_rate_limiting raises on bad configurations.
+        """
+        self.assertRaises(
+            ValueError, cli.inject_rate_limiting, [{'key': 'nope', 'rate': 1}])
+        self.assertRaises(
+            TypeError, cli.inject_rate_limiting, [{'key': 'user'}])
+
 
 class TestInjectAuthentication(TestCase):
     """
@@ -77,3 +333,44 @@ class TestInjectAuthentication(TestCase):
             ConfigurationError,
             cli.inject_authentication,
             {'commissaire_http.doesnotexist': {}})
+
+
+class TestGetListenSocket(TestCase):
+    """
+    Tests for the cli.get_listen_socket function.
+    """
+
+    def test_get_listen_socket_default(self):
+        """
+        Verify cli.get_listen_socket returns None without a socket to use.
+        """
+        with mock.patch('commissaire_http.server.cli.get_systemd_sockets',
+                        return_value=[]):
+            self.assertIsNone(cli.get_listen_socket())
+
+    def test_get_listen_socket_unix(self):
+        """
+        Verify cli.get_listen_socket creates a Unix domain socket.
+        """
+        with mock.patch('commissaire_http.server.cli.get_systemd_sockets',
+                        return_value=[]), \
+                mock.patch('commissaire_http.server.cli.create_unix_socket',
+                           return_value='unix') as _create:
+            self.assertEquals(
+                'unix', cli.get_listen_socket('/run/commissaire.sock', 10))
+            _create.assert_called_once_with('/run/commissaire.sock', 10)
+
+    def test_get_listen_socket_systemd(self):
+        """
+        Verify cli.get_listen_socket prefers sockets passed by systemd.
+        """
+        first, extra = mock.MagicMock(), mock.MagicMock()
+        with mock.patch('commissaire_http.server.cli.get_systemd_sockets',
+                        return_value=[first, extra]), \
+                mock.patch('commissaire_http.server.cli.create_unix_socket'
+                           ) as _create:
+            self.assertIs(
+                first, cli.get_listen_socket('/run/commissaire.sock'))
+            self.assertEquals(0, _create.call_count)
+        extra.close.assert_called_once_with()
+        self.assertEquals(0, first.close.call_count)
@@ -0,0 +1,186 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Test for commissaire_http.supervisor
+"""
+
+import os
+import signal
+
+from unittest import mock
+
+from . import TestCase
+
+from commissaire_http.supervisor import WorkerSupervisor
+
+
+class TestWorkerSupervisor(TestCase):
+    """
+    Test for the WorkerSupervisor class.
+    """
+
+    def setUp(self):
+        """
+        Creates a new instance to test with per test.
+        """
+        self.server = mock.MagicMock()
+        self.supervisor = WorkerSupervisor(self.server, 2)
+
+    @mock.patch('os.fork')
+    def test_spawn(self, _fork):
+        """
+        Verify WorkerSupervisor.spawn tracks the forked worker.
+        """
+        _fork.return_value = 100
+        self.assertEquals(100, self.supervisor.spawn())
+        self.assertIn(100, self.supervisor.children)
+
+    @mock.patch('os.fork')
+    @mock.patch('os.waitpid')
+    def test_reap_restarts_worker(self, _wait, _fork):
+        """
+        Verify WorkerSupervisor.reap restarts a worker that exited.
+        """
+        self.supervisor._running = True
+        self.supervisor.children[100] = 0
+        _wait.return_value = (100, 256)
+        _fork.return_value = 101
+        self.assertEquals(100, self.supervisor.reap())
+        self.assertEquals([101], list(self.supervisor.children.keys()))
+
+    @mock.patch('os.fork')
+    @mock.patch('os.waitpid')
+    def test_reap_when_stopped(self, _wait, _fork):
+        """
+        Verify WorkerSupervisor.reap does not restart workers when stopped.
+        """
+        self.supervisor.children[100] = 0
+        _wait.return_value = (100, 0)
+        self.supervisor.reap()
+        self.assertFalse(self.supervisor.children)
+        self.assertFalse(_fork.called)
+
+    @mock.patch('os.waitpid')
+    def test_reap_without_exited_worker(self, _wait):
+        """
+        Verify WorkerSupervisor.reap does not wait for workers to exit.
+        """
+        self.supervisor.children[100] = 0
+        _wait.return_value = (0, 0)
+        self.assertIsNone(self.supervisor.reap())
+        _wait.assert_called_once_with(-1, os.WNOHANG)
+        self.assertEquals([100], list(self.supervisor.children.keys()))
+
+    @mock.patch('os.waitpid')
+    def test_reap_after_exit(self, _wait):
+        """
+        Verify WorkerSupervisor.reap passes exited workers to after_exit.
+        """
+        after_exit = mock.MagicMock(side_effect=Exception)
+        self.supervisor.after_exit = after_exit
+        self.supervisor.retiring.add(100)
+        _wait.return_value = (100, 0)
+        self.assertEquals(100, self.supervisor.reap())
+        after_exit.assert_called_once_with(100)
+        self.assertFalse(self.supervisor.retiring)
+
+    @mock.patch('os.kill')
+    def test_stop(self, _kill):
+        """
+        Verify WorkerSupervisor.stop signals all workers.
+        """
+        self.supervisor._running = True
+        self.supervisor.children = {100: 0, 101: 0}
+        self.supervisor.stop()
+        self.assertFalse(self.supervisor._running)
+        self.assertEquals(2, _kill.call_count)
+
+    @mock.patch('os.kill')
+    @mock.patch('os.fork')
+    @mock.patch('os.waitpid')
+    def test_restart(self, _wait, _fork, _kill):
+        """
+        Verify WorkerSupervisor.restart starts new workers before retiring
+        the old ones and does not restart retired workers.
+        """
+        self.supervisor._running = True
+        self.supervisor.children = {100: 0, 101: 0}
+        _fork.side_effect = [102, 103]
+        self.supervisor.restart()
+        self.assertEquals(
+            [102, 103], sorted(self.supervisor.children.keys()))
+        self.assertEquals({100, 101}, self.supervisor.retiring)
+        self.assertEquals(2, _kill.call_count)
+
+        _wait.return_value = (100, 0)
+        self.assertEquals(100, self.supervisor.reap())
+        self.assertEquals({101}, self.supervisor.retiring)
+        self.assertEquals(2, _fork.call_count)
+
+    @mock.patch('os.kill')
+    @mock.patch('os.fork')
+    def test_restart_before_restart(self, _fork, _kill):
+        """
+        Verify WorkerSupervisor.restart calls before_restart before forking
+        and keeps the workers when it raises.
+        """
+        before_restart = mock.MagicMock(side_effect=Exception)
+        self.supervisor.before_restart = before_restart
+        self.supervisor._running = True
+        self.supervisor.children = {100: 0, 101: 0}
+        self.supervisor.restart()
+        before_restart.assert_called_once_with()
+        self.assertFalse(_fork.called)
+        self.assertFalse(_kill.called)
+        self.assertEquals([100, 101], sorted(self.supervisor.children.keys()))
+
+        before_restart.side_effect = None
+        _fork.side_effect = [102, 103]
+        self.supervisor.restart()
+        self.assertEquals(
+            [102, 103], sorted(self.supervisor.children.keys()))
+
+    @mock.patch('time.sleep')
+    @mock.patch('signal.signal')
+    @mock.patch('os.kill')
+    @mock.patch('os.fork')
+    @mock.patch('os.waitpid')
+    def test_run_restarts_on_request(self, _wait, _fork, _kill, _signal,
+                                     _sleep):
+        """
+        Verify SIGHUP only requests a restart which the run loop carries
+        out.
+        """
+        self.supervisor.workers = 1
+        _fork.side_effect = [100, 101]
+        _wait.side_effect = [(0, 0), (100, 0), (0, 0), (101, 0)]
+
+        # Signals arrive while the loop waits
+        signals = [self.supervisor.request_restart, self.supervisor.stop]
+
+        def sleep(seconds):
+            signals.pop(0)()
+            self.assertEquals(2 - len(signals), _fork.call_count)
+
+        _sleep.side_effect = sleep
+        self.supervisor.run()
+        _signal.assert_any_call(
+            signal.SIGHUP, self.supervisor.request_restart)
+        self.assertEquals(2, _fork.call_count)
+        self.assertEquals(
+            [mock.call(100, signal.SIGTERM), mock.call(101, signal.SIGTERM)],
+            _kill.call_args_list)
+        self.assertFalse(self.supervisor.children)
+        self.assertFalse(self.supervisor.retiring)
@@ -0,0 +1,148 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Test for commissaire_http.timing
+"""
+
+import asyncio
+
+from . import TestCase, create_environ, mock
+
+from commissaire_http import timing
+from commissaire_http.router import Router
+from commissaire_http.util.wsgi import FakeStartResponse
+
+
+def bus_wsgi_app(environ, start_response):
+    timing.record('bus', 0.5)
+    start_response('200 OK', [('content-type', 'application/json')])
+    return [b'{}']
+
+
+class TestTimings(TestCase):
+    """
+    Test for the Timings class.
+    """
+
+    def test_add(self):
+        """
+        Verify Timings.add sums repeated stages and formats them.
+        """
+        timings = timing.Timings()
+        timings.add('auth', 0.01)
+        timings.add('bus', 0.002)
+        timings.add('bus', 0.003)
+        self.assertEquals(
+            'auth;dur=10.000, bus;dur=5.000', timings.header())
+        self.assertEquals(
+            'auth_ms=10.000 bus_ms=5.000', timings.log_fields())
+
+
+class TestTimedStage(TestCase):
+    """
+    Test for the TimedStage class.
+    """
+
+    def test_call(self):
+        """
+        Verify TimedStage records its stage and stages recorded within.
+        """
+        environ = create_environ()
+        stage = timing.TimedStage('handler', bus_wsgi_app)
+        self.assertEquals([b'{}'], stage(environ, mock.MagicMock()))
+        stages = environ[timing.ENVIRON_KEY].stages
+        self.assertEquals(['bus', 'handler'], list(stages))
+        self.assertEquals(0.5, stages['bus'])
+        # Nothing is recorded outside of a stage
+        timing.record('bus', 1)
+        self.assertEquals(0.5, stages['bus'])
+
+    def test_call_async(self):
+        """
+        Verify TimedStage.call_async records stages run in the executor.
+        """
+        environ = create_environ()
+        stage = timing.TimedStage('handler', bus_wsgi_app)
+        loop = asyncio.new_event_loop()
+        try:
+            result = loop.run_until_complete(
+                stage.call_async(environ, mock.MagicMock()))
+        finally:
+            loop.close()
+        self.assertEquals([b'{}'], result)
+        self.assertEquals(
+            ['bus', 'handler'], list(environ[timing.ENVIRON_KEY].stages))
+
+
+class TestTimeRouting(TestCase):
+    """
+    Test for the time_routing function.
+    """
+
+    def test_time_routing(self):
+        """
+        Verify time_routing records route matching as the route stage.
+        """
+        router = Router()
+        router.connect('/hello/', controller='hello')
+        timing.time_routing(router)
+        environ = create_environ('/hello/')
+        match, route = router.routematch(environ=environ)
+        self.assertEquals('hello', match['controller'])
+        self.assertIn('route', environ[timing.ENVIRON_KEY].stages)
+
+
+class TestServerTimingMiddleware(TestCase):
+    """
+    Test for the ServerTimingMiddleware class.
+    """
+
+    def test_server_timing(self):
+        """
+        Verify ServerTimingMiddleware adds the Server-Timing header.
+        """
+        middleware = timing.ServerTimingMiddleware(
+            timing.TimedStage('handler', bus_wsgi_app))
+        start_response = FakeStartResponse()
+        environ = create_environ()
+        environ['REQUEST_METHOD'] = 'GET'
+        self.assertEquals([b'{}'], middleware(environ, start_response))
+        self.assertEquals('200 OK', start_response.code)
+        headers = dict(start_response.headers)
+        self.assertEquals('application/json', headers['content-type'])
+        self.assertRegex(
+            headers['Server-Timing'],
+            r'^bus;dur=500\.000, handler;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_server_timing_stream(self):
+        """
+        Verify ServerTimingMiddleware logs streamed bodies once closed,
+        including the time spent producing them.
+        """
+        def app(environ, start_response):
+            start_response('200 OK', [])
+            return iter([b'a', b'b'])
+
+        middleware = timing.ServerTimingMiddleware(
+            timing.TimedStage('handler', app))
+        environ = create_environ()
+        environ['REQUEST_METHOD'] = 'GET'
+        with mock.patch.object(middleware.logger, 'info') as info:
+            body = middleware(environ, FakeStartResponse())
+            self.assertFalse(info.called)
+            self.assertEquals([b'a', b'b'], list(body))
+            body.close()
+            info.assert_called_once_with(
+                mock.ANY, 'GET', '/', '200', '-', mock.ANY)
@@ -16,6 +16,8 @@
 Test cases for the commissaire_http.util.cli module.
 """
 
+import argparse
+
 from . import TestCase
 
 from commissaire_http.util import cli
@@ -49,3 +51,25 @@ class Test_parse_to_struct(TestCase):
         self.assertEquals(
             {'someclass': {'k': 'v'}},
             cli.parse_to_struct('someclass:k=v,IDONOTBELONG'))
+
+
+class Test_parse_rate_limit(TestCase):
+    """
+    Tests for the parse_rate_limit function
+    """
+
+    def test_parse_rate_limit(self):
+        """
+        Verify parse_rate_limit creates the configuration file structure.
+        """
+        self.assertEquals(
+            {'key': 'user', 'rate': '5', 'path': '/api/v0/host/'},
+            cli.parse_rate_limit('user:rate=5,path=/api/v0/host/'))
+
+    def test_parse_rate_limit_invalid(self):
+        """
+        Verify parse_rate_limit explains invalid rate limits.
+        """
+        for inp in ('user', 'user:', 'user:burst=5', 'user:rate=1:x'):
+            self.assertRaises(
+                argparse.ArgumentTypeError, cli.parse_rate_limit, inp)
@@ -0,0 +1,122 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Test for commissaire_http.util.logs
+"""
+
+import io
+import logging
+import queue
+import threading
+
+from . import TestCase, mock
+
+from commissaire_http.util.logs import BufferedLogHandler, configure_logging
+
+
+class TestBufferedLogHandler(TestCase):
+    """
+    Test for the BufferedLogHandler class.
+    """
+
+    def test_write_records(self):
+        """
+        Verify BufferedLogHandler writes records from its writer thread.
+        """
+        stream = io.StringIO()
+        stream_handler = logging.StreamHandler(stream)
+        stream_handler.setLevel(logging.INFO)
+        handler = BufferedLogHandler([stream_handler], batch_size=2)
+        logger = logging.Logger('test')
+        logger.addHandler(handler)
+        for i in range(5):
+            logger.info('record %s', i)
+        logger.debug('not written')
+        handler.close()
+        self.assertEquals(
+            ''.join('record {}\n'.format(i) for i in range(5)),
+            stream.getvalue())
+        self.assertFalse(handler._writer.is_alive())
+
+    def test_format_on_writer_thread(self):
+        """
+        Verify records are formatted once, by the writer thread.
+        """
+        threads = []
+        format_record = logging.Formatter.format
+
+        def format(formatter, record):
+            threads.append(threading.current_thread().name)
+            return format_record(formatter, record)
+
+        stream = io.StringIO()
+        stream_handler = logging.StreamHandler(stream)
+        stream_handler.setFormatter(
+            logging.Formatter('%(levelname)s %(message)s'))
+        handler = BufferedLogHandler([stream_handler])
+        logger = logging.Logger('test')
+        logger.addHandler(handler)
+        args = {'key': 'value'}
+        with mock.patch.object(logging.Formatter, 'format', format):
+            logger.info('record %s', args)
+            args['key'] = 'changed'
+            try:
+                raise ValueError('failed')
+            except ValueError:
+                logger.exception('error')
+            handler.close()
+        self.assertEquals(['BufferedLogHandler'] * 2, threads)
+        lines = stream.getvalue().splitlines()
+        self.assertEquals("INFO record {'key': 'value'}", lines[0])
+        self.assertEquals('ERROR error', lines[1])
+        self.assertEquals('ValueError: failed', lines[-1])
+
+    def test_enqueue_when_full(self):
+        """
+        Verify BufferedLogHandler drops records instead of waiting.
+        """
+        handler = BufferedLogHandler([], queue_size=1)
+        with mock.patch.object(handler.queue, 'put_nowait') as _put:
+            _put.side_effect = queue.Full
+            handler.emit(logging.makeLogRecord({'msg': 'dropped'}))
+        self.assertEquals(1, handler.dropped)
+        handler.close()
+
+
+class TestConfigureLogging(TestCase):
+    """
+    Test for the configure_logging function.
+    """
+
+    def test_configure_logging(self):
+        """
+        Verify configure_logging replaces the handlers of the root logger.
+        """
+        root = logging.getLogger()
+        original = (root.handlers[:], root.level)
+        try:
+            handler = configure_logging(debug=True)
+            self.assertIsInstance(handler, logging.StreamHandler)
+            self.assertEquals(logging.DEBUG, root.level)
+
+            buffered = configure_logging(queue_size=10)
+            self.assertIsInstance(buffered, BufferedLogHandler)
+            self.assertEquals([buffered], root.handlers)
+            self.assertEquals(logging.INFO, root.level)
+            root.removeHandler(buffered)
+            buffered.close()
+        finally:
+            root.handlers[:] = original[0]
+            root.setLevel(original[1])
@@ -0,0 +1,158 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Test for commissaire_http.util.sockets module.
+"""
+
+import os
+import socket
+import tempfile
+
+from . import TestCase, mock
+
+from commissaire_http.util import sockets
+
+
+class Test_create_unix_socket(TestCase):
+    """
+    Test for the create_unix_socket function.
+    """
+
+    def setUp(self):
+        """
+        Set up a temporary directory for socket files.
+        """
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'commissaire.sock')
+
+    def tearDown(self):
+        """
+        Remove the temporary directory.
+        """
+        self.tmpdir.cleanup()
+
+    def test_create_unix_socket(self):
+        """
+        Verify create_unix_socket returns a listening Unix domain socket.
+        """
+        sock = sockets.create_unix_socket(self.path, 5)
+        try:
+            self.assertEquals(socket.AF_UNIX, sock.family)
+            self.assertEquals(self.path, sock.getsockname())
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(self.path)
+            client.close()
+        finally:
+            sock.close()
+
+    def test_create_unix_socket_replaces_stale_socket(self):
+        """
+        Verify create_unix_socket replaces a socket file left behind.
+        """
+        stale = sockets.create_unix_socket(self.path, 5)
+        stale.close()
+        self.assertTrue(os.path.exists(self.path))
+        sock = sockets.create_unix_socket(self.path, 5)
+        sock.close()
+
+    def test_create_unix_socket_keeps_other_files(self):
+        """
+        Verify create_unix_socket does not remove a file which is not a socket.
+        """
+        with open(self.path, 'w') as f:
+            f.write('data')
+        self.assertRaises(
+            OSError, sockets.create_unix_socket, self.path, 5)
+        with open(self.path) as f:
+            self.assertEquals('data', f.read())
+
+
+class Test_socket_from_fd(TestCase):
+    """
+    Test for the socket_from_fd function.
+    """
+
+    def test_socket_from_fd_inet(self):
+        """
+        Verify socket_from_fd detects an IPv4 socket.
+        """
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        try:
+            sock = sockets.socket_from_fd(os.dup(listener.fileno()))
+            self.assertEquals(socket.AF_INET, sock.family)
+            self.assertEquals(listener.getsockname(), sock.getsockname())
+            sock.close()
+        finally:
+            listener.close()
+
+    def test_socket_from_fd_unix(self):
+        """
+        Verify socket_from_fd detects a Unix domain socket.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'commissaire.sock')
+            listener = sockets.create_unix_socket(path, 5)
+            try:
+                sock = sockets.socket_from_fd(os.dup(listener.fileno()))
+                self.assertEquals(socket.AF_UNIX, sock.family)
+                self.assertEquals(path, sock.getsockname())
+                sock.close()
+            finally:
+                listener.close()
+
+
+class Test_get_systemd_sockets(TestCase):
+    """
+    Test for the get_systemd_sockets function.
+    """
+
+    def test_get_systemd_sockets(self):
+        """
+        Verify get_systemd_sockets returns the passed sockets.
+        """
+        environ = {
+            'LISTEN_PID': str(os.getpid()),
+            'LISTEN_FDS': '2',
+            'LISTEN_FDNAMES': 'http:https',
+        }
+        with mock.patch.object(
+                sockets, 'socket_from_fd', side_effect=lambda fd: fd):
+            self.assertEquals([3, 4], sockets.get_systemd_sockets(environ))
+        self.assertEquals({}, environ)
+
+    def test_get_systemd_sockets_other_process(self):
+        """
+        Verify get_systemd_sockets ignores sockets passed to another process.
+        """
+        environ = {'LISTEN_PID': str(os.getpid() + 1), 'LISTEN_FDS': '1'}
+        with mock.patch.object(sockets, 'socket_from_fd') as _from_fd:
+            self.assertEquals([], sockets.get_systemd_sockets(environ))
+            self.assertEquals(0, _from_fd.call_count)
+        self.assertEquals({}, environ)
+
+    def test_get_systemd_sockets_not_activated(self):
+        """
+        Verify get_systemd_sockets returns nothing without socket activation.
+        """
+        self.assertEquals([], sockets.get_systemd_sockets({}))
+
+    def test_get_systemd_sockets_invalid(self):
+        """
+        Verify get_systemd_sockets ignores invalid variables.
+        """
+        environ = {'LISTEN_PID': 'nope', 'LISTEN_FDS': '1'}
+        self.assertEquals([], sockets.get_systemd_sockets(environ))
+        self.assertEquals({}, environ)
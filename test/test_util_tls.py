@@ -0,0 +1,123 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Test for commissaire_http.util.tls
+"""
+
+import socket
+import ssl
+import threading
+
+from wsgiref.simple_server import make_server
+
+from . import TestCase, get_fixture_file_path
+
+from commissaire_http import CommissaireRequestHandler, ThreadedWSGIServer
+from commissaire_http.util.tls import (
+    TLSContext, create_ssl_context, get_common_name)
+
+PEM_FILE = get_fixture_file_path('test/server.pem')
+
+
+def dummy_wsgi_app(environ, start_response):
+    start_response('200 OK', [('content-type', 'text/plain')])
+    return [bytes('hi', 'utf8')]
+
+
+class TestGetCommonName(TestCase):
+    """
+    Test for the get_common_name function.
+    """
+
+    def test_get_common_name(self):
+        """
+        Verify get_common_name returns the first commonName or None.
+        """
+        cert = {'subject': (
+            (('organizationName', 'system:master'),),
+            (('commonName', 'first'),),
+            (('commonName', 'second'),))}
+        self.assertEquals('first', get_common_name(cert))
+        self.assertIsNone(get_common_name({'subject': ()}))
+        self.assertIsNone(get_common_name({}))
+        self.assertIsNone(get_common_name(None))
+
+
+class TestTLSContext(TestCase):
+    """
+    Test for the TLSContext class.
+    """
+
+    def test_create_ssl_context(self):
+        """
+        Verify create_ssl_context refuses anything older than TLSv1.2.
+        """
+        context = create_ssl_context(PEM_FILE)
+        self.assertEquals(ssl.TLSVersion.TLSv1_2, context.minimum_version)
+        self.assertEquals(ssl.CERT_NONE, context.verify_mode)
+
+    def test_ticket_key_rotation(self):
+        """
+        Verify the context is replaced once the ticket keys expire.
+        """
+        tls_context = TLSContext(PEM_FILE, ticket_key_lifetime=60)
+        context = tls_context.context
+        self.assertIs(context, tls_context.context)
+        tls_context._created -= 61
+        self.assertIsNot(context, tls_context.context)
+
+    def test_record_handshake_without_session_reused(self):
+        """
+        Verify handshakes are counted on interpreters which do not tell if
+        a session was reused.
+        """
+        tls_context = TLSContext(PEM_FILE)
+        tls_context.record_handshake(object())
+        self.assertEquals(
+            {'handshakes': 1, 'resumed': 0}, tls_context.stats())
+
+    def test_session_resumption(self):
+        """
+        Verify resumed sessions are counted by the server.
+        """
+        httpd = make_server(
+            '127.0.0.1', 0, dummy_wsgi_app,
+            server_class=ThreadedWSGIServer,
+            handler_class=CommissaireRequestHandler)
+        httpd.tls_context = TLSContext(PEM_FILE)
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.start()
+        try:
+            client_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            client_context.check_hostname = False
+            client_context.verify_mode = ssl.CERT_NONE
+            client_context.maximum_version = ssl.TLSVersion.TLSv1_2
+            session = None
+            for _ in range(2):
+                sock = client_context.wrap_socket(
+                    socket.create_connection(
+                        ('127.0.0.1', httpd.server_port)),
+                    session=session)
+                sock.sendall(
+                    b'GET / HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n')
+                self.assertIn(b'200 OK', sock.recv(1024))
+                session = sock.session
+                sock.close()
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            thread.join()
+        self.assertEquals(
+            {'handshakes': 2, 'resumed': 1}, httpd.tls_context.stats())
@@ -16,7 +16,7 @@
 Test cases for the commissaire_http.util.wsgi module.
 """
 
-from . import TestCase
+from . import TestCase, mock
 
 from commissaire_http.util import wsgi
 
@@ -65,3 +65,39 @@ class Test_AuthenticationManager(TestCase):
         self.assertEquals(
             test_args[-1][1],
             self.fake_start_response.headers)
+
+
+class TestClosingIterator(TestCase):
+    """
+    Tests for the ClosingIterator class and close_when_done function.
+    """
+
+    def test_closing_iterator(self):
+        """
+        Verify ClosingIterator closes the body and calls back only once.
+        """
+        body = mock.MagicMock()
+        body.__iter__.return_value = iter([b'a', b'b'])
+        callback = mock.MagicMock()
+        iterator = wsgi.ClosingIterator(body, callback)
+        self.assertEquals([b'a', b'b'], list(iterator))
+        self.assertFalse(callback.called)
+        iterator.close()
+        iterator.close()
+        body.close.assert_called_once_with()
+        callback.assert_called_once_with()
+
+    def test_close_when_done(self):
+        """
+        Verify close_when_done calls back right away unless the body is an
+        iterator.
+        """
+        callback = mock.MagicMock()
+        self.assertEquals([b'a'], wsgi.close_when_done([b'a'], callback))
+        callback.assert_called_once_with()
+        callback.reset_mock()
+        body = wsgi.close_when_done(iter([b'a']), callback)
+        self.assertEquals([b'a'], list(body))
+        self.assertFalse(callback.called)
+        body.close()
+        callback.assert_called_once_with()
@@ -0,0 +1,532 @@
+# Copyright (C) 2016  Red Hat, Inc
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Test for the WSGI server classes in commissaire_http.
+"""
+
+import os
+import queue
+import socket
+import tempfile
+import threading
+import time
+
+from io import BytesIO
+from http.client import HTTPConnection
+from unittest import mock
+from wsgiref.simple_server import make_server
+
+from routes import Mapper
+
+from . import TestCase, UnixHTTPConnection
+
+from commissaire_http import (
+    CommissaireHttpServer, CommissaireRequestHandler, DeadlineReader,
+    PooledWSGIServer, RequestBody, ThreadedWSGIServer)
+from commissaire_http.util.sockets import create_unix_socket
+
+
+def dummy_wsgi_app(environ, start_response):
+    start_response('200 OK', [('content-type', 'text/plain')])
+    if environ['PATH_INFO'] == '/echo':
+        return [environ['wsgi.input'].read()]
+    if environ['PATH_INFO'] == '/stream':
+        return (bytes(part, 'utf8') for part in ('h', 'i'))
+    return [bytes('hi', 'utf8')]
+
+
+class TestPooledWSGIServer(TestCase):
+    """
+    Test for the PooledWSGIServer class.
+    """
+
+    def setUp(self):
+        """
+        Starts a server on an ephemeral port for each test.
+        """
+        self.httpd = make_server(
+            '127.0.0.1', 0, dummy_wsgi_app,
+            server_class=PooledWSGIServer,
+            handler_class=CommissaireRequestHandler)
+        self.httpd.max_threads = 2
+        self.httpd.start_pool()
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        """
+        Stops the server after each test.
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def request(self):
+        """
+        Sends a GET request and returns the response.
+        """
+        conn = HTTPConnection('127.0.0.1', self.httpd.server_port)
+        conn.request('GET', '/')
+        return conn.getresponse()
+
+    def test_pool_serves_requests(self):
+        """
+        Verify requests are handled by the pool threads.
+        """
+        self.assertEquals(2, len(self.httpd._pool))
+        for _ in range(4):
+            response = self.request()
+            self.assertEquals(200, response.status)
+            self.assertEquals(b'hi', response.read())
+
+    def test_idle_connections_free_threads(self):
+        """
+        Verify idle persistent connections give up their thread when more
+        clients than threads are connected.
+        """
+        idle = []
+        for _ in range(2):
+            conn = HTTPConnection('127.0.0.1', self.httpd.server_port)
+            conn.request('GET', '/')
+            self.assertEquals(b'hi', conn.getresponse().read())
+            idle.append(conn)
+        # Both threads are waiting for a next request by now
+        time.sleep(0.3)
+        started = time.monotonic()
+        response = self.request()
+        self.assertEquals(b'hi', response.read())
+        self.assertLess(time.monotonic() - started, 2)
+        for conn in idle:
+            conn.close()
+
+    def test_pipelined_requests(self):
+        """
+        Verify a request received with the previous one is served.
+        """
+        client = socket.create_connection(
+            ('127.0.0.1', self.httpd.server_port), timeout=5)
+        client.sendall(
+            b'GET / HTTP/1.1\r\n\r\nGET / HTTP/1.1\r\n'
+            b'Connection: close\r\n\r\n')
+        response = b''
+        while True:
+            chunk = client.recv(4096)
+            if not chunk:
+                break
+            response += chunk
+        client.close()
+        self.assertEquals(2, response.count(b'HTTP/1.1 200 OK'))
+
+    def test_full_queue_rejects(self):
+        """
+        Verify connections are answered with a 503 when the queue is full.
+        """
+        with mock.patch.object(
+                self.httpd._pending, 'put_nowait', side_effect=queue.Full):
+            response = self.request()
+        self.assertEquals(503, response.status)
+        self.assertEquals('1', response.getheader('Retry-After'))
+
+
+class TestCommissaireRequestHandler(TestCase):
+    """
+    Test for persistent connections in the CommissaireRequestHandler class.
+    """
+
+    def setUp(self):
+        """
+        Starts a server on an ephemeral port for each test.
+        """
+        self.httpd = make_server(
+            '127.0.0.1', 0, dummy_wsgi_app,
+            server_class=ThreadedWSGIServer,
+            handler_class=CommissaireRequestHandler)
+        self.httpd.keep_alive_requests = 3
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.start()
+        self.conn = HTTPConnection('127.0.0.1', self.httpd.server_port)
+
+    def tearDown(self):
+        """
+        Stops the server after each test.
+        """
+        self.conn.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def test_keep_alive(self):
+        """
+        Verify connections are reused until keep_alive_requests is reached.
+        """
+        sockets = []
+        for i in range(3):
+            # An unread body must not break the next request
+            self.conn.request('PUT', '/', body=b'{"unread": true}')
+            response = self.conn.getresponse()
+            self.assertEquals(b'hi', response.read())
+            self.assertEquals('2', response.getheader('Content-Length'))
+            sockets.append(self.conn.sock)
+        self.assertIsNotNone(sockets[0])
+        self.assertIs(sockets[0], sockets[1])
+        self.assertEquals('close', response.getheader('Connection'))
+
+    def test_chunked(self):
+        """
+        Verify bodies of unknown length are chunked on a kept connection.
+        """
+        for path in ('/stream', '/'):
+            self.conn.request('GET', path)
+            response = self.conn.getresponse()
+            self.assertEquals(b'hi', response.read())
+        self.conn.request('GET', '/stream')
+        response = self.conn.getresponse()
+        self.assertEquals('chunked', response.getheader('Transfer-Encoding'))
+        self.assertIsNone(response.getheader('Content-Length'))
+        self.assertEquals(b'hi', response.read())
+
+    def test_access_log(self):
+        """
+        Verify finished requests are written to the access log.
+        """
+        with self.assertLogs('access', level='INFO') as logs:
+            # The first request is logged before the second is read
+            for path in ('/', '/second'):
+                self.conn.request('GET', path)
+                self.conn.getresponse().read()
+        self.assertRegex(
+            logs.output[0],
+            r'remote=127\.0\.0\.1 method=GET path=/ status=200 size=2 '
+            r'duration_ms=[\d.]+$')
+
+    def test_http_10_closes(self):
+        """
+        Verify HTTP/1.0 requests without keep-alive close the connection.
+        """
+        self.conn._http_vsn = 10
+        self.conn._http_vsn_str = 'HTTP/1.0'
+        self.conn.request('GET', '/')
+        response = self.conn.getresponse()
+        self.assertEquals('close', response.getheader('Connection'))
+
+
+class TestRequestLimits(TestCase):
+    """
+    Test for the request body limits and read deadlines of the
+    CommissaireRequestHandler class.
+    """
+
+    def setUp(self):
+        """
+        Starts a server with short deadlines for each test.
+        """
+        self.httpd = make_server(
+            '127.0.0.1', 0, dummy_wsgi_app,
+            server_class=ThreadedWSGIServer,
+            handler_class=CommissaireRequestHandler)
+        self.httpd.max_body_size = 16
+        self.httpd.header_timeout = 0.3
+        self.httpd.body_timeout = 0.3
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.start()
+        self.client = socket.create_connection(
+            ('127.0.0.1', self.httpd.server_port), timeout=5)
+
+    def tearDown(self):
+        """
+        Stops the server after each test.
+        """
+        self.client.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def read_all(self):
+        """
+        Reads from the client until the server closes the connection.
+        """
+        data = b''
+        while True:
+            chunk = self.client.recv(4096)
+            if not chunk:
+                return data
+            data += chunk
+
+    def test_body_within_limit(self):
+        """
+        Verify bodies within the limit are passed to the app.
+        """
+        self.client.sendall(
+            b'PUT /echo HTTP/1.1\r\nContent-Length: 5\r\n'
+            b'Connection: close\r\n\r\nhello')
+        response = self.read_all()
+        self.assertTrue(response.startswith(b'HTTP/1.1 200 '))
+        self.assertTrue(response.endswith(b'\r\n\r\nhello'))
+
+    def test_body_too_large(self):
+        """
+        Verify bodies over the limit are answered with a 413 before the
+        body is sent.
+        """
+        self.client.sendall(
+            b'PUT /echo HTTP/1.1\r\nContent-Length: 1000000\r\n\r\n')
+        response = self.read_all()
+        self.assertTrue(response.startswith(b'HTTP/1.1 413 '))
+
+    def test_expect_continue(self):
+        """
+        Verify clients expecting 100 Continue are only invited to send
+        bodies within the limit.
+        """
+        self.client.sendall(
+            b'PUT /echo HTTP/1.1\r\nContent-Length: 1000000\r\n'
+            b'Expect: 100-continue\r\n\r\n')
+        response = self.read_all()
+        self.assertTrue(response.startswith(b'HTTP/1.1 413 '))
+        self.assertIn(b'Connection: close', response)
+        self.assertNotIn(b'100 Continue', response)
+
+        self.client = socket.create_connection(
+            ('127.0.0.1', self.httpd.server_port), timeout=5)
+        self.client.sendall(
+            b'PUT /echo HTTP/1.1\r\nContent-Length: 5\r\n'
+            b'Expect: 100-continue\r\nConnection: close\r\n\r\n')
+        self.assertEquals(
+            b'HTTP/1.1 100 Continue\r\n\r\n', self.client.recv(4096))
+        self.client.sendall(b'hello')
+        response = self.read_all()
+        self.assertTrue(response.startswith(b'HTTP/1.1 200 '))
+        self.assertTrue(response.endswith(b'\r\n\r\nhello'))
+
+    def test_transfer_encoding(self):
+        """
+        Verify bodies sent with a Transfer-Encoding are refused and the
+        connection closed instead of reading the body as a request.
+        """
+        self.client.sendall(
+            b'PUT /echo HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+            b'5\r\nhello\r\n0\r\n\r\n')
+        response = self.read_all()
+        self.assertTrue(response.startswith(b'HTTP/1.1 501 '))
+        self.assertIn(b'Connection: close', response)
+        self.assertEquals(1, response.count(b'HTTP/1.1'))
+
+    def test_content_length_and_transfer_encoding(self):
+        """
+        Verify requests framed by both Content-Length and
+        Transfer-Encoding are answered with a 400.
+        """
+        self.client.sendall(
+            b'PUT /echo HTTP/1.1\r\nContent-Length: 3\r\n'
+            b'Transfer-Encoding: chunked\r\n\r\n'
+            b'5\r\nhello\r\n0\r\n\r\nGET / HTTP/1.1\r\n\r\n')
+        response = self.read_all()
+        self.assertTrue(response.startswith(b'HTTP/1.1 400 '))
+        self.assertIn(b'Connection: close', response)
+        self.assertEquals(1, response.count(b'HTTP/1.1'))
+
+    def test_header_deadline(self):
+        """
+        Verify a client sending headers a byte at a time is answered with
+        a 408 once the header deadline passed.
+        """
+        started = time.monotonic()
+        self.client.sendall(b'GET / HTTP/1.1\r\n')
+        response = b''
+        for byte in b'X-Slow: ' + b'a' * 100:
+            try:
+                self.client.sendall(bytes((byte,)))
+            except OSError:
+                break
+            time.sleep(0.05)
+            self.client.setblocking(False)
+            try:
+                response = self.client.recv(4096)
+            except BlockingIOError:
+                pass
+            finally:
+                self.client.setblocking(True)
+            if response:
+                break
+        self.assertTrue(response.startswith(b'HTTP/1.1 408 '))
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_idle_connection_closed(self):
+        """
+        Verify a connection which never sends a request is closed.
+        """
+        started = time.monotonic()
+        self.assertEquals(b'', self.read_all())
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_body_deadline(self):
+        """
+        Verify a short body is passed to the app and the connection is
+        closed once the body deadline passed.
+        """
+        self.client.sendall(
+            b'PUT /echo HTTP/1.1\r\nContent-Length: 10\r\n\r\nhel')
+        response = self.read_all()
+        self.assertTrue(response.startswith(b'HTTP/1.1 200 '))
+        self.assertIn(b'Connection: close', response)
+        self.assertTrue(response.endswith(b'\r\n\r\nhel'))
+
+
+class TestCommissaireHttpServerUnixSocket(TestCase):
+    """
+    Test for serving the CommissaireHttpServer on a Unix domain socket.
+    """
+
+    def test_listen_socket(self):
+        """
+        Verify requests are served on a passed Unix domain socket.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'commissaire.sock')
+            dispatcher = mock.MagicMock(
+                dispatch=dummy_wsgi_app, router=Mapper())
+            server = CommissaireHttpServer(
+                None, None, dispatcher,
+                listen_socket=create_unix_socket(path, 5))
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            conn = UnixHTTPConnection(path)
+            with self.assertLogs('access', level='INFO') as logs:
+                conn.request('GET', '/')
+                response = conn.getresponse()
+                self.assertEquals(b'hi', response.read())
+                conn.close()
+                server.stop()
+                thread.join(5)
+            self.assertFalse(thread.is_alive())
+            self.assertIn('remote=unix ', logs.output[0])
+
+
+class TestCommissaireHttpServerDrain(TestCase):
+    """
+    Test for graceful shut down of the CommissaireHttpServer class.
+    """
+
+    def test_stop_drains_requests(self):
+        """
+        Verify stop lets in-flight requests finish before serve_forever
+        returns.
+        """
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_wsgi_app(environ, start_response):
+            started.set()
+            release.wait(5)
+            return dummy_wsgi_app(environ, start_response)
+
+        dispatcher = mock.MagicMock(dispatch=slow_wsgi_app, router=Mapper())
+        server = CommissaireHttpServer(
+            '127.0.0.1', 0, dispatcher, drain_timeout=5)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        conn = HTTPConnection('127.0.0.1', server._httpd.server_port)
+        conn.request('GET', '/')
+        self.assertTrue(started.wait(5))
+        server.stop()
+        thread.join(0.5)
+        # Still waiting for the in-flight request
+        self.assertTrue(thread.is_alive())
+
+        release.set()
+        response = conn.getresponse()
+        self.assertEquals(b'hi', response.read())
+        self.assertEquals('close', response.getheader('Connection'))
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        conn.close()
+
+
+class TestRequestBody(TestCase):
+    """
+    Test for the RequestBody class.
+    """
+
+    def test_read_stops_at_body(self):
+        """
+        Verify RequestBody never reads past the body.
+        """
+        body = RequestBody(BytesIO(b'body' + b'GET / HTTP/1.1'), 4)
+        self.assertEquals(b'body', body.read())
+        self.assertEquals(b'', body.read())
+
+    def test_drain(self):
+        """
+        Verify RequestBody.drain only discards up to the limit.
+        """
+        self.assertTrue(RequestBody(BytesIO(b'body'), 4).drain(4))
+        self.assertFalse(RequestBody(BytesIO(b'body'), 4).drain(2))
+
+    def test_read_timed_out(self):
+        """
+        Verify RequestBody stops reading once the connection timed out.
+        """
+        rfile = mock.MagicMock(read1=mock.MagicMock(side_effect=socket.timeout))
+        body = RequestBody(rfile, 4)
+        self.assertEquals(b'', body.read())
+        self.assertTrue(body.timed_out)
+        self.assertFalse(body.drain(4))
+
+
+class TestDeadlineReader(TestCase):
+    """
+    Test for the DeadlineReader class.
+    """
+
+    def setUp(self):
+        """
+        Creates a connected pair of sockets for each test.
+        """
+        self.sock, self.peer = socket.socketpair()
+        self.reader = DeadlineReader(self.sock, 5)
+        self.sock.settimeout(5)
+
+    def tearDown(self):
+        """
+        Closes the sockets after each test.
+        """
+        self.sock.close()
+        self.peer.close()
+
+    def test_read_without_deadline(self):
+        """
+        Verify reads without a deadline use the idle timeout.
+        """
+        self.peer.sendall(b'data')
+        self.assertEquals(b'data', self.reader.read(4))
+        self.assertEquals(5, self.sock.gettimeout())
+
+    def test_read_after_deadline(self):
+        """
+        Verify reads fail once the deadline passed even if data arrives.
+        """
+        self.peer.sendall(b'data')
+        self.reader.deadline = time.monotonic() - 1
+        self.assertRaises(socket.timeout, self.reader.read, 4)
+
+    def test_read_until_deadline(self):
+        """
+        Verify a read waits at most until the deadline and the idle timeout
+        is restored afterwards.
+        """
+        self.reader.deadline = time.monotonic() + 0.1
+        self.assertRaises(socket.timeout, self.reader.read, 4)
+        self.assertEquals(5, self.sock.gettimeout())